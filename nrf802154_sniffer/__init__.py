@@ -34,4 +34,4 @@
 # LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from .nrf802154_sniffer import Nrf802154Sniffer
+from .nrf802154_sniffer import CapturedPacket, Nrf802154Sniffer, SnifferConfig
@@ -0,0 +1,422 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Single-process capture engine. Instead of reader processes and a queue, an
+asyncio event loop watches the serial ports and control fifos of any number
+of captures through non-blocking file descriptors. Parsed frames go to the
+outputs of each capture through its own output thread, since fifos and
+files block; the loop stops reading a device while its output is behind.
+POSIX only.
+
+AsyncNrf802154Sniffer has the same start_threaded/stop_thread interface as
+Nrf802154Sniffer, with all threaded captures of the process sharing one
+event loop thread, and an async capture() entry point for use in an
+application's own event loop.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+
+from serial import Serial
+
+try:
+    from .nrf802154_sniffer import LineParser, Nrf802154Sniffer, PacketBatch, RetuneConfirmation
+except ImportError:
+    from nrf802154_sniffer import LineParser, Nrf802154Sniffer, PacketBatch, RetuneConfirmation
+
+
+class EventLoopThread:
+    """
+    Event loop running in a daemon thread, started on first use and shared
+    by all threaded captures of the process.
+    """
+
+    _lock = threading.Lock()
+    _loop = None
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name="nrf802154-capture", daemon=True).start()
+            return cls._loop
+
+
+class AsyncNrf802154Sniffer(Nrf802154Sniffer):
+    """
+    Nrf802154Sniffer running its captures on an asyncio event loop.
+    Flow control, the shared memory transport and metrics only apply to
+    the multiprocess engine; flow control is turned off, and the other two
+    raise ValueError.
+    """
+
+    # Bytes taken from the serial port per read.
+    READ_SIZE = 64 * 1024
+    # Writes queued for the output thread at which the serial port stops
+    # being read, until half of them are done.
+    MAX_OUTPUT_BATCHES = 64
+
+    def __init__(self, connection_open_timeout=None, config=None, **options):
+        options.update(max_in_flight_frames=None, max_in_flight_bytes=None)
+        super().__init__(connection_open_timeout, config, **options)
+        if self.config.transport != self.TRANSPORT_QUEUE:
+            raise ValueError("The asyncio engine has no %s transport" % self.config.transport)
+        if self.config.metrics_enabled:
+            raise ValueError("The asyncio engine has no capture metrics")
+        self.loop = None
+        self.future = None
+        self.stopping = None
+        self.serial = None
+        self.pending = b""
+        self.writer = None
+        self.output = None
+        self.output_batches = 0
+        self.reading = False
+        self.flush_handle = None
+        self.hooks_handle = None
+        self.confirmation = RetuneConfirmation()
+        self.confirm_handle = None
+        # Channel requested before the serial port was open.
+        self.queued_channel = None
+        self.control_buffer = b""
+        self.exit_reason = ""
+        self.predicate = None
+
+    def start_threaded(self, fifo, dev, channel, metadata=None, control_in=None, control_out=None):
+        """
+        Starts the capture on the shared event loop thread, and returns
+        once the device is receiving. Raises what stopped the capture from
+        starting, such as DeviceError.
+        Use .stop_thread to end it.
+        """
+        loop = EventLoopThread.get_loop()
+        self.started = Future()
+        self.future = asyncio.run_coroutine_threadsafe(
+            self.capture(fifo, dev, channel, metadata, control_in, control_out), loop
+        )
+        wait((self.started, self.future), return_when=FIRST_COMPLETED)
+        if not self.started.done():
+            future, self.future = self.future, None
+            future.result()
+
+    def stop_thread(self):
+        """
+        Stops a capture started with .start_threaded and waits for its end.
+        Raises what ended the capture if it failed.
+        """
+        if self.future is None:
+            return
+        self.stop()
+        future, self.future = self.future, None
+        future.result()
+
+    def stop(self):
+        """
+        Ends the capture; safe to call from any thread.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.end_capture)
+
+    def end_capture(self, reason: str = ""):
+        """
+        Event loop side. Makes capture() return.
+        """
+        if self.stopping is not None and not self.stopping.is_set():
+            self.exit_reason = reason
+            self.stopping.set()
+
+    async def capture(self, fifo, dev, channel, metadata=None, control_in=None, control_out=None):
+        """
+        Captures in the running event loop until .stop is called, the
+        device is lost, Wireshark goes away or a survey completes.
+        In survey mode, the capture starts on the first surveyed channel.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.exit_reason = ""
+        self.queued_channel = None
+        self.channel = channel if self.survey is None else self.survey.channel
+        self.dev = dev
+        self.control_in = control_in
+        self.control_out = control_out
+        self.fifo = fifo
+        self.set_metadata(metadata)
+        self.predicate = self.packet_filter(self.config.capture_filter)
+        self.fcs_errors = [0]
+        self.clocks = {}
+
+        # Opening fifos blocks until the other end does, and the device
+        # handshake waits for the device; neither may stall other captures.
+        await self.loop.run_in_executor(None, self.configure_device, dev, self.channel)
+        if self.started is not None and not self.started.done():
+            self.started.set_result(None)
+        # The outputs are opened, written and closed in the output thread.
+        self.output = ThreadPoolExecutor(1, thread_name_prefix="nrf802154-output")
+        self.output_batches = 0
+        output = ExitStack()
+        with ExitStack() as stack:
+            try:
+                self.writer = await self.loop.run_in_executor(self.output, output.enter_context, self.open_output())
+                self.serial = stack.enter_context(Serial(dev, exclusive=True, timeout=0))
+                fd = self.serial.fileno()
+                os.set_blocking(fd, False)
+                self.resume_reading()
+                if self.queued_channel is not None:
+                    self.retune(self.queued_channel)
+
+                if control_out:
+                    self.control_out_fifo = await self.loop.run_in_executor(None, open, control_out, "wb", 0)
+                    stack.callback(self.control_out_fifo.close)
+                if control_in:
+                    control = await self.loop.run_in_executor(None, open, control_in, "rb", 0)
+                    stack.enter_context(control)
+                    os.set_blocking(control.fileno(), False)
+                    self.loop.add_reader(control.fileno(), self.read_control, control.fileno())
+                    stack.callback(self.loop.remove_reader, control.fileno())
+
+                self.hooks.start(self.writer)
+                self.schedule_hooks()
+                await self.stopping.wait()
+            except BrokenPipeError:
+                pass
+            finally:
+                self.pause_reading()
+                for handle in (self.flush_handle, self.hooks_handle, self.confirm_handle):
+                    if handle is not None:
+                        handle.cancel()
+                self.flush_handle = self.hooks_handle = self.confirm_handle = None
+                writer, self.writer = self.writer, None
+                # Queued writes run first, the output thread being FIFO.
+                await self.loop.run_in_executor(self.output, self.close_output, writer, output)
+                self.output.shutdown()
+                self.output = None
+                self.serial = None
+
+        if self.exit_reason:
+            self.logger.error(self.exit_reason)
+        await self.loop.run_in_executor(None, self._stop)
+        self.finish_capture()
+        self.control_out_fifo = None
+
+    def read_serial(self):
+        try:
+            chunk = os.read(self.serial.fileno(), self.READ_SIZE)
+            host_time = time.time_ns() // 1000
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self.end_capture(f"Sniffer device {self.dev} was disconnected.")
+            return
+
+        lines = (self.pending + chunk).split(b"\n")
+        self.pending = lines.pop()
+        if len(self.pending) > self.MAX_PENDING_LINE:
+            self.pending = b""
+        result = LineParser.parse_lines(lines, self.config.fcs_policy, self.keep_fcs)
+        self.fcs_errors[0] += result.bad_fcs
+        if self.confirmation.awaiting and result.ignored:
+            for reply in self.confirmation.check(lines):
+                self.handle_reply(reply)
+            if not self.confirmation.awaiting and self.confirm_handle is not None:
+                self.confirm_handle.cancel()
+                self.confirm_handle = None
+
+        packets = result.packets
+        if self.predicate is not None:
+            packets = [p for p in packets if self.predicate(p)]
+        if not packets:
+            return
+        channel = self.channel
+        convert = self.device_clock().convert
+        records = [(p.content, channel, p.rssi, p.lqi, convert(p.timestamp, host_time)) for p in packets]
+        self.submit_output(self.write_records, records)
+        self.hooks.add(PacketBatch(packets), channel)
+
+    def pause_reading(self):
+        if self.reading:
+            self.loop.remove_reader(self.serial.fileno())
+            self.reading = False
+
+    def resume_reading(self):
+        if not self.reading:
+            self.loop.add_reader(self.serial.fileno(), self.read_serial)
+            self.reading = True
+
+    def submit_output(self, function, *args):
+        """
+        Queues function(writer, *args) for the output thread. It returns
+        the writer's timeout(), after which the writer is polled.
+        """
+        self.output_batches += 1
+        future = self.loop.run_in_executor(self.output, function, self.writer, *args)
+        future.add_done_callback(self.output_done)
+        if self.output_batches >= self.MAX_OUTPUT_BATCHES:
+            self.pause_reading()
+
+    def output_done(self, future):
+        self.output_batches -= 1
+        if self.writer is None:
+            return
+        error = future.exception()
+        if isinstance(error, BrokenPipeError):
+            self.end_capture()
+            return
+        if error is not None:
+            self.end_capture("Cannot write the capture: %s" % error)
+            return
+        timeout = future.result()
+        if self.flush_handle is None and timeout is not None:
+            self.flush_handle = self.loop.call_later(timeout, self.poll_writer)
+        if self.output_batches <= self.MAX_OUTPUT_BATCHES // 2 and not self.stopping.is_set():
+            self.resume_reading()
+
+    def poll_writer(self):
+        self.flush_handle = None
+        if self.writer is not None:
+            self.submit_output(self.poll_output)
+
+    @staticmethod
+    def write_records(writer, records) -> float | None:
+        """
+        Output thread side. Writes the records of a batch.
+        """
+        write_packet = writer.write_packet
+        for record in records:
+            write_packet(*record)
+        return writer.timeout()
+
+    @staticmethod
+    def poll_output(writer) -> float | None:
+        writer.poll()
+        return writer.timeout()
+
+    @staticmethod
+    def close_output(writer, output: ExitStack):
+        """
+        Output thread side. Flushes what the writer holds and closes the
+        outputs.
+        """
+        with output:
+            if writer is not None:
+                try:
+                    writer.flush()
+                except BrokenPipeError:
+                    pass
+
+    def read_control(self, fd: int):
+        try:
+            data = os.read(fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.end_capture("Wireshark connection lost.")
+            return
+        self.control_buffer += data
+        header = self.CTRL_HEADER.size
+        while len(self.control_buffer) >= header:
+            _, length_high, length_low, _, _ = self.CTRL_HEADER.unpack_from(self.control_buffer)
+            size = header + (length_high << 16 | length_low) - 2
+            if len(self.control_buffer) < size:
+                break
+            message, self.control_buffer = self.control_buffer[:size], self.control_buffer[size:]
+            try:
+                self.handle_control(self.parse_control(message))
+            except ValueError:
+                self.end_capture("Wireshark connection lost.")
+                return
+
+    def schedule_hooks(self):
+        timeout = self.hooks.timeout()
+        if timeout is not None:
+            self.hooks_handle = self.loop.call_later(timeout, self.run_hooks)
+
+    def run_hooks(self):
+        self.hooks_handle = None
+        self.hooks.poll(self.writer)
+        if not self.stopping.is_set():
+            self.schedule_hooks()
+
+    def set_channel(self, channel: int, source: int = 0):
+        """
+        Retunes the running capture; safe to call from any thread.
+        """
+        if channel not in self.CHANNELS:
+            raise ValueError("Invalid channel: %s" % channel)
+        if self.loop is None or self.stopping.is_set():
+            raise RuntimeError("No capture is running")
+        self.loop.call_soon_threadsafe(self.retune, channel)
+
+    def retune(self, channel: int):
+        """
+        Event loop side. Sends the channel command; frames read from then
+        on are recorded on the new channel.
+        """
+        if self.serial is None:
+            self.queued_channel = channel
+            return
+        self.queued_channel = None
+        try:
+            os.write(self.serial.fileno(), b"channel %d\r\n" % channel)
+        except OSError:
+            self.end_capture(f"Sniffer device {self.dev} was disconnected.")
+            return
+        self.confirmation.sent(channel, self.channel)
+        self.channel = channel
+        self.schedule_confirmation()
+
+    def schedule_confirmation(self):
+        if self.confirm_handle is not None:
+            self.confirm_handle.cancel()
+        delay = max(0.0, self.confirmation.deadline - time.monotonic())
+        self.confirm_handle = self.loop.call_later(delay, self.confirm_expired)
+
+    def confirm_expired(self):
+        self.confirm_handle = None
+        self.confirmation.expire()
+        if self.confirmation.awaiting:
+            # The loop may run a timer slightly ahead of the deadline.
+            self.schedule_confirmation()
@@ -0,0 +1,396 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compressed capture archive with a time and address index.
+
+Frames are stored in independently compressed chunks appended to a data
+file. A sidecar index, one JSON line per chunk, records where each chunk
+is, the time range and number of its frames, and which PAN IDs and
+addresses occur in it. Queries read the index, decompress only the
+chunks that can match, and filter their frames exactly.
+
+Export a time window as pcap with:
+python -m nrf802154_sniffer.archive export capture.nrfa out.pcap --start 2024-05-01T10:00 --end 2024-05-01T10:05
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from dataclasses import dataclass
+
+try:
+    from .ieee802154 import AddressMode, decode_addressing
+except ImportError:
+    from ieee802154 import AddressMode, decode_addressing
+
+INDEX_SUFFIX = ".idx"
+
+
+@dataclass
+class ChunkInfo:
+    offset: int
+    size: int
+    raw_size: int
+    start: int
+    end: int
+    frames: int
+    channels: list[int]
+    # None when a chunk has too many distinct values to list; such chunks
+    # are always read by address queries.
+    pans: list[int] | None
+    short_addresses: list[int] | None
+    extended_addresses: list[int] | None
+    # Whether the frames end with their FCS. Missing from older indexes,
+    # whose frames never have it.
+    fcs: bool = False
+
+    def overlaps(self, start: int | None, end: int | None) -> bool:
+        return (start is None or self.end >= start) and (end is None or self.start <= end)
+
+    def may_contain(self, pan: int | None, address: tuple[int, int] | None) -> bool:
+        if pan is not None and self.pans is not None and pan not in self.pans:
+            return False
+        if address is not None:
+            mode, value = address
+            addresses = self.short_addresses if mode == AddressMode.SHORT else self.extended_addresses
+            if addresses is not None and value not in addresses:
+                return False
+        return True
+
+
+def frame_matches(frame: bytes, pan: int | None, address: tuple[int, int] | None) -> bool:
+    if pan is None and address is None:
+        return True
+    fields = decode_addressing(frame)
+    if fields is None:
+        return False
+    dst_pan, dst_mode, dst_addr, src_pan, src_mode, src_addr = fields
+    if pan is not None and pan not in (dst_pan, src_pan):
+        return False
+    if address is not None and address not in ((dst_mode, dst_addr), (src_mode, src_addr)):
+        return False
+    return True
+
+
+class ArchiveWriter:
+    """
+    Appends frames to an archive, with the same interface as PcapWriter.
+    A chunk is compressed and written once it holds chunk_frames frames or
+    its first frame is chunk_seconds old, so a crash loses at most the
+    frames of the open chunk. Existing archives are appended to.
+    With fcs set, frames end with their FCS and are stored with it, so a
+    bad one can still be flagged when exported; the index marks such
+    chunks.
+    """
+
+    # Frame record: timestamp in microseconds, channel, RSSI, LQI, length.
+    RECORD = struct.Struct("<qBbBB")
+    MAX_FRAME_LENGTH = 127
+    # Largest number of distinct PAN IDs or addresses listed per chunk.
+    MAX_SUMMARY = 256
+
+    def __init__(self, path, chunk_frames=16384, chunk_seconds=60.0, level=6, fcs=False):
+        self.path = path
+        self.fcs = fcs
+        self.chunk_frames = chunk_frames
+        self.chunk_seconds = chunk_seconds
+        self.level = level
+        self.data = open(path, "ab")
+        self.index = open(path + INDEX_SUFFIX, "a")
+        self.offset = self.data.seek(0, os.SEEK_END)
+        self.flush_count = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.chunk = bytearray()
+        self.frames = 0
+        self.start = self.end = None
+        self.deadline = None
+        self.channels = set()
+        self.pans = set()
+        self.short_addresses = set()
+        self.extended_addresses = set()
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        frame = frame[:self.MAX_FRAME_LENGTH]
+        self.chunk += self.RECORD.pack(timestamp, channel, rssi, lqi, len(frame))
+        self.chunk += frame
+        self.frames += 1
+        if self.start is None:
+            self.start = self.end = timestamp
+            self.deadline = time.monotonic() + self.chunk_seconds
+        else:
+            self.start = min(self.start, timestamp)
+            self.end = max(self.end, timestamp)
+        self.channels.add(channel)
+
+        fields = decode_addressing(frame)
+        if fields is not None:
+            dst_pan, dst_mode, dst_addr, src_pan, src_mode, src_addr = fields
+            self.pans.update(p for p in (dst_pan, src_pan) if p is not None)
+            for mode, value in ((dst_mode, dst_addr), (src_mode, src_addr)):
+                if mode == AddressMode.SHORT:
+                    self.short_addresses.add(value)
+                elif mode == AddressMode.EXTENDED:
+                    self.extended_addresses.add(value)
+
+        if self.frames >= self.chunk_frames:
+            self.write_chunk()
+
+    def summary(self, values: set) -> list[int] | None:
+        return sorted(values) if len(values) <= self.MAX_SUMMARY else None
+
+    def write_chunk(self) -> None:
+        if not self.frames:
+            return
+        compressed = zlib.compress(self.chunk, self.level)
+        self.data.write(compressed)
+        self.data.flush()
+        info = ChunkInfo(
+            offset=self.offset,
+            size=len(compressed),
+            raw_size=len(self.chunk),
+            start=self.start,
+            end=self.end,
+            frames=self.frames,
+            channels=sorted(self.channels),
+            pans=self.summary(self.pans),
+            short_addresses=self.summary(self.short_addresses),
+            extended_addresses=self.summary(self.extended_addresses),
+            fcs=self.fcs,
+        )
+        # The index line goes after the data, so an interrupted write
+        # leaves unindexed bytes rather than an entry without data.
+        self.index.write(json.dumps(info.__dict__, separators=(",", ":")) + "\n")
+        self.index.flush()
+        self.offset += len(compressed)
+        self.flush_count += 1
+        self.reset()
+
+    def timeout(self) -> float | None:
+        """
+        Returns how long the caller may wait before poll() has to be called,
+        or None if no chunk is open.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def poll(self) -> None:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.write_chunk()
+
+    def flush(self) -> None:
+        """
+        Chunks are only written when full or old enough; writing one for
+        every idle moment of the capture would defeat the compression.
+        """
+        self.poll()
+
+    def close(self) -> None:
+        self.write_chunk()
+        self.data.close()
+        self.index.close()
+
+
+class ArchiveReader:
+    """
+    Reads frames of an archive as (timestamp, channel, rssi, lqi, frame)
+    tuples, only decompressing the chunks a query can match.
+    """
+
+    RECORD = ArchiveWriter.RECORD
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + INDEX_SUFFIX) as f:
+            self.chunks = [ChunkInfo(**json.loads(line)) for line in f if line.strip()]
+
+    def select(self, start=None, end=None, pan=None, address=None) -> list[ChunkInfo]:
+        """
+        Returns the chunks that may hold frames matching the query.
+        :param start: first timestamp in microseconds, inclusive
+        :param end: last timestamp in microseconds, inclusive
+        :param address: (AddressMode, address) pair
+        """
+        return [c for c in self.chunks if c.overlaps(start, end) and c.may_contain(pan, address)]
+
+    def read_chunk(self, f, chunk: ChunkInfo):
+        f.seek(chunk.offset)
+        data = zlib.decompress(f.read(chunk.size))
+        offset = 0
+        while offset < len(data):
+            timestamp, channel, rssi, lqi, length = self.RECORD.unpack_from(data, offset)
+            offset += self.RECORD.size
+            yield timestamp, channel, rssi, lqi, data[offset:offset + length]
+            offset += length
+
+    def has_fcs(self) -> bool:
+        """
+        Returns whether every frame of the archive was stored with its FCS.
+        """
+        return all(c.fcs for c in self.chunks)
+
+    def packets(self, start=None, end=None, pan=None, address=None, fcs=False):
+        """
+        Yields the frames matching the query, in archive order.
+        :param fcs: yield frames with their FCS, which every selected chunk
+                    must have been stored with
+        """
+        chunks = self.select(start, end, pan, address)
+        if fcs and not all(c.fcs for c in chunks):
+            raise ValueError("%s holds frames stored without their FCS" % self.path)
+        with open(self.path, "rb") as f:
+            for chunk in chunks:
+                strip = chunk.fcs and not fcs
+                for packet in self.read_chunk(f, chunk):
+                    timestamp = packet[0]
+                    if start is not None and timestamp < start or end is not None and timestamp > end:
+                        continue
+                    if frame_matches(packet[4], pan, address):
+                        if strip:
+                            packet = packet[:4] + (packet[4][:-2],)
+                        yield packet
+
+    def frames(self) -> int:
+        return sum(c.frames for c in self.chunks)
+
+
+def parse_time(value: str) -> int:
+    """
+    Parses a UNIX timestamp in seconds or an ISO 8601 local time into
+    microseconds.
+    """
+    from datetime import datetime
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = datetime.fromisoformat(value).timestamp()
+    return int(seconds * 10**6)
+
+
+def main() -> None:
+    from argparse import ArgumentParser
+
+    from .capture_filter import CaptureFilterError, parse_address, parse_number
+    from .columnar import PacketColumns
+    from .nrf802154_sniffer import DLT, PcapWriter, pcap_header
+
+    parser = ArgumentParser(description="Query nRF Sniffer for 802.15.4 capture archives")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info = subparsers.add_parser("info", help="Summarize an archive")
+    info.add_argument("archive")
+
+    export = subparsers.add_parser("export", help="Export matching frames as pcap, NumPy .npz or Arrow")
+    export.add_argument("archive")
+    export.add_argument("output", help="File to write, - for standard output")
+    export.add_argument("--format", choices=["pcap", "npz", "arrow"], default="pcap", help="Output format")
+    export.add_argument("--start", help="UNIX time or ISO 8601 local time")
+    export.add_argument("--end", help="UNIX time or ISO 8601 local time")
+    export.add_argument("--pan", help="PAN ID")
+    export.add_argument("--address", help="Short or extended address")
+    export.add_argument(
+        "--metadata",
+        choices=["ieee802154-tap", "ieee802154-fcs"],
+        help="Write TAP records with channel, RSSI and LQI, or frames with their FCS",
+    )
+    export.add_argument(
+        "--fcs", action="store_true", help="Keep the FCS in TAP records, so frames with a bad one are flagged"
+    )
+
+    args = parser.parse_args()
+    reader = ArchiveReader(args.archive)
+
+    if args.command == "info":
+        if not reader.chunks:
+            print("%s: empty" % args.archive)
+            return
+        first = min(c.start for c in reader.chunks)
+        last = max(c.end for c in reader.chunks)
+        stored = sum(c.size for c in reader.chunks)
+        raw = sum(c.raw_size for c in reader.chunks)
+        print("chunks:   %d" % len(reader.chunks))
+        print("frames:   %d" % reader.frames())
+        print("from:     %s" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first / 10**6)))
+        print("to:       %s" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last / 10**6)))
+        print("stored:   %d bytes, %.1fx compressed" % (stored, raw / stored))
+        return
+
+    try:
+        pan = parse_number(args.pan, 0xFFFF, "PAN ID") if args.pan else None
+        address = parse_address(args.address) if args.address else None
+    except CaptureFilterError as e:
+        parser.error(str(e))
+    start = parse_time(args.start) if args.start else None
+    end = parse_time(args.end) if args.end else None
+    if args.fcs and args.metadata != "ieee802154-tap":
+        parser.error("--fcs requires --metadata ieee802154-tap")
+    keep_fcs = args.format == "pcap" and (args.fcs or args.metadata == "ieee802154-fcs")
+    if keep_fcs and not reader.has_fcs():
+        parser.error("%s holds frames stored without their FCS" % args.archive)
+
+    output = os.fdopen(os.dup(1), "wb", 0) if args.output == "-" else open(args.output, "wb", 0)
+    count = 0
+    with output:
+        if args.format == "pcap":
+            dlt = {
+                "ieee802154-tap": DLT.DLT_IEEE802_15_4_TAP,
+                "ieee802154-fcs": DLT.DLT_IEEE802_15_4_WITHFCS,
+            }.get(args.metadata, DLT.DLT_IEEE802_15_4_NOFCS)
+            output.write(pcap_header(dlt))
+            writer = PcapWriter(output, dlt, max_delay=float("inf"), fcs=keep_fcs)
+        else:
+            writer = PacketColumns()
+        for timestamp, channel, rssi, lqi, frame in reader.packets(start, end, pan, address, keep_fcs):
+            writer.write_packet(frame, channel, rssi, lqi, timestamp)
+            count += 1
+        writer.flush()
+        if args.format == "npz":
+            writer.save_npz(output)
+        elif args.format == "arrow":
+            writer.save_arrow(output)
+    print("%d frames exported" % count, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,787 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Microbenchmarks for the nRF Sniffer for 802.15.4 capture pipeline.
+
+Run with: python -m nrf802154_sniffer.benchmark <benchmark> [options]
+"""
+
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from argparse import ArgumentParser, ArgumentTypeError
+from contextlib import ExitStack
+from multiprocessing import Process, Queue
+from threading import Thread
+
+from . import discovery
+from .aio import AsyncNrf802154Sniffer
+from .capture_filter import compile_filter
+from .clock import DeviceClock
+from .columnar import PacketColumns
+from .convert import convert
+from .fake_device import FakeSnifferDevice, read_stamp
+from .nrf802154_sniffer import DLT, CapturedPacket, LineParser, Nrf802154Sniffer, PacketBatch, PcapWriter, pcap_header
+from .shm_ring import SharedMemoryRing
+from .talkers import TopTalkers
+from .trigger import TriggerRecorder
+
+
+def synthetic_lines(count: int, seed: int = 0) -> list[bytes]:
+    """
+    Generates firmware "received:" lines with random frame sizes, in the
+    format printed by the sniffer firmware.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        frame = rng.randbytes(rng.randint(5, 127))
+        lines.append(
+            b"received: %s power: %d lqi: %d time: %d\r\n"
+            % (frame.hex().encode(), rng.randint(-100, -10), rng.randint(0, 255), rng.getrandbits(32))
+        )
+    return lines
+
+
+def recorded_lines(path: str) -> list[bytes]:
+    """
+    Loads lines recorded from the sniffer serial port.
+    """
+    with open(path, "rb") as f:
+        return [line for line in f if LineParser.MARKER in line]
+
+
+def _report(name: str, seconds: float, frames: int) -> None:
+    print("%-24s %10.1f ns/frame %12.0f frames/s" % (name, seconds / frames * 1e9, frames / seconds))
+
+
+def bench_parse(args) -> None:
+    lines = recorded_lines(args.input) if args.input else synthetic_lines(args.count)
+    if not lines:
+        sys.exit("No \"received:\" lines to parse.")
+
+    def legacy():
+        for line in lines:
+            Nrf802154Sniffer.parse_packet(line)
+
+    # The readers parse the lines of one serial read at a time.
+    batches = [lines[i:i + args.batch] for i in range(0, len(lines), args.batch)]
+
+    def fast():
+        for batch in batches:
+            LineParser.parse_lines(batch)
+
+    legacy_time = min(timeit.repeat(legacy, number=1, repeat=args.repeat))
+    fast_time = min(timeit.repeat(fast, number=1, repeat=args.repeat))
+    _report("parse_packet", legacy_time, len(lines))
+    _report("LineParser.parse_lines", fast_time, len(lines))
+    print("speedup: %.1fx" % (legacy_time / fast_time))
+
+
+class _CountingFile:
+    """
+    Unbuffered file wrapper counting write calls.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return self.file.write(data)
+
+
+def _drain(fd: int) -> None:
+    while os.read(fd, 1 << 16):
+        pass
+
+
+def bench_pcap(args) -> None:
+    packets = LineParser.parse_lines(synthetic_lines(args.count)).packets
+    dlt = DLT.DLT_IEEE802_15_4_TAP
+
+    # A pipe drained by another thread stands in for the Wireshark fifo.
+    read_fd, write_fd = os.pipe()
+    reader = Thread(target=_drain, args=(read_fd,), daemon=True)
+    reader.start()
+
+    with open(write_fd, "wb", 0) as fifo:
+        per_frame = _CountingFile(fifo)
+
+        def legacy():
+            for p in packets:
+                per_frame.write(Nrf802154Sniffer.pcap_packet(p.content, dlt, 11, p.rssi, p.lqi, p.timestamp))
+
+        buffered = _CountingFile(fifo)
+
+        def writer():
+            w = PcapWriter(buffered, dlt, args.max_delay, args.max_bytes)
+            for p in packets:
+                w.write_packet(p.content, 11, p.rssi, p.lqi, p.timestamp)
+            w.flush()
+
+        legacy_time = min(timeit.repeat(legacy, number=1, repeat=args.repeat))
+        writer_time = min(timeit.repeat(writer, number=1, repeat=args.repeat))
+
+    reader.join()
+    _report("pcap_packet + write", legacy_time, len(packets))
+    _report("PcapWriter", writer_time, len(packets))
+    print("writes per run: %d vs %d" % (per_frame.writes // args.repeat, buffered.writes // args.repeat))
+    print("speedup: %.1fx" % (legacy_time / writer_time))
+
+
+def _queue_producer(queue, packets, batch_size) -> None:
+    for i in range(0, len(packets), batch_size):
+        queue.put(PacketBatch(packets[i:i + batch_size]))
+    queue.put(None)
+
+
+def _ring_producer(ring, packets, batch_size) -> None:
+    for i in range(0, len(packets), batch_size):
+        batch = packets[i:i + batch_size]
+        # Retry instead of dropping so that both transports move every frame.
+        while batch:
+            stored = len(batch) - ring.put_packets(batch)
+            ring.notify()
+            batch = batch[stored:]
+
+
+def bench_transport(args) -> None:
+    packets = LineParser.parse_lines(synthetic_lines(args.count)).packets
+
+    queue = Queue()
+    producer = Process(target=_queue_producer, args=(queue, packets, args.batch_size))
+    start = time.perf_counter()
+    producer.start()
+    received = 0
+    while (batch := queue.get()) is not None:
+        received += len(batch.packets)
+    queue_time = time.perf_counter() - start
+    producer.join()
+
+    ring = SharedMemoryRing.create(args.slots)
+    producer = Process(target=_ring_producer, args=(ring, packets, args.batch_size))
+    start = time.perf_counter()
+    producer.start()
+    received = 0
+    while received < len(packets):
+        received += len(ring.get_batch(args.slots, 0.05))
+    ring_time = time.perf_counter() - start
+    producer.join()
+    ring.close()
+
+    _report("multiprocessing.Queue", queue_time, len(packets))
+    _report("SharedMemoryRing", ring_time, len(packets))
+    print("speedup: %.1fx" % (queue_time / ring_time))
+
+
+class _PcapConsumer(Thread):
+    """
+    Reads the pcap stream written by the sniffer, standing in for Wireshark,
+    and records the end-to-end latency of every stamped frame.
+    """
+
+    RECORD_HEADER = struct.Struct("<LLLL")
+    # Length field of the TAP header, and the channel field of the channel
+    # assignment TLV in TAP records without an FCS type TLV.
+    TAP_LENGTH = struct.Struct("<2xH")
+    TAP_CHANNEL = struct.Struct("<16xH")
+
+    def __init__(self, fifo: str):
+        super().__init__(daemon=True)
+        self.fifo = fifo
+        self.latencies = []
+        self.first_index = self.last_index = None
+        self.first_time = self.last_time = 0
+        self.received = 0
+        # Arrival time of the first frame tagged with each channel, TAP only.
+        self.channel_seen = {}
+
+    def run(self):
+        with open(self.fifo, "rb") as f:
+            header = f.read(24)
+            if len(header) < 24:
+                return
+            tap = struct.unpack_from("<L", header, 20)[0] == DLT.DLT_IEEE802_15_4_TAP
+            skip = 0
+            while record := f.read(self.RECORD_HEADER.size):
+                _, _, length, _ = self.RECORD_HEADER.unpack(record)
+                data = f.read(length)
+                now = time.monotonic_ns()
+                if tap:
+                    skip = self.TAP_LENGTH.unpack_from(data)[0]
+                if (stamp := read_stamp(data[skip:])) is None:
+                    continue
+                sent, index = stamp
+                if tap:
+                    # An FCS type TLV, if any, comes before the channel.
+                    channel = self.TAP_CHANNEL.unpack_from(data, skip - PcapWriter.TAP_LENGTH)[0]
+                    if channel not in self.channel_seen:
+                        self.channel_seen[channel] = now
+                if self.first_index is None:
+                    self.first_index, self.first_time = index, now
+                self.last_index, self.last_time = index, now
+                self.received += 1
+                self.latencies.append(now - sent)
+
+
+def _cpu_time() -> float:
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return sum(u.ru_utime + u.ru_stime for u in (self_usage, children_usage))
+
+
+def _size_table(value: str) -> dict[int, float]:
+    """
+    Parses LENGTH:WEIGHT,... into a frame size table for FakeSnifferDevice.
+    """
+    table = {}
+    try:
+        for entry in value.split(","):
+            length, weight = entry.split(":")
+            table[int(length)] = table.get(int(length), 0) + float(weight)
+    except ValueError:
+        raise ArgumentTypeError("expected LENGTH:WEIGHT,... but got '%s'" % value)
+    if min(table.values()) < 0 or not sum(table.values()):
+        raise ArgumentTypeError("weights must be non-negative and not all zero")
+    return table
+
+
+def _sniffer(engine: str, **kwargs) -> Nrf802154Sniffer:
+    if engine == "asyncio":
+        return AsyncNrf802154Sniffer(**kwargs)
+    return Nrf802154Sniffer(**kwargs)
+
+
+def bench_pipeline(args) -> None:
+    kwargs = {"transport": args.transport, "fcs_policy": args.fcs_policy}
+    if args.max_in_flight_frames:
+        kwargs["max_in_flight_frames"] = args.max_in_flight_frames
+    if args.overload_policy:
+        kwargs["overload_policy"] = args.overload_policy
+    sniffer = _sniffer(args.engine, **kwargs)
+
+    with tempfile.TemporaryDirectory() as tmp, FakeSnifferDevice(
+        args.rate, args.size_table or (args.min_size, args.max_size), bad_fcs=args.bad_fcs
+    ) as device:
+        fifo = os.path.join(tmp, "fifo")
+        os.mkfifo(fifo)
+        consumer = _PcapConsumer(fifo)
+        consumer.start()
+
+        # The device is a child process; its CPU time is only accounted
+        # once it has been joined, after the measurement.
+        cpu = _cpu_time()
+        sniffer.start_threaded(fifo, device.port, args.channel, args.metadata)
+        time.sleep(args.duration)
+        sniffer.stop_thread()
+        consumer.join()
+        cpu = _cpu_time() - cpu
+
+    received = consumer.received
+    if received < 2:
+        sys.exit("Not enough frames reached the pcap output.")
+    # Frames streamed before the reader opened the port are discarded by
+    # the serial driver, and frames after the last one were still in
+    # flight when the capture stopped; neither counts as a loss.
+    expected = consumer.last_index - consumer.first_index + 1
+    elapsed = (consumer.last_time - consumer.first_time) / 1e9
+    latencies = sorted(consumer.latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] / 1000
+
+    print("offered rate:   %10d frames/s" % args.rate)
+    print("throughput:     %10.0f frames/s" % (received / elapsed))
+    print("CPU per frame:  %10.1f us" % (cpu / received * 1e6))
+    print("latency:        p50 %.0f us, p90 %.0f us, p99 %.0f us, max %.0f us"
+          % (percentile(50), percentile(90), percentile(99), latencies[-1] / 1000))
+    print("frames:         %d received, %d lost, %d dropped by flow control"
+          % (received, expected - received, sniffer.dropped_frames()))
+    if args.bad_fcs or args.fcs_policy != "pass":
+        print("bad FCS:        %d frames" % sum(sniffer.fcs_errors))
+
+
+def _pss(pid: int) -> int:
+    """
+    Returns the proportional set size of a process in bytes, which splits
+    pages shared after fork between the processes sharing them (Linux).
+    """
+    with open("/proc/%d/smaps_rollup" % pid) as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def bench_engines(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        devices = [stack.enter_context(FakeSnifferDevice(args.rate, seed=i)) for i in range(args.sniffers)]
+        sniffers = []
+        consumers = []
+        cpu = _cpu_time()
+        for i, device in enumerate(devices):
+            fifo = os.path.join(tmp, "fifo%d" % i)
+            os.mkfifo(fifo)
+            consumer = _PcapConsumer(fifo)
+            consumer.start()
+            sniffer = _sniffer(args.engine)
+            sniffer.start_threaded(fifo, device.port, 11)
+            sniffers.append(sniffer)
+            consumers.append(consumer)
+        time.sleep(args.duration)
+        pids = [os.getpid()] + [p.pid for s in sniffers for p in s.processes]
+        memory = sum(map(_pss, pids))
+        for sniffer in sniffers:
+            sniffer.stop_thread()
+        for consumer in consumers:
+            consumer.join()
+        cpu = _cpu_time() - cpu
+
+    received = sum(c.received for c in consumers)
+    print("engine:         %s, %d sniffers at %d frames/s each" % (args.engine, args.sniffers, args.rate))
+    print("processes:      %d" % len(pids))
+    print("memory (PSS):   %.1f MB" % (memory / 2**20))
+    print("CPU per frame:  %.1f us over %d frames" % (cpu / received * 1e6, received))
+
+
+def bench_retune(args) -> None:
+    sniffer = _sniffer(args.engine, transport=args.transport)
+    channels = [c for c in Nrf802154Sniffer.CHANNELS if c != args.channel][:args.count]
+    delays = []
+
+    with tempfile.TemporaryDirectory() as tmp, FakeSnifferDevice(args.rate) as device:
+        fifo = os.path.join(tmp, "fifo")
+        os.mkfifo(fifo)
+        consumer = _PcapConsumer(fifo)
+        consumer.start()
+        sniffer.start_threaded(fifo, device.port, args.channel, "ieee802154-tap")
+        while args.channel not in consumer.channel_seen:
+            time.sleep(0.001)
+
+        for channel in channels:
+            requested = time.monotonic_ns()
+            sniffer.set_channel(channel)
+            deadline = time.monotonic() + 1
+            while channel not in consumer.channel_seen and time.monotonic() < deadline:
+                time.sleep(0.0001)
+            if channel in consumer.channel_seen:
+                delays.append((consumer.channel_seen[channel] - requested) / 10**6)
+            time.sleep(0.05)
+
+        sniffer.stop_thread()
+        consumer.join()
+
+    if not delays:
+        sys.exit("No retune reached the pcap output.")
+    delays.sort()
+    lost = consumer.last_index - consumer.first_index + 1 - consumer.received
+    print("retunes:        %d of %d seen in the output" % (len(delays), len(channels)))
+    print("retune to first frame on the new channel: median %.1f ms, max %.1f ms"
+          % (delays[len(delays) // 2], delays[-1]))
+    print("frames:         %d received, %d lost" % (consumer.received, lost))
+
+
+def bench_columns(args) -> None:
+    rng = random.Random(0)
+    frames = [rng.randbytes(rng.randint(args.min_size, args.max_size)) for _ in range(args.count)]
+    payload = sum(map(len, frames))
+
+    def captured():
+        return [
+            CapturedPacket(frame, 1_700_000_000_000_000 + i, 11 + i % 16, -40 - i % 50, i % 256)
+            for i, frame in enumerate(frames)
+        ]
+
+    def columns():
+        buffer = PacketColumns()
+        for start in range(0, args.count, 64):
+            buffer.extend(packets[start:start + 64])
+        return buffer
+
+    packets = captured()
+    # The packet objects share the frame bytes objects, which tracemalloc
+    # does not see; the columns copy the frames into their arena.
+    for name, build, untraced in (
+        ("CapturedPacket list", captured, sum(map(sys.getsizeof, frames))),
+        ("PacketColumns", columns, 0),
+    ):
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+        del result
+        tracemalloc.start()
+        result = build()
+        size = tracemalloc.get_traced_memory()[0] + untraced
+        tracemalloc.stop()
+        del result
+        print("%-24s %7.1f bytes/frame, %6.1f beyond the frame data, %6.0f ns/frame to build"
+              % (name, size / args.count, (size - payload) / args.count, seconds / args.count * 1e9))
+
+    buffer = columns()
+    start = time.perf_counter()
+    rssi = buffer.to_numpy(copy=False)["rssi"].mean()
+    print("mean RSSI over the columns with NumPy: %.1f dBm in %.2f ms" % (rssi, (time.perf_counter() - start) * 1e3))
+
+
+def bench_talkers(args) -> None:
+    # Data frames from extended source addresses: half of them from a few
+    # busy devices, the rest from a population so large that nearly every
+    # address is heard only once.
+    rng = random.Random(0)
+    header = struct.Struct("<HBHHQ")
+    frames = [
+        CapturedPacket(
+            header.pack(
+                0xC841, i & 0xFF, 0x1A62, 0x0000,
+                int(rng.paretovariate(1.0)) if i % 2 else rng.getrandbits(64),
+            ) + bytes(20),
+            i, 11, -40 - i % 50, 255,
+        )
+        for i in range(args.count)
+    ]
+
+    def count_exact():
+        counts = {}
+        for p in frames:
+            source = p.content[7:15]
+            counts[source] = counts.get(source, 0) + 1
+        return counts
+
+    def count_sketch():
+        talkers = TopTalkers(args.capacity)
+        for start in range(0, args.count, 64):
+            talkers.add(frames[start:start + 64])
+        return talkers
+
+    for name, build in (("exact sources", count_exact), ("TopTalkers", count_sketch)):
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+        del result
+        tracemalloc.start()
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%-14s %6.0f ns/frame, %7.1f MB" % (name, seconds / args.count * 1e9, size / 1e6))
+
+    exact = count_exact()
+    busiest = sorted(exact.values(), reverse=True)[:8]
+    top = [count for _, count, *_ in result.sources.top(8)]
+    print("%d distinct sources; busiest exact %s, sketch %s" % (len(exact), busiest, top))
+
+
+def bench_clock(args) -> None:
+    # A device whose crystal is off by args.skew ppm, starting a minute
+    # before its timer wraps, heard at random intervals with random read
+    # delays of a few milliseconds. The original correction, a fixed offset
+    # from the first frame, is shown for comparison.
+    rng = random.Random(0)
+    start = 2**32 - 60_000_000
+    host_start = time.time_ns() // 1000
+    clock = DeviceClock(Nrf802154Sniffer.TIMER_MAX)
+    device = start
+    fixed = None
+    errors = {"DeviceClock": [], "fixed offset": []}
+    backwards = {"DeviceClock": 0, "fixed offset": 0}
+    last = {"DeviceClock": 0, "fixed offset": 0}
+    elapsed = 0.0
+    frames = 0
+    while device - start < args.hours * 3600e6:
+        device += int(rng.expovariate(1 / (args.interval * 1e6)))
+        received = host_start + (device - start) * (1 + args.skew * 1e-6)
+        host = int(received + 500 + rng.expovariate(1 / 2000))
+        raw = device % Nrf802154Sniffer.TIMER_MAX
+        if fixed is None:
+            fixed = host - raw
+        before = time.perf_counter()
+        converted = clock.convert(raw, host)
+        elapsed += time.perf_counter() - before
+        frames += 1
+        for name, timestamp in (("DeviceClock", converted), ("fixed offset", fixed + raw)):
+            errors[name].append(timestamp - received)
+            backwards[name] += timestamp < last[name]
+            last[name] = timestamp
+
+    print("%d frames over %g hours, %d timer wraps, %.0f ns/frame" % (
+        frames, args.hours, clock.wraps, elapsed / frames * 1e9,
+    ))
+    for name, error in errors.items():
+        tail = error[len(error) // 2:]
+        print("%-12s out of order %7d, error over the second half: mean %12.0f us, spread %10.0f us" % (
+            name, backwards[name], sum(tail) / len(tail), max(tail) - min(tail),
+        ))
+    print(clock.stats())
+
+
+class _CountingSink:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data) -> int:
+        self.bytes += len(data)
+        return len(data)
+
+
+def bench_trigger(args) -> None:
+    # Data frames every millisecond, of which one in args.every has the
+    # security enabled bit set and triggers.
+    rng = random.Random(0)
+    header = struct.Struct("<HBHH")
+    frames = [
+        (
+            header.pack(0xC849 if i % args.every == args.every // 2 else 0xC841, i & 0xFF, 0x1A62, 0xFFFF)
+            + rng.randbytes(rng.randint(10, 100)),
+            -40 - i % 50,
+            255,
+        )
+        for i in range(args.count)
+    ]
+    start = time.time_ns() // 1000
+    dlt = DLT.DLT_IEEE802_15_4_TAP
+
+    sink = _CountingSink()
+    writer = PcapWriter(sink, dlt, max_bytes=1024 * 1024)
+    before = time.perf_counter()
+    for i, (frame, rssi, lqi) in enumerate(frames):
+        writer.write_packet(frame, 15, rssi, lqi, start + i * 1000)
+    writer.flush()
+    seconds = time.perf_counter() - before
+    print("%-16s %6.0f ns/frame, %9d bytes" % ("every frame", seconds / args.count * 1e9, sink.bytes))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder = TriggerRecorder(
+            tmp, pcap_header(dlt), PcapWriter, dlt,
+            [(args.trigger, compile_filter(args.trigger))],
+            pre_seconds=args.pre, post_seconds=args.post,
+        )
+        before = time.perf_counter()
+        for i, (frame, rssi, lqi) in enumerate(frames):
+            recorder.write_packet(frame, 15, rssi, lqi, start + i * 1000)
+        recorder.close()
+        seconds = time.perf_counter() - before
+        files = [os.path.join(tmp, name) for name in os.listdir(tmp)]
+        size = sum(os.path.getsize(path) for path in files)
+    print("%-16s %6.0f ns/frame, %9d bytes in %d files" % (
+        "around triggers", seconds / args.count * 1e9, size, len(files),
+    ))
+
+
+def bench_convert(args) -> None:
+    lines = synthetic_lines(args.count)
+    jobs = args.jobs or sorted({1, 2, 4, os.cpu_count() or 1})
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, "sniffer.log")
+        with open(log, "wb") as f:
+            for _ in range(args.repeat_log):
+                f.writelines(lines)
+        size = os.path.getsize(log)
+        for count in jobs:
+            with open(os.devnull, "wb") as output:
+                start = time.perf_counter()
+                frames, _ = convert(log, output, jobs=count, chunk_size=args.chunk_size * 1024 * 1024)
+                seconds = time.perf_counter() - start
+            print("%2d jobs: %6.2f s, %7.1f MB/s, %9.0f frames/s" % (count, seconds, size / seconds / 1e6, frames / seconds))
+
+
+STARTUP_COMMANDS = {
+    # Wireshark always adds its version to the interface query.
+    "interfaces": ["--extcap-interfaces", "--extcap-version=4.2"],
+    "dlts": ["--extcap-interface", "/dev/ttyACM0", "--extcap-dlts"],
+    "config": ["--extcap-interface", "/dev/ttyACM0", "--extcap-config"],
+    "config-multi": ["--extcap-interface", Nrf802154Sniffer.MULTI_INTERFACE, "--extcap-config"],
+    "filter-check": ["--extcap-interface", "/dev/ttyACM0", "--extcap-capture-filter", "pan 0x1a62"],
+}
+
+
+def _run_time(command: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def bench_startup(args) -> None:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nrf802154_sniffer.py")
+    cache = discovery.port_cache_path()
+
+    def uncached(command):
+        try:
+            os.unlink(cache)
+        except FileNotFoundError:
+            pass
+        return _run_time(command)
+
+    def report(name, run, command):
+        times = sorted(run(command) for _ in range(args.repeat))
+        print("%-24s median %7.1f ms   min %7.1f ms" % (name, times[len(times) // 2] * 1e3, times[0] * 1e3))
+
+    unknown = set(args.command) - set(STARTUP_COMMANDS)
+    if unknown:
+        sys.exit("Unknown queries: %s" % ", ".join(sorted(unknown)))
+
+    report("python", _run_time, [sys.executable, "-c", "pass"])
+    for name in args.command or STARTUP_COMMANDS:
+        command = [sys.executable, script] + STARTUP_COMMANDS[name]
+        report(name + " (uncached)", uncached, command)
+        report(name, _run_time, command)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmarks for the nRF Sniffer for 802.15.4")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parse = subparsers.add_parser("parse", help="Compare parse_packet with LineParser")
+    parse.add_argument("--input", help="File with lines recorded from the sniffer serial port")
+    parse.add_argument("--count", type=int, default=100000, help="Number of synthetic lines")
+    parse.add_argument("--repeat", type=int, default=5, help="Number of timing runs")
+    parse.add_argument(
+        "--batch", type=int, default=Nrf802154Sniffer.BATCH_MAX_PACKETS, help="Lines per LineParser.parse_lines call"
+    )
+    parse.set_defaults(func=bench_parse)
+
+    pcap = subparsers.add_parser("pcap", help="Compare per-frame pcap writes with PcapWriter")
+    pcap.add_argument("--count", type=int, default=100000, help="Number of synthetic frames")
+    pcap.add_argument("--max-delay", type=float, default=0.005, help="PcapWriter flush delay in seconds")
+    pcap.add_argument("--max-bytes", type=int, default=64 * 1024, help="PcapWriter flush size in bytes")
+    pcap.add_argument("--repeat", type=int, default=5, help="Number of timing runs")
+    pcap.set_defaults(func=bench_pcap)
+
+    transport = subparsers.add_parser("transport", help="Compare the queue and shared memory transports")
+    transport.add_argument("--count", type=int, default=200000, help="Number of synthetic frames")
+    transport.add_argument("--batch-size", type=int, default=64, help="Frames per queue batch")
+    transport.add_argument("--slots", type=int, default=4096, help="Ring slots")
+    transport.set_defaults(func=bench_transport)
+
+    pipeline = subparsers.add_parser(
+        "pipeline", help="Run the full capture pipeline against an emulated device (POSIX only)"
+    )
+    pipeline.add_argument("--rate", type=int, default=5000, help="Frames per second sent by the device")
+    pipeline.add_argument("--min-size", type=int, default=23, help="Minimum frame length")
+    pipeline.add_argument("--max-size", type=int, default=127, help="Maximum frame length")
+    pipeline.add_argument(
+        "--size-table",
+        type=_size_table,
+        help="Weighted frame lengths as LENGTH:WEIGHT,..., e.g. 23:6,60:3,127:1, instead of --min-size/--max-size",
+    )
+    pipeline.add_argument("--duration", type=float, default=5, help="Capture duration in seconds")
+    pipeline.add_argument("--channel", type=int, default=11, help="Capture channel")
+    pipeline.add_argument(
+        "--metadata", choices=["ieee802154-tap", "ieee802154-fcs"], help="Write TAP or FCS records instead of NOFCS"
+    )
+    pipeline.add_argument("--fcs-policy", choices=["pass", "drop", "flag"], default="pass", help="Handling of bad FCS")
+    pipeline.add_argument("--bad-fcs", type=float, default=0.0, help="Fraction of frames sent with a bad FCS")
+    pipeline.add_argument("--transport", choices=["queue", "shm"], default="queue", help="Reader to writer transport")
+    pipeline.add_argument("--max-in-flight-frames", type=int, help="Bound on frames between reader and writer")
+    pipeline.add_argument("--overload-policy", choices=["drop-newest", "drop-oldest", "block"])
+    pipeline.add_argument("--engine", choices=["process", "asyncio"], default="process", help="Capture engine")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    engines = subparsers.add_parser(
+        "engines", help="Measure memory and CPU of several captures per engine (Linux only)"
+    )
+    engines.add_argument("--sniffers", type=int, default=4, help="Number of emulated devices and captures")
+    engines.add_argument("--rate", type=int, default=2000, help="Frames per second sent by each device")
+    engines.add_argument("--duration", type=float, default=5, help="Capture duration in seconds")
+    engines.add_argument("--engine", choices=["process", "asyncio"], default="process", help="Capture engine")
+    engines.set_defaults(func=bench_engines)
+
+    retune = subparsers.add_parser(
+        "retune", help="Measure live retuning against an emulated device (POSIX only)"
+    )
+    retune.add_argument("--rate", type=int, default=5000, help="Frames per second sent by the device")
+    retune.add_argument("--channel", type=int, default=11, help="Initial capture channel")
+    retune.add_argument("--count", type=int, default=15, help="Number of retunes")
+    retune.add_argument("--transport", choices=["queue", "shm"], default="queue", help="Reader to writer transport")
+    retune.add_argument("--engine", choices=["process", "asyncio"], default="process", help="Capture engine")
+    retune.set_defaults(func=bench_retune)
+
+    columns = subparsers.add_parser("columns", help="Compare memory of packet objects and PacketColumns")
+    columns.add_argument("--count", type=int, default=1000000, help="Number of synthetic frames")
+    columns.add_argument("--min-size", type=int, default=5, help="Minimum frame length")
+    columns.add_argument("--max-size", type=int, default=127, help="Maximum frame length")
+    columns.set_defaults(func=bench_columns)
+
+    talkers = subparsers.add_parser("talkers", help="Compare exact per-address counts with the top talker sketches")
+    talkers.add_argument("--count", type=int, default=500000, help="Number of frames")
+    talkers.add_argument("--capacity", type=int, default=1024, help="Keys counted by each sketch")
+    talkers.set_defaults(func=bench_talkers)
+
+    clock = subparsers.add_parser("clock", help="Simulate a long capture through the device clock model")
+    clock.add_argument("--hours", type=float, default=48, help="Length of the capture")
+    clock.add_argument("--interval", type=float, default=1.0, help="Mean seconds between frames")
+    clock.add_argument("--skew", type=float, default=25.0, help="Error of the device crystal in ppm")
+    clock.set_defaults(func=bench_clock)
+
+    trigger = subparsers.add_parser("trigger", help="Compare writing every frame with writing frames around triggers")
+    trigger.add_argument("--count", type=int, default=1000000, help="Number of frames, one per millisecond")
+    trigger.add_argument("--every", type=int, default=200000, help="Frames per triggering frame")
+    trigger.add_argument("--trigger", default="security", help="Trigger expression")
+    trigger.add_argument("--pre", type=float, default=10.0, help="Seconds before a trigger")
+    trigger.add_argument("--post", type=float, default=10.0, help="Seconds after a trigger")
+    trigger.set_defaults(func=bench_trigger)
+
+    conversion = subparsers.add_parser("convert", help="Time offline log conversion with a growing process pool")
+    conversion.add_argument("--count", type=int, default=100000, help="Number of distinct synthetic lines")
+    conversion.add_argument("--repeat-log", type=int, default=10, help="Times the lines are repeated in the log")
+    conversion.add_argument("--chunk-size", type=int, default=8, help="Chunk size in MB")
+    conversion.add_argument("--jobs", type=int, action="append", help="Pool size to time; repeat for several")
+    conversion.set_defaults(func=bench_convert)
+
+    startup = subparsers.add_parser(
+        "startup", help="Time cold starts of the extcap for each Wireshark query"
+    )
+    startup.add_argument(
+        "command", nargs="*", help="Queries to time, all by default: %s" % ", ".join(STARTUP_COMMANDS)
+    )
+    startup.add_argument("--repeat", type=int, default=20, help="Runs of each query")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
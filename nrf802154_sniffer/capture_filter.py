@@ -0,0 +1,257 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Capture filters evaluated in the serial reader process, before frames are
+handed over to the writer.
+
+Grammar:
+
+    expr      := term ("or" term)*
+    term      := factor ("and" factor)*
+    factor    := "not" factor | "(" expr ")" | primitive
+    primitive := "type" (beacon | data | ack | command | multipurpose | fragment | extended)
+               | "security"
+               | ["src" | "dst"] "pan" PAN_ID
+               | ("src" | "dst" | "addr") ADDRESS
+               | ("rssi" | "lqi") ("==" | "!=" | "<" | "<=" | ">" | ">=") NUMBER
+
+"&&", "||" and "!" can be used instead of "and", "or" and "not".
+Short addresses and PAN IDs are written as numbers, e.g. 0xffff;
+extended addresses as eight colon separated bytes or 16 hex digits,
+most significant byte first, as Wireshark displays them.
+
+Example: type data and pan 0x1a62 and not dst 0xffff and rssi >= -80
+"""
+
+import re
+
+try:
+    from .ieee802154 import AddressMode, FrameType, FC_FRAME_TYPE, FC_SECURITY_ENABLED, decode_addressing
+except ImportError:
+    from ieee802154 import AddressMode, FrameType, FC_FRAME_TYPE, FC_SECURITY_ENABLED, decode_addressing
+
+
+class CaptureFilterError(ValueError):
+    pass
+
+
+TOKEN_REGEX = re.compile(r"\s*(\(|\)|&&|\|\||!=|>=|<=|==|[<>!]|[^\s()!<>=&|]+)")
+
+FRAME_TYPES = {
+    "beacon": FrameType.BEACON,
+    "data": FrameType.DATA,
+    "ack": FrameType.ACK,
+    "command": FrameType.COMMAND,
+    "cmd": FrameType.COMMAND,
+    "multipurpose": FrameType.MULTIPURPOSE,
+    "fragment": FrameType.FRAGMENT,
+    "frag": FrameType.FRAGMENT,
+    "extended": FrameType.EXTENDED,
+}
+
+COMPARISONS = ("==", "!=", "<", "<=", ">", ">=")
+
+# Indices into the tuple returned by decode_addressing.
+DST_PAN, DST_MODE, DST_ADDR, SRC_PAN, SRC_MODE, SRC_ADDR = range(6)
+
+
+def tokenize(expression: str) -> list[str]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        m = TOKEN_REGEX.match(expression, position)
+        if not m:
+            raise CaptureFilterError("Unexpected character at position %d" % position)
+        tokens.append(m.group(1))
+        position = m.end()
+    return tokens
+
+
+def parse_number(token: str, maximum: int, what: str) -> int:
+    try:
+        value = int(token, 0)
+    except ValueError:
+        raise CaptureFilterError("Invalid %s: %s" % (what, token)) from None
+    if not 0 <= value <= maximum:
+        raise CaptureFilterError("%s out of range: %s" % (what.capitalize(), token))
+    return value
+
+
+def parse_address(token: str) -> tuple[int, int]:
+    """
+    Returns the (address mode, address) of an address token.
+    """
+    digits = token.replace(":", "")
+    if ":" in token or len(digits.removeprefix("0x")) == 16:
+        digits = digits.removeprefix("0x")
+        if len(digits) != 16:
+            raise CaptureFilterError("Invalid extended address: %s" % token)
+        try:
+            return AddressMode.EXTENDED, int(digits, 16)
+        except ValueError:
+            raise CaptureFilterError("Invalid extended address: %s" % token) from None
+    return AddressMode.SHORT, parse_number(token, 0xFFFF, "short address")
+
+
+class Parser:
+    """
+    Recursive descent parser turning a filter expression into the source
+    of an equivalent Python expression.
+    """
+
+    def __init__(self, expression: str):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.uses_frame_control = False
+        self.uses_addressing = False
+
+    def peek(self) -> str | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position].lower()
+        return None
+
+    def next(self, what: str) -> str:
+        token = self.peek()
+        if token is None:
+            raise CaptureFilterError("Expected %s at end of filter" % what)
+        self.position += 1
+        return token
+
+    def parse(self) -> str:
+        source = self.expr()
+        if self.peek() is not None:
+            raise CaptureFilterError("Unexpected token: %s" % self.tokens[self.position])
+        return source
+
+    def expr(self) -> str:
+        terms = [self.term()]
+        while self.peek() in ("or", "||"):
+            self.position += 1
+            terms.append(self.term())
+        return terms[0] if len(terms) == 1 else "(%s)" % " or ".join(terms)
+
+    def term(self) -> str:
+        factors = [self.factor()]
+        while self.peek() in ("and", "&&"):
+            self.position += 1
+            factors.append(self.factor())
+        return factors[0] if len(factors) == 1 else "(%s)" % " and ".join(factors)
+
+    def factor(self) -> str:
+        token = self.next("filter primitive")
+        if token in ("not", "!"):
+            return "(not %s)" % self.factor()
+        if token == "(":
+            source = self.expr()
+            if self.next("')'") != ")":
+                raise CaptureFilterError("Expected ')'")
+            return source
+        return self.primitive(token)
+
+    def primitive(self, token: str) -> str:
+        if token == "type":
+            name = self.next("frame type")
+            if name not in FRAME_TYPES:
+                raise CaptureFilterError("Unknown frame type: %s" % name)
+            self.uses_frame_control = True
+            return "(fc >= 0 and fc & %d == %d)" % (FC_FRAME_TYPE, FRAME_TYPES[name])
+
+        if token == "security":
+            self.uses_frame_control = True
+            return "(fc >= 0 and fc & %d != 0)" % FC_SECURITY_ENABLED
+
+        if token in ("rssi", "lqi"):
+            operator = self.next("comparison")
+            if operator not in COMPARISONS:
+                raise CaptureFilterError("Expected comparison after %s" % token)
+            value = self.next("number")
+            try:
+                value = int(value, 0)
+            except ValueError:
+                raise CaptureFilterError("Invalid %s value: %s" % (token, value)) from None
+            return "%s %s %d" % (token, operator, value)
+
+        direction = None
+        if token in ("src", "dst"):
+            direction = token
+            if self.peek() == "pan":
+                token = self.next("pan")
+
+        if token == "pan":
+            pan = parse_number(self.next("PAN ID"), 0xFFFF, "PAN ID")
+            self.uses_addressing = True
+            if direction == "src":
+                return "(a is not None and a[%d] == %d)" % (SRC_PAN, pan)
+            if direction == "dst":
+                return "(a is not None and a[%d] == %d)" % (DST_PAN, pan)
+            return "(a is not None and (a[%d] == %d or a[%d] == %d))" % (DST_PAN, pan, SRC_PAN, pan)
+
+        if direction is not None or token == "addr":
+            mode, address = parse_address(self.next("address"))
+            self.uses_addressing = True
+            src = "a[%d] == %d and a[%d] == %d" % (SRC_MODE, mode, SRC_ADDR, address)
+            dst = "a[%d] == %d and a[%d] == %d" % (DST_MODE, mode, DST_ADDR, address)
+            if direction == "src":
+                return "(a is not None and %s)" % src
+            if direction == "dst":
+                return "(a is not None and %s)" % dst
+            return "(a is not None and (%s or %s))" % (src, dst)
+
+        raise CaptureFilterError("Unknown filter primitive: %s" % token)
+
+
+def compile_filter(expression: str):
+    """
+    Compiles a filter expression into a predicate called as
+    predicate(content, rssi, lqi) for every frame. Only the parts of the
+    MAC header the filter refers to are decoded.
+    :raises CaptureFilterError: if the expression is invalid
+    """
+    parser = Parser(expression)
+    body = parser.parse()
+    lines = ["def predicate(content, rssi, lqi):"]
+    if parser.uses_frame_control:
+        lines.append("    fc = content[0] | content[1] << 8 if len(content) > 1 else -1")
+    if parser.uses_addressing:
+        lines.append("    a = decode_addressing(content)")
+    lines.append("    return %s" % body)
+
+    namespace = {"decode_addressing": decode_addressing}
+    exec("\n".join(lines), namespace)
+    return namespace["predicate"]
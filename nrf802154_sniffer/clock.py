@@ -0,0 +1,220 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Clock model of a sniffer device: extends its 32-bit microsecond timer to
+64 bits across wraps and maps it onto host time, following the drift of
+the device crystal, so that long captures stay ordered and aligned with
+host-side logs.
+"""
+
+import math
+import time
+
+
+class DeviceClock:
+    """
+    Maps the timestamps of one sniffer device, microseconds since its boot
+    on a counter of timer_max values, to host time in microseconds since
+    the epoch.
+
+    Wraps of the counter are counted as timestamps go by; after a silence
+    long enough to hide wraps, their number is worked out from the host
+    time instead. Host time is modelled as device time plus an offset and
+    a skew proportional to device time. Every frame comes with the host
+    time at which it was read, which is later than its reception by a
+    varying delay; the frame with the smallest delay of every window
+    seconds of device time goes into a least squares fit of offset and
+    skew, in which older windows fade out over about memory seconds.
+    Until the first window is complete, the smallest delay seen so far
+    gives the offset. All of this is O(1) per frame.
+
+    Should a frame end up more than resync seconds off the model, the
+    device was reset or the host clock stepped, and the model starts over.
+    Converted timestamps never go backwards.
+    """
+
+    def __init__(self, timer_max: int = 2**32, window: float = 10.0, memory: float = 3600.0, resync: float = 5.0):
+        self.timer_max = timer_max
+        self.half = timer_max // 2
+        # Longest silence over which wraps are still counted.
+        self.silence = timer_max // 4
+        self.window = int(window * 1e6)
+        self.decay = math.exp(-window / memory)
+        self.resync_limit = resync * 1e6
+        # Counter extension.
+        self.base = 0
+        self.last_raw = None
+        self.last_host = None
+        self.last_output = 0
+        # Statistics.
+        self.frames = 0
+        self.wraps = 0
+        self.resyncs = 0
+        self.reset_model()
+
+    def reset_model(self) -> None:
+        # Window being filled: its end in device time (-inf before the first
+        # frame), and the device time and offset of its frame with the
+        # smallest delay.
+        self.window_end = -math.inf
+        self.window_x = self.window_y = None
+        # Exponentially weighted means and co-moments of the window points.
+        self.weight = 0.0
+        self.mean_x = self.mean_y = 0.0
+        self.cxx = self.cxy = self.cyy = 0.0
+        self.windows = 0
+        # Host time = x + offset + skew * (x - anchor).
+        self.offset = None
+        self.skew = 0.0
+        self.anchor = 0.0
+
+    def extend(self, raw: int) -> int:
+        """
+        Returns a device timestamp extended to 64 bits, counting wraps from
+        the previous timestamp alone. Used on its own where there is no
+        host time, as when converting logs.
+        """
+        last = self.last_raw
+        if last is not None:
+            if last - raw > self.half:
+                self.base += self.timer_max
+                self.wraps += 1
+            elif raw - last > self.half:
+                # Read after a wrap, but stamped before it.
+                return self.base - self.timer_max + raw
+        self.last_raw = raw
+        return self.base + raw
+
+    def resume(self, last_raw: int, base: int = 0) -> None:
+        """
+        Continues extending timestamps after last_raw, whose extension had
+        base added, as left by extend on another instance.
+        """
+        self.last_raw = last_raw
+        self.base = base
+
+    def convert(self, raw: int, host: int | None = None) -> int:
+        """
+        Returns the host time of a device timestamp. host is the host time
+        in microseconds at which the frame was read, now if not given.
+        """
+        if host is None:
+            host = time.time_ns() // 1000
+        self.frames += 1
+        if self.last_raw is not None and host - self.last_host > self.silence and self.offset is not None:
+            # Too long a silence to tell wraps apart; predict the extended
+            # timestamp from host time.
+            predicted = (host - self.offset + self.skew * self.anchor) / (1 + self.skew)
+            base = round((predicted - raw) / self.timer_max) * self.timer_max
+            if base > self.base:
+                self.wraps += (base - self.base) // self.timer_max
+                self.base = base
+            self.last_raw = raw
+        x = self.extend(raw)
+        self.last_host = host
+        return self.map(x, host - x)
+
+    def map(self, x: int, y: int) -> int:
+        """
+        Feeds the offset y of extended timestamp x to the model and returns
+        its host time.
+        """
+        if x < self.window_end:
+            if y < self.window_y:
+                self.window_x, self.window_y = x, y
+                if not self.windows:
+                    self.offset = y
+        elif self.window_y is None:
+            self.window_end = x + self.window
+            self.window_x, self.window_y = x, y
+            self.offset = y
+        else:
+            self.add_window(self.window_x, self.window_y)
+            self.window_end = x + self.window
+            self.window_x, self.window_y = x, y
+
+        output = int(x + self.offset + self.skew * (x - self.anchor))
+        if abs(x + y - output) > self.resync_limit:
+            self.resyncs += 1
+            self.reset_model()
+            return self.map(x, y)
+        if output < self.last_output:
+            output = self.last_output
+        self.last_output = output
+        return output
+
+    def add_window(self, x: float, y: float) -> None:
+        decay = self.decay
+        self.weight = self.weight * decay + 1.0
+        self.cxx *= decay
+        self.cxy *= decay
+        self.cyy *= decay
+        dx = x - self.mean_x
+        self.mean_x += dx / self.weight
+        dy = y - self.mean_y
+        self.mean_y += dy / self.weight
+        self.cxx += dx * (x - self.mean_x)
+        self.cxy += dx * (y - self.mean_y)
+        self.cyy += dy * (y - self.mean_y)
+        self.windows += 1
+        if self.windows > 1 and self.cxx > 0:
+            self.skew = self.cxy / self.cxx
+        self.offset = self.mean_y
+        self.anchor = self.mean_x
+
+    def stats(self) -> dict:
+        """
+        Returns the state of the model. residual is the weighted RMS
+        distance of the window points from the fit, and skew_error the
+        standard error of the skew, both small once the model has
+        settled; None until there are enough windows.
+        """
+        residual = skew_error = None
+        if self.windows > 2 and self.cxx > 0:
+            variance = max(0.0, self.cyy - self.cxy * self.cxy / self.cxx) / self.weight
+            residual = round(math.sqrt(variance), 1)
+            skew_error = round(math.sqrt(variance / self.cxx) * 1e6, 3)
+        return {
+            "frames": self.frames,
+            "wraps": self.wraps,
+            "resyncs": self.resyncs,
+            "windows": self.windows,
+            "offset": None if self.offset is None else round(self.offset),
+            "skew_ppm": round(self.skew * 1e6, 3),
+            "skew_error_ppm": skew_error,
+            "residual_us": residual,
+        }
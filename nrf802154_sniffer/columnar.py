@@ -0,0 +1,196 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Columnar capture buffer for analysis of large captures. Timestamps, channel,
+RSSI and LQI are kept in typed arrays and the frames in one contiguous bytes
+arena indexed by an offset array, so a capture of millions of frames takes
+no per-frame Python objects and exports to NumPy or Arrow without copying
+frame by frame.
+
+NumPy and pyarrow are only needed for the respective exports.
+"""
+
+from array import array
+from itertools import accumulate
+
+
+class PacketColumns:
+    """
+    Growable columns of captured frames. Implements the record writer
+    interface, so it can stand in for any other output.
+    The arrays grow by over-allocating like lists do, so appending is
+    amortized constant time.
+    """
+
+    # Column name and array type code; channel, RSSI and LQI fit in a byte.
+    COLUMNS = (
+        ("timestamp", "q"),
+        ("channel", "B"),
+        ("rssi", "b"),
+        ("lqi", "B"),
+    )
+
+    flush_count = 0
+
+    def __init__(self):
+        self.timestamp = array("q")
+        self.channel = array("B")
+        self.rssi = array("b")
+        self.lqi = array("B")
+        # Frame i is payload[offsets[i]:offsets[i + 1]].
+        self.offsets = array("q", [0])
+        self.payload = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes used by the stored data, not counting over-allocation.
+        """
+        arrays = [getattr(self, name) for name, _ in self.COLUMNS] + [self.offsets]
+        return sum(len(a) * a.itemsize for a in arrays) + len(self.payload)
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        self.timestamp.append(timestamp)
+        self.channel.append(channel)
+        self.rssi.append(rssi)
+        self.lqi.append(lqi)
+        self.payload += frame
+        self.offsets.append(len(self.payload))
+
+    def extend(self, packets) -> None:
+        """
+        Appends a batch of CapturedPacket objects, as returned by
+        Nrf802154Sniffer.get_batch, one column at a time.
+        """
+        self.timestamp.extend([p.timestamp for p in packets])
+        self.channel.extend([p.channel for p in packets])
+        self.rssi.extend([p.rssi for p in packets])
+        self.lqi.extend([p.lqi for p in packets])
+        contents = [p.content for p in packets]
+        self.offsets.extend(accumulate(map(len, contents), initial=len(self.payload)))
+        # accumulate repeats the initial value, which is already the last offset.
+        del self.offsets[-len(contents) - 1]
+        self.payload += b"".join(contents)
+
+    def timeout(self) -> float | None:
+        return None
+
+    def poll(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def frame(self, index: int) -> bytes:
+        return bytes(self.payload[self.offsets[index]:self.offsets[index + 1]])
+
+    def frames(self):
+        """
+        Yields the frames as memoryviews into the payload arena, which must
+        not grow while they are in use.
+        """
+        view = memoryview(self.payload)
+        offsets = self.offsets
+        for i in range(len(self)):
+            yield view[offsets[i]:offsets[i + 1]]
+
+    def to_numpy(self, copy: bool = True) -> dict:
+        """
+        Returns the columns as NumPy arrays: timestamp, channel, rssi, lqi,
+        offsets (one more than there are frames) and payload (uint8).
+        Without copy the arrays share memory with this buffer, which then
+        cannot grow while they exist.
+        """
+        import numpy
+
+        columns = {name: numpy.frombuffer(getattr(self, name), dtype=code) for name, code in self.COLUMNS}
+        columns["offsets"] = numpy.frombuffer(self.offsets, dtype="q")
+        columns["payload"] = numpy.frombuffer(self.payload, dtype="B")
+        if copy:
+            columns = {name: column.copy() for name, column in columns.items()}
+        return columns
+
+    def save_npz(self, file, compressed: bool = False) -> None:
+        """
+        Saves the columns to a NumPy .npz file; see to_numpy for its arrays.
+        """
+        import numpy
+
+        save = numpy.savez_compressed if compressed else numpy.savez
+        save(file, **self.to_numpy(copy=False))
+
+    @classmethod
+    def load_npz(cls, file) -> "PacketColumns":
+        import numpy
+
+        columns = cls()
+        with numpy.load(file) as data:
+            for name, code in cls.COLUMNS + (("offsets", "q"),):
+                setattr(columns, name, array(code, data[name].astype(code, copy=False).tobytes()))
+            columns.payload = bytearray(data["payload"].tobytes())
+        return columns
+
+    def to_arrow(self):
+        """
+        Returns the columns as a pyarrow Table with a large_binary frame
+        column. The table shares memory with this buffer, which then cannot
+        grow while it exists.
+        """
+        import pyarrow
+
+        count = len(self)
+        frame = pyarrow.Array.from_buffers(
+            pyarrow.large_binary(), count, [None, pyarrow.py_buffer(self.offsets), pyarrow.py_buffer(self.payload)]
+        )
+        types = {"q": pyarrow.int64(), "B": pyarrow.uint8(), "b": pyarrow.int8()}
+        arrays = [
+            pyarrow.Array.from_buffers(types[code], count, [None, pyarrow.py_buffer(getattr(self, name))])
+            for name, code in self.COLUMNS
+        ]
+        return pyarrow.table(arrays + [frame], names=[name for name, _ in self.COLUMNS] + ["frame"])
+
+    def save_arrow(self, file) -> None:
+        """
+        Saves the columns to an Arrow IPC (Feather v2) file.
+        """
+        import pyarrow.feather
+
+        pyarrow.feather.write_feather(self.to_arrow(), file)
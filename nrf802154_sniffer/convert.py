@@ -0,0 +1,283 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Offline conversion of raw sniffer logs, as saved by a terminal logger from
+the serial port, to pcap or pcapng.
+
+The log is memory-mapped and split into line-aligned chunks that a pool of
+processes parses and encodes in parallel; the encoded chunks are written
+out in log order. Device timestamps are extended across timer wraps by the
+DeviceClock of live captures. A first pass over the chunks counts the
+wraps in each, so that every chunk knows the wraps before it. Without
+host times there is no drift to fit: the first frame is placed at the
+start time and the others keep their distance to it.
+
+Run with: python -m nrf802154_sniffer.convert LOG OUTPUT [options]
+"""
+
+import mmap
+import os
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+
+from .archive import parse_time
+from .clock import DeviceClock
+from .nrf802154_sniffer import DLT, LineParser, Nrf802154Sniffer, PcapWriter, pcap_header
+from .pcapng import PcapngWriter
+
+FORMAT_PCAP = "pcap"
+FORMAT_PCAPNG = "pcapng"
+
+# Size of the chunks the log is split into.
+CHUNK_SIZE = 8 * 1024 * 1024
+# Timestamp of a "received:" line, for the pass that counts timer wraps.
+STAMP = re.compile(rb"received:[^\n]* time: (\d+)\r?$", re.MULTILINE)
+
+
+class _Sink:
+    """
+    File-like target collecting what a writer flushes.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+
+def chunk_bounds(log, chunk_size: int = CHUNK_SIZE) -> list[tuple[int, int]]:
+    """
+    Splits the log into (start, end) ranges of about chunk_size bytes that
+    end right after a newline, or at the end of the log.
+    """
+    bounds = []
+    start = 0
+    while start < len(log):
+        end = log.find(b"\n", start + chunk_size - 1)
+        end = len(log) if end < 0 else end + 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def scan_chunk(path: str, start: int, end: int) -> tuple[int, int, int] | None:
+    """
+    Returns the first and last timestamps of the frames in one chunk of the
+    log and the number of timer wraps between them, or None if the chunk
+    has no frames.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        stamps = STAMP.findall(log, start, end)
+    if not stamps:
+        return None
+    clock = DeviceClock(Nrf802154Sniffer.TIMER_MAX)
+    for stamp in stamps:
+        clock.extend(int(stamp))
+    return int(stamps[0]), clock.last_raw, clock.wraps
+
+
+def convert_chunk(
+    path: str, start: int, end: int, file_format: str, dlt: int, channel: int, offset: int, clock_state: tuple
+):
+    """
+    Parses and encodes one chunk of the log. clock_state holds the last
+    timestamp before the chunk and its wrap base, as taken by
+    DeviceClock.resume. Returns the encoded records, the number of frames
+    and the number of malformed lines.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        lines = log[start:end].split(b"\n")
+    result = LineParser.parse_lines(lines)
+
+    sink = _Sink()
+    if file_format == FORMAT_PCAPNG:
+        writer = PcapngWriter(sink, dlt, [(channel, "")], max_delay=float("inf"))
+    else:
+        writer = PcapWriter(sink, dlt, max_delay=float("inf"), max_bytes=1024 * 1024)
+    # The headers are written once by the parent.
+    writer.flush()
+    sink.parts.clear()
+    clock = DeviceClock(Nrf802154Sniffer.TIMER_MAX)
+    clock.resume(*clock_state)
+    extend = clock.extend
+    for p in result.packets:
+        writer.write_packet(p.content, channel, p.rssi, p.lqi, offset + extend(p.timestamp))
+    writer.flush()
+    return b"".join(sink.parts), len(result.packets), result.malformed
+
+
+def file_header(file_format: str, dlt: int, channel: int) -> bytes:
+    if file_format == FORMAT_PCAPNG:
+        sink = _Sink()
+        PcapngWriter(sink, dlt, [(channel, "")]).flush()
+        return b"".join(sink.parts)
+    return pcap_header(dlt)
+
+
+def convert(
+    path: str,
+    output,
+    file_format: str = FORMAT_PCAP,
+    dlt: int = DLT.DLT_IEEE802_15_4_NOFCS,
+    channel: int = 11,
+    start_time: int | None = None,
+    jobs: int | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> tuple[int, int]:
+    """
+    Converts the log at path and writes the capture to the output file.
+    :param start_time: UNIX time of the first frame in microseconds; by
+                       default the log's modification time is taken as the
+                       time of the last frame
+    :param jobs: number of worker processes, the CPU count by default; 1
+                 converts in this process
+    :return: number of frames and of malformed lines
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            bounds = []
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                bounds = chunk_bounds(log, chunk_size)
+
+    output.write(file_header(file_format, dlt, channel))
+    if not bounds:
+        return 0, 0
+
+    with ExitStack() as stack:
+        if jobs == 1 or len(bounds) == 1:
+            pool = None
+            scans = [scan_chunk(path, start, end) for start, end in bounds]
+        else:
+            jobs = jobs or os.cpu_count() or 1
+            pool = stack.enter_context(ProcessPoolExecutor(jobs))
+            scans = list(pool.map(scan_chunk, *zip(*((path, start, end) for start, end in bounds))))
+
+        # Chain the wraps of the chunks: every chunk starts from the clock
+        # state left by the ones before it.
+        clock = DeviceClock(Nrf802154Sniffer.TIMER_MAX)
+        states = []
+        first = None
+        for scan in scans:
+            states.append((clock.last_raw, clock.base))
+            if scan is None:
+                continue
+            chunk_first, chunk_last, wraps = scan
+            extended = clock.extend(chunk_first)
+            if first is None:
+                first = extended
+            clock.resume(chunk_last, clock.base + wraps * clock.timer_max)
+        if first is None:
+            return 0, 0
+        last = clock.base + clock.last_raw
+        if start_time is None:
+            start_time = int(os.stat(path).st_mtime * 10**6) - (last - first)
+        offset = start_time - first
+        arguments = (file_format, dlt, channel, offset)
+
+        frames = malformed = 0
+        if pool is None:
+            for (start, end), state in zip(bounds, states):
+                data, count, bad = convert_chunk(path, start, end, *arguments, state)
+                output.write(data)
+                frames += count
+                malformed += bad
+            return frames, malformed
+
+        # Chunks are submitted ahead of the one being written only as far
+        # as needed to keep the pool busy, which bounds memory use.
+        ahead = 2 * jobs
+        pending = deque()
+        chunks = iter(zip(bounds, states))
+        while True:
+            for (start, end), state in chunks:
+                pending.append(pool.submit(convert_chunk, path, start, end, *arguments, state))
+                if len(pending) >= ahead:
+                    break
+            if not pending:
+                break
+            data, count, bad = pending.popleft().result()
+            output.write(data)
+            frames += count
+            malformed += bad
+    return frames, malformed
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Convert raw nRF Sniffer for 802.15.4 serial logs to pcap or pcapng")
+    parser.add_argument("log", help="Log of the sniffer serial output")
+    parser.add_argument("output", help="File to write, - for standard output")
+    parser.add_argument("--format", choices=[FORMAT_PCAP, FORMAT_PCAPNG], default=FORMAT_PCAP, help="Output format")
+    parser.add_argument("--metadata", choices=["ieee802154-tap"], help="Write TAP records with channel, RSSI and LQI")
+    parser.add_argument("--channel", type=int, default=11, help="Channel the log was captured on")
+    parser.add_argument(
+        "--start", help="UNIX time or ISO 8601 local time of the first frame; default: log mtime is the last frame"
+    )
+    parser.add_argument("--jobs", type=int, help="Worker processes, the CPU count by default")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE // 1024 // 1024, help="Chunk size in MB")
+    args = parser.parse_args()
+
+    dlt = DLT.DLT_IEEE802_15_4_TAP if args.metadata else DLT.DLT_IEEE802_15_4_NOFCS
+    started = time.perf_counter()
+    output = os.fdopen(os.dup(1), "wb") if args.output == "-" else open(args.output, "wb")
+    with output:
+        frames, malformed = convert(
+            args.log,
+            output,
+            args.format,
+            dlt,
+            args.channel,
+            parse_time(args.start) if args.start else None,
+            args.jobs,
+            args.chunk_size * 1024 * 1024,
+        )
+    print(
+        "%d frames converted, %d malformed lines, in %.1f s" % (frames, malformed, time.perf_counter() - started),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Long-running capture daemon. It owns the sniffer devices, keeps them
+receiving, and streams pcap to any number of clients attached through a
+Unix socket. POSIX only.
+
+Start it with:
+python -m nrf802154_sniffer.daemon --device /dev/ttyACM0:15
+
+It listens on $XDG_RUNTIME_DIR/nrf802154_sniffer.sock, or in a directory
+private to the user under the temporary directory, unless --socket says
+otherwise, and refuses to start while another daemon answers there.
+
+Clients send one request line and get a reply:
+  attach [<device>] [tap|fcs|nofcs]
+                                 pcap stream of the device, the first
+                                 one by default
+  channel [<device>] <channel>   retunes the device for all clients
+  status                         JSON description of devices and clients
+The extcap attaches with --daemon-socket instead of opening the device.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+from argparse import ArgumentParser
+from collections import deque
+
+from . import fcs
+from .discovery import private_directory
+from .nrf802154_sniffer import DLT, Nrf802154Sniffer, PcapWriter, pcap_header
+
+logger = logging.getLogger(__name__)
+
+
+def default_socket() -> str:
+    """
+    Returns the socket the daemon listens on by default: in the runtime
+    directory of the user, or in a directory of the user under the
+    temporary directory where there is none.
+    """
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if directory:
+        return os.path.join(directory, "nrf802154_sniffer.sock")
+    return os.path.join(tempfile.gettempdir(), "nrf802154_sniffer-%d" % os.getuid(), "daemon.sock")
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Removes the socket of a daemon that is gone. Raises RuntimeError if a
+    daemon still answers on it, or if path is not a socket.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError("%s exists and is not a socket" % path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise RuntimeError("A daemon is already listening on %s" % path)
+
+
+class _ChunkSink:
+    """
+    File-like target for PcapWriter keeping each flush as one chunk.
+    """
+
+    def __init__(self):
+        self.chunk = b""
+
+    def write(self, data):
+        self.chunk += bytes(data)
+        return len(data)
+
+
+class Subscriber:
+    """
+    Client of a device stream with its own bounded buffer of encoded
+    batches. The device never waits for a subscriber: batches that do not
+    fit in max_bytes are dropped for that subscriber only.
+    """
+
+    def __init__(self, dlt: int, max_bytes: int):
+        self.dlt = dlt
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def offer(self, chunk: bytes, frames: int) -> None:
+        with self.condition:
+            if self.size + len(chunk) > self.max_bytes:
+                self.dropped_frames += frames
+                return
+            self.chunks.append((chunk, frames))
+            self.size += len(chunk)
+            self.condition.notify()
+
+    def take(self, timeout: float) -> tuple[bytes, int]:
+        """
+        Returns all buffered data and its frame count, waiting up to timeout
+        seconds for some.
+        """
+        with self.condition:
+            if not self.chunks and not self.closed:
+                self.condition.wait(timeout)
+            chunks = list(self.chunks)
+            self.chunks.clear()
+            self.size = 0
+        return b"".join(chunk for chunk, _ in chunks), sum(frames for _, frames in chunks)
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def status(self) -> dict:
+        return {
+            "dlt": self.dlt,
+            "buffered_bytes": self.size,
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.dropped_frames,
+        }
+
+
+class DeviceStream:
+    """
+    Capture of one device with the streaming API, encoded once per DLT in
+    use and fanned out to the subscribers.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, dev: str, channel: int, **sniffer_options):
+        self.dev = dev
+        self.channel = channel
+        self.sniffer = Nrf802154Sniffer(**sniffer_options)
+        self.subscribers: list[Subscriber] = []
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.running = False
+        self.thread = None
+        self.writers = {}
+
+    def start(self) -> None:
+        # Frames keep their FCS for the clients that want it; it is
+        # stripped for the others when encoding.
+        self.sniffer.start_stream(self.dev, self.channel, keep_fcs=True)
+        self.running = True
+        self.thread = threading.Thread(target=self.pump, name="pump %s" % self.dev, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.sniffer.stop_stream()
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+
+    def set_channel(self, channel: int) -> None:
+        self.sniffer.set_channel(channel)
+        self.channel = channel
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+    def encode(self, packets, dlt: int) -> bytes:
+        """
+        Encodes packets for the clients of one link type. FCS and TAP
+        records keep the FCS, which TAP records declare.
+        """
+        keep_fcs = dlt != DLT.DLT_IEEE802_15_4_NOFCS
+        if dlt not in self.writers:
+            sink = _ChunkSink()
+            self.writers[dlt] = sink, PcapWriter(sink, dlt, max_delay=float("inf"), fcs=keep_fcs)
+        sink, writer = self.writers[dlt]
+        sink.chunk = b""
+        for p in packets:
+            writer.write_packet(
+                p.content if keep_fcs else p.content[:-fcs.FCS_LENGTH], p.channel, p.rssi, p.lqi, p.timestamp
+            )
+        writer.flush()
+        return sink.chunk
+
+    def pump(self) -> None:
+        while self.running:
+            packets = self.sniffer.get_batch(Nrf802154Sniffer.RING_SLOTS, self.POLL_INTERVAL)
+            if not packets:
+                if self.sniffer.stream_ended:
+                    logger.error("Capture from %s ended", self.dev)
+                    break
+                continue
+            self.frames += len(packets)
+            # The list is replaced, never modified, so it can be read
+            # without the lock.
+            subscribers = self.subscribers
+            chunks = {}
+            for subscriber in subscribers:
+                chunk = chunks.get(subscriber.dlt)
+                if chunk is None:
+                    chunk = chunks[subscriber.dlt] = self.encode(packets, subscriber.dlt)
+                subscriber.offer(chunk, len(packets))
+
+    def status(self) -> dict:
+        return {
+            "device": self.dev,
+            "channel": self.channel,
+            "frames": self.frames,
+            "dropped_frames": self.sniffer.dropped_frames(),
+            "subscribers": [s.status() for s in self.subscribers],
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "SnifferDaemon"
+
+    def handle(self):
+        words = self.rfile.readline(1024).decode(errors="replace").split()
+        try:
+            match words:
+                case ["attach", *options]:
+                    self.attach(options)
+                case ["channel", *options] if options:
+                    stream = self.server.find_stream(options[:-1])
+                    stream.set_channel(int(options[-1]))
+                    self.wfile.write(b"ok\n")
+                case ["status"]:
+                    self.wfile.write(json.dumps(self.server.status()).encode() + b"\n")
+                case _:
+                    self.wfile.write(b"error: unknown request\n")
+        except (ValueError, RuntimeError) as e:
+            self.wfile.write(b"error: %s\n" % str(e).encode())
+        except OSError:
+            pass
+
+    LINK_TYPES = {
+        "tap": DLT.DLT_IEEE802_15_4_TAP,
+        "fcs": DLT.DLT_IEEE802_15_4_WITHFCS,
+        "nofcs": DLT.DLT_IEEE802_15_4_NOFCS,
+    }
+
+    def attach(self, options):
+        dlt = DLT.DLT_IEEE802_15_4_NOFCS
+        if options and options[-1] in self.LINK_TYPES:
+            dlt = self.LINK_TYPES[options.pop()]
+        stream = self.server.find_stream(options)
+
+        subscriber = Subscriber(dlt, self.server.subscriber_buffer)
+        self.wfile.write(self.server.headers[dlt])
+        stream.subscribe(subscriber)
+        logger.info("Client attached to %s", stream.dev)
+        try:
+            while not subscriber.closed:
+                data, frames = subscriber.take(DeviceStream.POLL_INTERVAL)
+                if data:
+                    self.wfile.write(data)
+                    subscriber.sent_frames += frames
+        finally:
+            stream.unsubscribe(subscriber)
+            logger.info(
+                "Client detached from %s, %d frames dropped for it", stream.dev, subscriber.dropped_frames
+            )
+
+
+class SnifferDaemon(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix socket server in front of one DeviceStream per device.
+    :param devices: list of (device, channel) pairs
+    :param subscriber_buffer: bytes buffered per client before its
+                              batches are dropped
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, devices, subscriber_buffer=4 * 1024 * 1024, **sniffer_options):
+        remove_stale_socket(socket_path)
+        self.socket_path = socket_path
+        self.subscriber_buffer = subscriber_buffer
+        self.streams = [DeviceStream(dev, channel, **sniffer_options) for dev, channel in devices]
+        self.headers = {dlt: pcap_header(dlt) for dlt in DLT}
+        super().__init__(socket_path, _RequestHandler)
+
+    def find_stream(self, options) -> DeviceStream:
+        if not options:
+            return self.streams[0]
+        for stream in self.streams:
+            if stream.dev == options[0]:
+                return stream
+        raise ValueError("no such device: %s" % options[0])
+
+    def status(self) -> dict:
+        return {"devices": [stream.status() for stream in self.streams]}
+
+    def run(self) -> None:
+        for stream in self.streams:
+            stream.start()
+            logger.info("Capturing from %s on channel %d", stream.dev, stream.channel)
+        try:
+            self.serve_forever()
+        finally:
+            for stream in self.streams:
+                stream.stop()
+            self.server_close()
+            os.unlink(self.socket_path)
+
+
+def attach(socket_path=None, device=None, metadata=None):
+    """
+    Attaches to a running daemon and returns a binary file with the pcap
+    stream of the device, the first one by default.
+    :param socket_path: socket of the daemon, default_socket() if None
+    :param metadata: "ieee802154-tap" for TAP records, "ieee802154-fcs" for
+                     frames with their FCS
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path or default_socket())
+    link_type = {"ieee802154-tap": "tap", "ieee802154-fcs": "fcs"}.get(metadata, "nofcs")
+    request = ["attach"] + ([device] if device else []) + [link_type]
+    client.sendall(" ".join(request).encode() + b"\n")
+    stream = client.makefile("rb")
+    client.close()
+    return stream
+
+
+def parse_device(value: str) -> tuple[str, int]:
+    dev, _, channel = value.rpartition(":")
+    if not dev:
+        return value, 11
+    return dev, int(channel)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Capture daemon for the nRF Sniffer for 802.15.4")
+    parser.add_argument("--socket", help="Unix socket to listen on, in $XDG_RUNTIME_DIR by default")
+    parser.add_argument(
+        "--device",
+        action="append",
+        type=parse_device,
+        help="Device to capture from as PORT[:CHANNEL]; may be repeated. All connected sniffers on channel 11 by default",
+    )
+    parser.add_argument(
+        "--subscriber-buffer", type=int, default=4096, help="Kilobytes buffered per client before frames are dropped"
+    )
+    parser.add_argument("--transport", choices=["queue", "shm"], default="queue", help="Reader to daemon transport")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+    devices = args.device or [(port, 11) for port in Nrf802154Sniffer.sniffer_ports()]
+    if not devices:
+        parser.error("no sniffer devices connected")
+
+    socket_path = args.socket
+    if socket_path is None:
+        socket_path = default_socket()
+        if not private_directory(os.path.dirname(socket_path)):
+            parser.error("%s is not a directory only the user can write to" % os.path.dirname(socket_path))
+    try:
+        server = SnifferDaemon(socket_path, devices, args.subscriber_buffer * 1024, transport=args.transport)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    def shutdown(*_):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
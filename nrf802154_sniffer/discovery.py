@@ -0,0 +1,404 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Extcap discovery: the answers to Wireshark's --extcap-interfaces,
+--extcap-dlts and --extcap-config queries and to capture filter checks.
+
+Wireshark runs the extcap for these on every start and interface refresh,
+so this module sticks to the standard library and imports pyserial's port
+listing only when it has to enumerate the ports.
+"""
+
+import os
+import time
+
+# USB device identification.
+NORDICSEMI_VID = 0x1915
+SNIFFER_802154_PID = 0x154B
+
+# Helpers for Wireshark argument parsing.
+CTRL_ARG_CHANNEL = 0
+CTRL_ARG_LOGGER = 6
+
+CHANNELS = range(11, 27)
+
+# Interface capturing from all connected dongles at once.
+MULTI_INTERFACE = "nrf802154-multi"
+
+# Link types offered to Wireshark: http://www.tcpdump.org/linktypes.html
+DLT_IEEE802_15_4_NOFCS = 230
+DLT_IEEE802_15_4_TAP = 283
+DLT_IEEE802_15_4_WITHFCS = 195
+
+# Longest a listing of the sniffer ports is reused by later runs, in
+# seconds. Wireshark queries the interfaces, then the DLTs and config of
+# each of them within a second or so.
+PORT_CACHE_MAX_AGE = 5.0
+
+
+def port_cache_path() -> str:
+    """
+    Returns the file the listing of the sniffer ports is cached in, in the
+    cache directory of the user.
+    """
+    directory = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(directory, "nrf802154_sniffer", "ports")
+
+
+def private_directory(directory: str) -> bool:
+    """
+    Creates directory if needed and returns whether it belongs to the user
+    and nobody else can write to it.
+    """
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        status = os.stat(directory)
+    except OSError:
+        return False
+    return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+
+def device_set_key() -> str | None:
+    """
+    Returns a value that changes whenever a device is plugged in or removed,
+    or None where there is no cheap way to tell, which disables the cache.
+    On Linux and macOS device nodes come and go in /dev, which updates its
+    mtime.
+    """
+    if not hasattr(os, "getuid"):
+        return None
+    try:
+        return "%d" % os.stat("/dev").st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_port_cache(path: str, key: str, max_age: float) -> list[str] | None:
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    except OSError:
+        return None
+    try:
+        with open(fd) as f:
+            if os.fstat(fd).st_uid != os.getuid():
+                return None
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    if len(lines) < 2 or lines[0] != key:
+        return None
+    try:
+        age = time.time() - float(lines[1])
+    except ValueError:
+        return None
+    if not 0 <= age <= max_age:
+        return None
+    return lines[2:]
+
+
+def _write_port_cache(path: str, key: str, ports: list[str]) -> None:
+    if not private_directory(os.path.dirname(path)):
+        return
+    temporary = "%s.%d" % (path, os.getpid())
+    try:
+        # Exclusive creation never follows a link left in place of the file.
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    except OSError:
+        return
+    try:
+        with open(fd, "w") as f:
+            f.write("\n".join([key, repr(time.time())] + ports) + "\n")
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+
+
+def sniffer_ports(max_age: float = PORT_CACHE_MAX_AGE) -> list[str]:
+    """
+    Returns the serial ports of all connected sniffer devices, sorted.
+    A listing made by an earlier run is reused for up to max_age seconds,
+    unless devices were plugged in or removed since; 0 always enumerates.
+    There is no cache where device_set_key cannot tell these changes.
+    """
+    path = port_cache_path()
+    key = device_set_key()
+    if key is None:
+        max_age = 0
+    if max_age > 0:
+        ports = _read_port_cache(path, key, max_age)
+        if ports is not None:
+            return ports
+
+    from serial.tools.list_ports import comports
+
+    ports = sorted(
+        port.device
+        for port in comports()
+        if port.vid == NORDICSEMI_VID and port.pid == SNIFFER_802154_PID
+    )
+    if key is not None:
+        _write_port_cache(path, key, ports)
+    return ports
+
+
+def extcap_interfaces():
+    """
+    Wireshark-related method that returns configuration options.
+    :return: string with wireshark-compatible information
+    """
+    res = []
+    res.append(
+        "extcap {version=0.8.0}{help=https://github.com/NordicSemiconductor/nRF-Sniffer-for-802.15.4}{display=nRF Sniffer for 802.15.4}"
+    )
+    ports = sniffer_ports()
+    for port in ports:
+        res.append(
+            "interface {value=%s}{display=nRF Sniffer for 802.15.4}"
+            % (port,)
+        )
+    if len(ports) > 1:
+        res.append(
+            "interface {value=%s}{display=nRF Sniffer for 802.15.4 (all devices)}"
+            % (MULTI_INTERFACE,)
+        )
+
+    res.append(
+        "control {number=%d}{type=selector}{display=Channel}{tooltip=IEEE 802.15.4 capture channel}"
+        % CTRL_ARG_CHANNEL
+    )
+    res.append(
+        "control {number=%d}{type=button}{role=logger}{display=Log}{tooltip=Show capture log}"
+        % CTRL_ARG_LOGGER
+    )
+    for channel in CHANNELS:
+        res.append(
+            "value {control=%d}{value=%d}{display=%d}%s"
+            % (CTRL_ARG_CHANNEL, channel, channel, "{default=true}" if channel == 11 else "")
+        )
+
+    return "\n".join(res)
+
+
+def extcap_dlts():
+    """
+    Wireshark-related method that returns configuration options.
+    :return: string with wireshark-compatible information
+    """
+    res = []
+    res.append(
+        "dlt {number=%d}{name=IEEE802_15_4_TAP}{display=IEEE 802.15.4 TAP}"
+        % DLT_IEEE802_15_4_TAP
+    )
+    res.append(
+        "dlt {number=%d}{name=IEEE802_15_4_NOFCS}{display=IEEE 802.15.4 without FCS}"
+        % DLT_IEEE802_15_4_NOFCS
+    )
+    res.append(
+        "dlt {number=%d}{name=IEEE802_15_4_WITHFCS}{display=IEEE 802.15.4 with FCS}"
+        % DLT_IEEE802_15_4_WITHFCS
+    )
+
+    return "\n".join(res)
+
+
+def extcap_config(option, interface=None):
+    """
+    Wireshark-related method that returns configuration options.
+    :return: string with wireshark-compatible information
+    """
+    args = []
+    values = []
+    res = []
+    multi = interface == MULTI_INTERFACE
+
+    if multi:
+        ports = sniffer_ports()
+        args.append(
+            (
+                0,
+                "--channels",
+                "Channels",
+                "Comma separated IEEE 802.15.4 channels, one per device in port order",
+                "string",
+                "{required=true}{default=%s}"
+                % ",".join(str(11 + i) for i in range(min(len(ports), 16))),
+            )
+        )
+    else:
+        args.append(
+            (
+                0,
+                "--channel",
+                "Channel",
+                "IEEE 802.15.4 channel",
+                "selector",
+                "{required=true}{default=11}",
+            )
+        )
+    args.append(
+        (
+            1,
+            "--metadata",
+            "Out-Of-Band meta-data",
+            "Packet header containing out-of-band meta-data for channel, RSSI and LQI",
+            "selector",
+            "{default=none}",
+        )
+    )
+    if not multi:
+        args.append(
+            (
+                2,
+                "--survey-dwell",
+                "Channel survey dwell time",
+                "Hop through all channels, staying this many seconds on each; 0 captures on the selected channel",
+                "double",
+                "{default=0}",
+            )
+        )
+    args.append(
+        (
+            3,
+            "--fcs-policy",
+            "Bad FCS",
+            "What to do with frames whose FCS does not match; flagging needs TAP or FCS meta-data",
+            "selector",
+            "{default=pass}",
+        )
+    )
+
+    if len(option) <= 0:
+        for arg in args:
+            res.append(
+                "arg {number=%d}{call=%s}{display=%s}{tooltip=%s}{type=%s}%s" % arg
+            )
+
+        if not multi:
+            values = values + [
+                (0, "%d" % i, "%d" % i, "true" if i == 11 else "false")
+                for i in range(11, 27)
+            ]
+
+        values.append((1, "ieee802154-tap", "IEEE 802.15.4 TAP", "true"))
+        values.append((1, "ieee802154-fcs", "IEEE 802.15.4 with FCS", "false"))
+        values.append((1, "none", "None", "false"))
+        values.append((3, "pass", "Pass unchecked", "true"))
+        values.append((3, "drop", "Drop", "false"))
+        values.append((3, "flag", "Flag", "false"))
+
+    for value in values:
+        res.append("value {arg=%d}{value=%s}{display=%s}{default=%s}" % value)
+    res.append(
+        "control {number=4}{type=button}{role=logger}{display=Log}{tooltip=Show capture log}"
+    )
+    return "\n".join(res)
+
+
+# Options of the discovery invocations, and whether each takes a value.
+DISCOVERY_OPTIONS = {
+    "--extcap-interfaces": False,
+    "--extcap-dlts": False,
+    "--extcap-config": False,
+    "--extcap-interface": True,
+    "--extcap-reload-option": True,
+    "--extcap-capture-filter": True,
+}
+# Options Wireshark may add to any invocation that change nothing in the
+# answers, and whether each takes a value.
+IGNORED_OPTIONS = {
+    "--extcap-version": True,
+    "--debug": False,
+    "--debug-file": True,
+}
+
+
+def run(argv: list[str]) -> bool:
+    """
+    Answers a discovery invocation of the extcap. Returns False without
+    printing anything for any other command line, including one with
+    options this does not know about, so that the caller can go through
+    the full argument parser instead.
+    """
+    options = {}
+    arguments = iter(argv)
+    skip = False
+    for argument in arguments:
+        name, separator, value = argument.partition("=")
+        if skip and not argument.startswith("-"):
+            # Value of an ignored option.
+            skip = False
+            continue
+        skip = False
+        if name in IGNORED_OPTIONS:
+            skip = IGNORED_OPTIONS[name] and not separator
+            continue
+        takes_value = DISCOVERY_OPTIONS.get(name)
+        if takes_value is None or (separator and not takes_value):
+            return False
+        if takes_value and not separator:
+            value = next(arguments, None)
+            if value is None:
+                return False
+        options[name] = value if takes_value else True
+    if not options:
+        return False
+
+    capture_filter = options.get("--extcap-capture-filter")
+    if capture_filter:
+        # Wireshark validates capture filters by running the extcap without
+        # --capture; any output marks the filter as invalid.
+        try:
+            from .capture_filter import compile_filter
+        except ImportError:
+            from capture_filter import compile_filter
+        try:
+            compile_filter(capture_filter)
+        except ValueError as e:
+            print(e)
+        return True
+
+    if options.get("--extcap-interfaces"):
+        print(extcap_interfaces())
+    if options.get("--extcap-dlts"):
+        print(extcap_dlts())
+    if options.get("--extcap-config"):
+        print(extcap_config(options.get("--extcap-reload-option") or "", options.get("--extcap-interface")))
+    return True
@@ -0,0 +1,282 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Stand-in for the sniffer firmware on a pseudo terminal, so that the capture
+pipeline can be exercised and benchmarked without hardware. POSIX only.
+
+The device answers the shell commands used by the extcap (sleep, shell
+echo off, channel, receive) the way the bundled firmware does: it prints
+no prompt and nothing on success, and rejects commands with the error
+messages of the firmware images. While receiving, it streams "received:"
+lines at a configurable rate. Each generated frame is a valid 802.15.4
+data frame whose payload starts with the time.monotonic_ns() at which it
+was sent and its index, so consumers can measure latency and losses.
+"""
+
+import itertools
+import os
+import random
+import select
+import struct
+import time
+from collections.abc import Mapping
+from multiprocessing import Event, Process, RawValue
+
+try:
+    from .fcs import FCS_LENGTH, crc16
+except ImportError:
+    from fcs import FCS_LENGTH, crc16
+
+# Data frame, PAN ID compression, short addresses, frame version 2006.
+FRAME_CONTROL = 0x8841
+PAN_ID = 0x1A62
+DST_ADDRESS = 0xFFFF
+SRC_ADDRESS = 0x0001
+HEADER = struct.Struct("<HBHHH")
+STAMP = struct.Struct("<QI")
+MIN_FRAME_LENGTH = HEADER.size + STAMP.size + FCS_LENGTH
+MAX_FRAME_LENGTH = 127
+
+TIMER_MAX = 2**32
+
+
+def clamp_length(length: int) -> int:
+    return min(max(length, MIN_FRAME_LENGTH), MAX_FRAME_LENGTH)
+
+
+def read_stamp(frame: bytes) -> tuple[int, int] | None:
+    """
+    Returns the (send time in ns, frame index) stamped into a frame
+    generated by FakeSnifferDevice, or None for other frames.
+    """
+    if len(frame) < HEADER.size + STAMP.size or HEADER.unpack_from(frame)[0] != FRAME_CONTROL:
+        return None
+    return STAMP.unpack_from(frame, HEADER.size)
+
+
+class FakeSnifferDevice:
+    """
+    Emulated sniffer device. Open .port with the sniffer as if it was the
+    serial port of a real device.
+    :param rate: frames per second streamed while receiving
+    :param frame_sizes: PSDU length of every frame, including the FCS:
+                        a (min, max) range drawn uniformly, a
+                        {length: weight} table, or a callable taking the
+                        device's random.Random and returning a length.
+                        Lengths are clamped to what a generated frame
+                        can have.
+    :param timer_start: initial value of the 32-bit microsecond timer
+    :param active_channels: channels with traffic, all if None
+    :param bad_fcs: fraction of frames sent with a corrupted FCS
+    """
+
+    def __init__(
+        self,
+        rate=1000,
+        frame_sizes=(MIN_FRAME_LENGTH, MAX_FRAME_LENGTH),
+        seed=0,
+        timer_start=0,
+        active_channels=None,
+        bad_fcs=0.0,
+    ):
+        import pty
+        import tty
+
+        self.rate = rate
+        # Exactly one of these describes the frame lengths.
+        self.frame_sizes = None
+        self.size_table = None
+        self.size_sampler = None
+        if callable(frame_sizes):
+            self.size_sampler = frame_sizes
+        elif isinstance(frame_sizes, Mapping):
+            if not frame_sizes or min(frame_sizes.values()) < 0 or not sum(frame_sizes.values()):
+                raise ValueError("Frame size weights must be non-negative and not all zero")
+            lengths = [clamp_length(length) for length in frame_sizes]
+            self.size_table = (lengths, list(itertools.accumulate(frame_sizes.values())))
+        else:
+            self.frame_sizes = (clamp_length(frame_sizes[0]), clamp_length(frame_sizes[1]))
+        self.seed = seed
+        self.timer_start = timer_start
+        self.active_channels = active_channels
+        self.bad_fcs = bad_fcs
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.sent = RawValue("q", 0)
+        self.channel = RawValue("i", 11)
+        self.stop_event = Event()
+        self.worker = None
+
+    def start(self):
+        """
+        Runs the device in a separate process, so that generating frames
+        does not compete with the pipeline under test for the GIL.
+        """
+        self.worker = Process(target=self.run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def frame_length(self, rng) -> int:
+        if self.size_sampler is not None:
+            return clamp_length(self.size_sampler(rng))
+        if self.size_table is not None:
+            lengths, cum_weights = self.size_table
+            return rng.choices(lengths, cum_weights=cum_weights)[0]
+        return rng.randint(*self.frame_sizes)
+
+    def frame(self, rng, index: int) -> bytes:
+        length = self.frame_length(rng)
+        frame = HEADER.pack(FRAME_CONTROL, index & 0xFF, PAN_ID, DST_ADDRESS, SRC_ADDRESS)
+        frame += STAMP.pack(time.monotonic_ns(), index & 0xFFFFFFFF)
+        frame += bytes(length - len(frame) - FCS_LENGTH)
+        crc = crc16(frame)
+        if self.bad_fcs and rng.random() < self.bad_fcs:
+            crc ^= 0xFFFF
+        return frame + struct.pack("<H", crc)
+
+    def write(self, data: bytes):
+        """
+        Writes to the terminal, waiting while nobody drains it, like a USB
+        device whose host stopped polling.
+        """
+        view = memoryview(data)
+        while view and not self.stop_event.is_set():
+            try:
+                view = view[os.write(self.master, view):]
+            except BlockingIOError:
+                select.select([], [self.master], [], 0.05)
+
+    def run(self):
+        """
+        Device main loop: answers commands and streams frames.
+        """
+        rng = random.Random(self.seed)
+        os.set_blocking(self.master, False)
+        echo = True
+        receiving = False
+        command = b""
+        booted = time.monotonic()
+        started = 0.0
+        streamed = 0
+
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.001)
+            if readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    return
+                if echo:
+                    self.write(data)
+                command += data
+                *lines, command = command.replace(b"\r\n", b"\n").replace(b"\r", b"\n").split(b"\n")
+                for line in lines:
+                    words = line.split()
+                    reply = None
+                    if not words:
+                        pass
+                    elif words[0] in (b"sleep", b"receive"):
+                        if len(words) != 1:
+                            reply = b"%s: wrong parameter count" % words[0]
+                        elif words[0] == b"sleep":
+                            receiving = False
+                        else:
+                            receiving = True
+                            started = time.monotonic()
+                            streamed = 0
+                    elif words[0] == b"channel":
+                        # The firmware has no message for a channel it
+                        # cannot tune to.
+                        if len(words) != 2:
+                            reply = b"invalid number of parameters: %d" % len(words)
+                        elif words[1].isdigit() and 11 <= int(words[1]) <= 26:
+                            self.channel.value = int(words[1])
+                    elif words[0] == b"shell":
+                        if len(words) == 1:
+                            reply = b"Please specify a subcommand."
+                        elif words[1] != b"echo":
+                            reply = b"shell: unknown parameter: %s" % words[1]
+                        elif len(words) == 2:
+                            reply = b"Echo status: %s" % (b"on" if echo else b"off")
+                        elif len(words) > 3:
+                            reply = b"echo: wrong parameter count"
+                        elif words[2] in (b"on", b"off"):
+                            echo = words[2] == b"on"
+                        else:
+                            reply = b"echo: unknown parameter: %s" % words[2]
+                    else:
+                        reply = b"%s: command not found" % words[0]
+                    if reply is not None:
+                        self.write(reply + b"\r\n")
+
+            if receiving:
+                due = int((time.monotonic() - started) * self.rate) - streamed
+                if due > 0 and self.active_channels is not None and self.channel.value not in self.active_channels:
+                    streamed += due
+                elif due > 0:
+                    lines = []
+                    for _ in range(due):
+                        index = self.sent.value
+                        timer = (self.timer_start + int((time.monotonic() - booted) * 10**6)) % TIMER_MAX
+                        lines.append(
+                            b"received: %s power: %d lqi: %d time: %d\r\n"
+                            % (self.frame(rng, index).hex().encode(), rng.randint(-90, -30), rng.randint(50, 255), timer)
+                        )
+                        self.sent.value = index + 1
+                    streamed += due
+                    self.write(b"".join(lines))
@@ -0,0 +1,83 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+IEEE 802.15.4 frame check sequence: CRC-16/ITU-T over the MAC header and
+payload, sent least significant byte first after them.
+
+The CRC is the bit-reflected form of the one binascii.crc_hqx computes,
+so frames go through a 256-entry bit reversal table and the table-driven
+C implementation does the rest. Over a whole frame, FCS included, the
+CRC of a valid frame is zero, which saves both extracting the received
+FCS and reflecting the result back.
+"""
+
+from binascii import crc_hqx
+
+# What to do with frames whose FCS does not match: pass them on
+# unchecked, drop them, or keep the FCS in the output so that Wireshark
+# marks them.
+PASS = "pass"
+DROP = "drop"
+FLAG = "flag"
+POLICIES = (PASS, DROP, FLAG)
+
+FCS_LENGTH = 2
+
+REVERSED_BITS = bytes(int("{:08b}".format(i)[::-1], 2) for i in range(256))
+
+
+def crc16(data: bytes) -> int:
+    """
+    Returns the CRC-16/ITU-T (also known as Kermit) of data.
+    """
+    crc = crc_hqx(data.translate(REVERSED_BITS), 0)
+    return REVERSED_BITS[crc & 0xFF] << 8 | REVERSED_BITS[crc >> 8]
+
+
+def fcs_valid(frame: bytes) -> bool:
+    """
+    Returns whether the last two bytes of frame are the FCS of the rest.
+    """
+    return len(frame) >= FCS_LENGTH and not crc_hqx(frame.translate(REVERSED_BITS), 0)
+
+
+def check_frames(frames) -> list[bool]:
+    """
+    Returns fcs_valid for every frame of an iterable, in order.
+    """
+    table = REVERSED_BITS
+    return [len(frame) >= FCS_LENGTH and not crc_hqx(frame.translate(table), 0) for frame in frames]
@@ -0,0 +1,274 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Capture hooks: the optional consumers of a capture, such as metrics, top
+talkers and channel surveys, behind the one interface that every capture
+path drives, whether it reads one device, several, or runs on an asyncio
+event loop.
+"""
+
+import time
+from abc import ABC, abstractmethod
+
+
+class CaptureHook:
+    """
+    Base of the capture hooks. The capture calls start() once its outputs
+    are open, add() with every batch of frames it writes, timeout() to
+    know how long it may wait before poll() is due, poll() after handling
+    each item or wait, and stop() when it ends. All methods run on the
+    writer side of the capture.
+    """
+
+    def start(self, writer) -> None:
+        pass
+
+    def timeout(self) -> float | None:
+        """
+        Returns the number of seconds until poll() has work to do, or None
+        if it has none.
+        """
+        return None
+
+    def add(self, batch, channel: int) -> None:
+        """
+        Accounts a batch of frames written to the output, all received on
+        the given channel.
+        """
+        pass
+
+    def poll(self, writer) -> None:
+        """
+        Does the periodic work that is due. The writer is the capture
+        output, or None where frames are handed over as they arrive.
+        """
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class HookGroup(CaptureHook):
+    """
+    Drives several hooks as one.
+    """
+
+    def __init__(self, hooks):
+        self.hooks = list(hooks)
+
+    def __len__(self) -> int:
+        return len(self.hooks)
+
+    def start(self, writer) -> None:
+        for hook in self.hooks:
+            hook.start(writer)
+
+    def timeout(self) -> float | None:
+        return min((t for hook in self.hooks if (t := hook.timeout()) is not None), default=None)
+
+    def add(self, batch, channel: int) -> None:
+        for hook in self.hooks:
+            hook.add(batch, channel)
+
+    def poll(self, writer) -> None:
+        for hook in self.hooks:
+            hook.poll(writer)
+
+    def stop(self) -> None:
+        for hook in self.hooks:
+            hook.stop()
+
+
+class PeriodicHook(CaptureHook, ABC):
+    """
+    Hook publishing a report every interval seconds, if an interval is
+    given, and once more when the capture stops. Subclasses implement
+    publish().
+    """
+
+    def __init__(self, interval: float | None = None):
+        self.interval = interval
+        self.due = None
+
+    def start(self, writer) -> None:
+        if self.interval:
+            self.due = time.monotonic() + self.interval
+
+    def timeout(self) -> float | None:
+        if self.due is None:
+            return None
+        return max(0.0, self.due - time.monotonic())
+
+    def poll(self, writer) -> None:
+        if self.due is not None and time.monotonic() >= self.due:
+            self.due += self.interval
+            self.publish()
+
+    def stop(self) -> None:
+        self.due = None
+        self.publish()
+
+    @abstractmethod
+    def publish(self) -> None:
+        pass
+
+
+class MetricsHook(PeriodicHook):
+    """
+    Accounts the batches of frames once the output has written them out,
+    and logs the capture metrics, also writing them to a file in
+    Prometheus text format if one is given.
+    """
+
+    def __init__(self, sniffer, metrics, interval=None, path=None):
+        super().__init__(interval)
+        self.sniffer = sniffer
+        self.metrics = metrics
+        self.path = path
+        # Batches written to the output but maybe not flushed yet.
+        self.pending = []
+        self.flush_count = 0
+
+    def start(self, writer) -> None:
+        super().start(writer)
+        self.pending = []
+        self.flush_count = 0 if writer is None else writer.flush_count
+
+    def add(self, batch, channel: int) -> None:
+        self.pending.append((len(batch.packets), batch.read_time, batch.queued_time, time.monotonic_ns()))
+
+    def poll(self, writer) -> None:
+        if writer is None or writer.flush_count != self.flush_count:
+            self.record()
+            if writer is not None:
+                self.flush_count = writer.flush_count
+        super().poll(writer)
+
+    def stop(self) -> None:
+        self.record()
+        super().stop()
+
+    def record(self) -> None:
+        if self.pending:
+            self.metrics.record_written(self.pending)
+            self.pending = []
+
+    def publish(self) -> None:
+        snapshot = self.sniffer.stats()
+        self.sniffer.logger.info("Capture metrics: %s", self.metrics.format_log(snapshot))
+        if self.path:
+            try:
+                self.metrics.dump_prometheus(self.path, snapshot, {"device": self.sniffer.dev or "multi"})
+            except OSError as e:
+                self.sniffer.logger.warning("Cannot write metrics file: %s", e)
+
+
+class TalkersHook(PeriodicHook):
+    """
+    Counts the frames of every source, logging the busiest ones and
+    writing the counts to a file as JSON if one is given.
+    """
+
+    def __init__(self, sniffer, talkers, interval=None, path=None):
+        super().__init__(interval)
+        self.sniffer = sniffer
+        self.talkers = talkers
+        self.path = path
+
+    def add(self, batch, channel: int) -> None:
+        self.talkers.add(batch.packets, channel)
+
+    def publish(self) -> None:
+        snapshot = self.talkers.snapshot()
+        self.sniffer.logger.info(
+            "Top talkers: %s",
+            ", ".join(
+                "%s%s %d frames" % (s["pan"] + "/" if s.get("pan") else "", s["address"], s["frames"])
+                for s in snapshot["sources"][:5]
+            ) or "none",
+        )
+        if self.path:
+            try:
+                self.talkers.dump(self.path)
+            except OSError as e:
+                self.sniffer.logger.warning("Cannot write top talkers file: %s", e)
+
+
+class SurveyHook(CaptureHook):
+    """
+    Moves a channel survey to the next channel once the dwell time is
+    over, logging what was heard on the channel it leaves, and ends the
+    capture when the survey is complete. The summary is logged, and
+    written to a file as JSON if one is given, when the capture stops.
+    """
+
+    def __init__(self, sniffer, survey, path=None):
+        self.sniffer = sniffer
+        self.survey = survey
+        self.path = path
+
+    def start(self, writer) -> None:
+        self.survey.start()
+
+    def timeout(self) -> float | None:
+        return self.survey.timeout()
+
+    def add(self, batch, channel: int) -> None:
+        self.survey.add(batch.packets, channel)
+
+    def poll(self, writer) -> None:
+        left = self.survey.channel
+        channel = self.survey.poll()
+        if channel is None:
+            return
+        message = self.survey.format_channel(self.survey.stats[left].summary())
+        self.sniffer.logger.info("Survey %s", message)
+        self.sniffer.control_log(message)
+        if channel is False:
+            self.sniffer.end_capture()
+        else:
+            self.sniffer.set_channel(channel)
+
+    def stop(self) -> None:
+        self.survey.stop()
+        self.sniffer.logger.info("Channel survey summary:\n%s", self.survey.format_table())
+        if self.path:
+            try:
+                self.survey.dump(self.path)
+            except OSError as e:
+                self.sniffer.logger.warning("Cannot write survey file: %s", e)
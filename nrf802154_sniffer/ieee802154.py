@@ -0,0 +1,289 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Helpers for decoding IEEE 802.15.4 MAC headers of captured frames.
+"""
+
+import struct
+from enum import IntEnum
+
+
+class FrameType(IntEnum):
+    BEACON = 0
+    DATA = 1
+    ACK = 2
+    COMMAND = 3
+    MULTIPURPOSE = 5
+    FRAGMENT = 6
+    EXTENDED = 7
+
+
+class AddressMode(IntEnum):
+    NONE = 0
+    SHORT = 2
+    EXTENDED = 3
+
+
+# Frame control field bits.
+FC_FRAME_TYPE = 0x0007
+FC_SECURITY_ENABLED = 0x0008
+FC_FRAME_PENDING = 0x0010
+FC_ACK_REQUEST = 0x0020
+FC_PAN_ID_COMPRESSION = 0x0040
+FC_SEQUENCE_NUMBER_SUPPRESSION = 0x0100
+FC_DST_ADDR_MODE_SHIFT = 10
+FC_FRAME_VERSION_SHIFT = 12
+FC_SRC_ADDR_MODE_SHIFT = 14
+
+FRAME_VERSION_2015 = 2
+
+ADDRESS_LENGTH = {AddressMode.NONE: 0, AddressMode.SHORT: 2, AddressMode.EXTENDED: 8}
+
+SHORT_FIELD = struct.Struct("<H")
+EXTENDED_FIELD = struct.Struct("<Q")
+
+
+def frame_control(frame: bytes) -> int | None:
+    """
+    Returns the frame control field, or None if the frame is too short.
+    """
+    if len(frame) < 2:
+        return None
+    return frame[0] | frame[1] << 8
+
+
+def pan_id_presence(fc: int, dst_mode: int, src_mode: int) -> tuple[bool, bool]:
+    """
+    Returns whether the destination and source PAN IDs are present,
+    following the PAN ID compression rules of the frame version.
+    """
+    compression = bool(fc & FC_PAN_ID_COMPRESSION)
+    if (fc >> FC_FRAME_VERSION_SHIFT) & 3 < FRAME_VERSION_2015:
+        return bool(dst_mode), bool(src_mode) and not (compression and dst_mode)
+
+    # IEEE 802.15.4-2015, table 7-2.
+    if not dst_mode and not src_mode:
+        return compression, False
+    if dst_mode and not src_mode:
+        return not compression, False
+    if src_mode and not dst_mode:
+        return False, not compression
+    if dst_mode == AddressMode.EXTENDED and src_mode == AddressMode.EXTENDED:
+        return not compression, False
+    return True, not compression
+
+
+class MacHeader:
+    """
+    MAC header of a frame, decoded lazily: only the frame control field is
+    read up front, and the offsets of the other fields are looked up the
+    first time one of them is asked for. Fields are read straight from the
+    frame, which is neither copied nor sliced, so the frame may also be a
+    memoryview. Absent fields, and all fields but the frame control of
+    truncated or unsupported frames, are None; addresses are integers.
+    """
+
+    __slots__ = ("frame", "fc", "_offsets")
+
+    # Offsets of the sequence number, destination PAN ID and address and
+    # source PAN ID and address, for frames that cannot be decoded.
+    UNDECODED = (None, None, None, None, None)
+
+    # The offsets, followed by the header length, of every frame control
+    # value seen so far, or None if it is not supported. Frames of a
+    # network use only a handful of values.
+    layouts = {}
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.fc = frame_control(frame)
+        self._offsets = None
+
+    @property
+    def frame_type(self) -> int | None:
+        return None if self.fc is None else self.fc & FC_FRAME_TYPE
+
+    @property
+    def frame_version(self) -> int | None:
+        return None if self.fc is None else (self.fc >> FC_FRAME_VERSION_SHIFT) & 3
+
+    @property
+    def dst_mode(self) -> int | None:
+        return None if self.fc is None else (self.fc >> FC_DST_ADDR_MODE_SHIFT) & 3
+
+    @property
+    def src_mode(self) -> int | None:
+        return None if self.fc is None else (self.fc >> FC_SRC_ADDR_MODE_SHIFT) & 3
+
+    @property
+    def sequence_number(self) -> int | None:
+        offset = self.offsets()[0]
+        return None if offset is None else self.frame[offset]
+
+    @property
+    def dst_pan(self) -> int | None:
+        offset = self.offsets()[1]
+        return None if offset is None else SHORT_FIELD.unpack_from(self.frame, offset)[0]
+
+    @property
+    def dst_addr(self) -> int | None:
+        return self._address(self.offsets()[2], self.fc >> FC_DST_ADDR_MODE_SHIFT & 3)
+
+    @property
+    def src_pan(self) -> int | None:
+        """
+        Source PAN ID; a compressed one is reported as the destination
+        PAN ID.
+        """
+        offsets = self.offsets()
+        if offsets[3] is None:
+            return None if offsets[4] is None else self.dst_pan
+        return SHORT_FIELD.unpack_from(self.frame, offsets[3])[0]
+
+    @property
+    def src_addr(self) -> int | None:
+        return self._address(self.offsets()[4], self.fc >> FC_SRC_ADDR_MODE_SHIFT & 3)
+
+    def addressing(self) -> tuple:
+        """
+        Returns (dst_pan, dst_addr, src_pan, src_addr), for callers that
+        need all of them; cheaper than going through the properties.
+        """
+        _, dst_pan, dst_addr, src_pan, src_addr = self.offsets()
+        frame = self.frame
+        fc = self.fc
+        short = SHORT_FIELD.unpack_from
+        if dst_pan is not None:
+            dst_pan = short(frame, dst_pan)[0]
+        if dst_addr is not None:
+            field = short if fc >> FC_DST_ADDR_MODE_SHIFT & 3 == AddressMode.SHORT else EXTENDED_FIELD.unpack_from
+            dst_addr = field(frame, dst_addr)[0]
+        if src_pan is not None:
+            src_pan = short(frame, src_pan)[0]
+        elif src_addr is not None:
+            src_pan = dst_pan
+        if src_addr is not None:
+            field = short if fc >> FC_SRC_ADDR_MODE_SHIFT & 3 == AddressMode.SHORT else EXTENDED_FIELD.unpack_from
+            src_addr = field(frame, src_addr)[0]
+        return dst_pan, dst_addr, src_pan, src_addr
+
+    def _address(self, offset: int | None, mode: int) -> int | None:
+        if offset is None:
+            return None
+        field = SHORT_FIELD if mode == AddressMode.SHORT else EXTENDED_FIELD
+        return field.unpack_from(self.frame, offset)[0]
+
+    def offsets(self) -> tuple:
+        """
+        Returns the offsets of the sequence number, destination PAN ID,
+        destination address, source PAN ID and source address, with None
+        for absent fields.
+        """
+        offsets = self._offsets
+        if offsets is None:
+            layout = self.cached_layout(self.fc)
+            if layout is None or len(self.frame) < layout[5]:
+                offsets = self.UNDECODED
+            else:
+                offsets = layout[:5]
+            self._offsets = offsets
+        return offsets
+
+    @classmethod
+    def cached_layout(cls, fc: int | None) -> tuple | None:
+        """
+        Returns layout(fc) from the cache of frame control values seen so
+        far, or None if fc is None.
+        """
+        try:
+            return cls.layouts[fc]
+        except KeyError:
+            layout = cls.layouts[fc] = None if fc is None else cls.layout(fc)
+            return layout
+
+    @staticmethod
+    def layout(fc: int) -> tuple | None:
+        """
+        Returns the field offsets and header length for a frame control
+        value, or None if the frame format is not supported.
+        """
+        if (fc & FC_FRAME_TYPE) in (FrameType.MULTIPURPOSE, FrameType.FRAGMENT, FrameType.EXTENDED):
+            return None
+        dst_mode = (fc >> FC_DST_ADDR_MODE_SHIFT) & 3
+        src_mode = (fc >> FC_SRC_ADDR_MODE_SHIFT) & 3
+        if dst_mode == 1 or src_mode == 1:
+            return None
+        dst_pan_present, src_pan_present = pan_id_presence(fc, dst_mode, src_mode)
+
+        offset = 2
+        sequence = None
+        if not (fc & FC_SEQUENCE_NUMBER_SUPPRESSION and (fc >> FC_FRAME_VERSION_SHIFT) & 3 == FRAME_VERSION_2015):
+            sequence = offset
+            offset += 1
+        fields = [sequence]
+        for present, length in (
+            (dst_pan_present, 2),
+            (dst_mode, ADDRESS_LENGTH[dst_mode]),
+            (src_pan_present, 2),
+            (src_mode, ADDRESS_LENGTH[src_mode]),
+        ):
+            fields.append(offset if present else None)
+            if present:
+                offset += length
+        return (*fields, offset)
+
+
+def decode_addressing(frame: bytes):
+    """
+    Decodes the addressing fields of a frame without copying it, with the
+    layout MacHeader uses.
+    :return: (dst_pan, dst_mode, dst_addr, src_pan, src_mode, src_addr)
+             with None for absent fields, or None if the frame is truncated
+             or uses a frame control format that is not supported.
+             Addresses are integers; a compressed source PAN ID is reported
+             as the destination PAN ID.
+    """
+    header = MacHeader(frame)
+    fc = header.fc
+    layout = MacHeader.cached_layout(fc)
+    if layout is None or len(frame) < layout[5]:
+        return None
+    dst_pan, dst_addr, src_pan, src_addr = header.addressing()
+    dst_mode = (fc >> FC_DST_ADDR_MODE_SHIFT) & 3
+    src_mode = (fc >> FC_SRC_ADDR_MODE_SHIFT) & 3
+    return dst_pan, dst_mode or None, dst_addr, src_pan, src_mode or None, src_addr
@@ -0,0 +1,237 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Opt-in capture metrics shared between the serial reader processes and the
+writer: counters and per-stage latency histograms.
+"""
+
+import os
+import time
+from multiprocessing import Lock, RawArray
+
+
+class CaptureMetrics:
+    """
+    Counters and latency histograms kept in shared memory. Updates are made
+    once per batch of frames, so the cost per frame stays negligible.
+    Latencies are measured with time.monotonic_ns(), which is system-wide
+    and therefore comparable between processes.
+    """
+
+    COUNTERS = (
+        "lines_read",
+        "frames_parsed",
+        "parse_failures",
+        "frames_filtered",
+        "frames_queued",
+        "frames_written",
+    )
+    LINES_READ, FRAMES_PARSED, PARSE_FAILURES, FRAMES_FILTERED, FRAMES_QUEUED, FRAMES_WRITTEN = range(6)
+
+    STAGES = (
+        "read_to_parse",
+        "parse_to_enqueue",
+        "enqueue_to_dequeue",
+        "dequeue_to_write",
+        "read_to_write",
+    )
+    READ_TO_PARSE, PARSE_TO_ENQUEUE, ENQUEUE_TO_DEQUEUE, DEQUEUE_TO_WRITE, READ_TO_WRITE = range(5)
+
+    # Bucket i counts latencies below 2**i microseconds; the last one is unbounded.
+    BUCKETS = 26
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = RawArray("q", len(self.COUNTERS))
+        self.histograms = RawArray("q", len(self.STAGES) * self.BUCKETS)
+        self.sums = RawArray("q", len(self.STAGES))
+        self.started = time.monotonic()
+
+    def _observe(self, stage: int, nanoseconds: int, count: int) -> None:
+        # Must be called with the lock held.
+        bucket = min((max(nanoseconds, 0) // 1000).bit_length(), self.BUCKETS - 1)
+        self.histograms[stage * self.BUCKETS + bucket] += count
+        self.sums[stage] += nanoseconds * count
+
+    def record_parse(self, lines: int, parsed: int, failures: int, filtered: int, read_ns: int, parsed_ns: int) -> None:
+        """
+        Reader side. Records a chunk of lines read at read_ns and parsed at
+        parsed_ns.
+        """
+        with self.lock:
+            counters = self.counters
+            counters[self.LINES_READ] += lines
+            counters[self.FRAMES_PARSED] += parsed
+            counters[self.PARSE_FAILURES] += failures
+            counters[self.FRAMES_FILTERED] += filtered
+            if parsed:
+                self._observe(self.READ_TO_PARSE, parsed_ns - read_ns, parsed)
+
+    def record_queued(self, frames: int, parsed_ns: int, queued_ns: int) -> None:
+        """
+        Reader side. Records a batch parsed at parsed_ns and queued at queued_ns.
+        """
+        with self.lock:
+            self.counters[self.FRAMES_QUEUED] += frames
+            self._observe(self.PARSE_TO_ENQUEUE, queued_ns - parsed_ns, frames)
+
+    def record_written(self, batches: list) -> None:
+        """
+        Writer side. Records (frames, read_ns, queued_ns, dequeued_ns) of
+        batches that have just been written out.
+        """
+        now = time.monotonic_ns()
+        with self.lock:
+            for frames, read_ns, queued_ns, dequeued_ns in batches:
+                self.counters[self.FRAMES_WRITTEN] += frames
+                if queued_ns:
+                    self._observe(self.ENQUEUE_TO_DEQUEUE, dequeued_ns - queued_ns, frames)
+                self._observe(self.DEQUEUE_TO_WRITE, now - dequeued_ns, frames)
+                if read_ns:
+                    self._observe(self.READ_TO_WRITE, now - read_ns, frames)
+
+    def snapshot(self, **extra) -> dict:
+        """
+        Returns a consistent copy of all metrics. Latencies are reported in
+        seconds; percentiles are the upper bounds of their buckets.
+        """
+        with self.lock:
+            counters = list(self.counters)
+            histograms = list(self.histograms)
+            sums = list(self.sums)
+
+        elapsed = time.monotonic() - self.started
+        result = dict(zip(self.COUNTERS, counters))
+        result.update(extra)
+        result["elapsed"] = elapsed
+        result["frames_per_second"] = counters[self.FRAMES_WRITTEN] / elapsed if elapsed > 0 else 0.0
+
+        latencies = {}
+        for stage, name in enumerate(self.STAGES):
+            buckets = histograms[stage * self.BUCKETS:(stage + 1) * self.BUCKETS]
+            total = sum(buckets)
+            latency = {"count": total, "sum": sums[stage] / 1e9, "buckets": buckets}
+            for percentile in self.PERCENTILES:
+                latency["p%d" % percentile] = self.percentile(buckets, percentile)
+            latencies[name] = latency
+        result["latency"] = latencies
+        return result
+
+    @classmethod
+    def bucket_bound(cls, bucket: int) -> float:
+        """
+        Returns the upper bound of a bucket in seconds.
+        """
+        if bucket == cls.BUCKETS - 1:
+            return float("inf")
+        return 2**bucket / 1e6
+
+    @classmethod
+    def percentile(cls, buckets: list, percentile: int) -> float | None:
+        total = sum(buckets)
+        if not total:
+            return None
+        threshold = total * percentile / 100
+        seen = 0
+        for bucket, count in enumerate(buckets):
+            seen += count
+            if seen >= threshold:
+                return cls.bucket_bound(bucket)
+        return cls.bucket_bound(cls.BUCKETS - 1)
+
+    @staticmethod
+    def format_log(snapshot: dict) -> str:
+        """
+        Formats a snapshot as a single log line.
+        """
+        line = "lines %d, parsed %d, parse failures %d, filtered %d, written %d, dropped %d, queue depth %d, %.0f frames/s" % (
+            snapshot["lines_read"],
+            snapshot["frames_parsed"],
+            snapshot["parse_failures"],
+            snapshot["frames_filtered"],
+            snapshot["frames_written"],
+            snapshot.get("frames_dropped", 0),
+            snapshot.get("queue_depth", 0),
+            snapshot["frames_per_second"],
+        )
+        latency = snapshot["latency"]["read_to_write"]
+        if latency["count"]:
+            line += ", read to write p50 %.1f ms p99 %.1f ms" % (latency["p50"] * 1e3, latency["p99"] * 1e3)
+        return line
+
+    @classmethod
+    def prometheus(cls, snapshot: dict, labels: dict | None = None) -> str:
+        """
+        Formats a snapshot in the Prometheus text exposition format.
+        """
+        label = ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in (labels or {}).items())
+        prefix = "nrf802154_sniffer_"
+        res = []
+        for name in cls.COUNTERS + ("frames_dropped",):
+            res.append("# TYPE %s%s_total counter" % (prefix, name))
+            res.append("%s%s_total{%s} %d" % (prefix, name, label, snapshot.get(name, 0)))
+        res.append("# TYPE %squeue_depth gauge" % prefix)
+        res.append("%squeue_depth{%s} %d" % (prefix, label, snapshot.get("queue_depth", 0)))
+
+        res.append("# TYPE %slatency_seconds histogram" % prefix)
+        stage_label = label + "," if label else ""
+        for stage, latency in snapshot["latency"].items():
+            cumulative = 0
+            for bucket, count in enumerate(latency["buckets"]):
+                cumulative += count
+                bound = cls.bucket_bound(bucket)
+                res.append(
+                    '%slatency_seconds_bucket{%sstage="%s",le="%s"} %d'
+                    % (prefix, stage_label, stage, "+Inf" if bound == float("inf") else "%g" % bound, cumulative)
+                )
+            res.append('%slatency_seconds_sum{%sstage="%s"} %g' % (prefix, stage_label, stage, latency["sum"]))
+            res.append('%slatency_seconds_count{%sstage="%s"} %d' % (prefix, stage_label, stage, latency["count"]))
+        return "\n".join(res) + "\n"
+
+    @classmethod
+    def dump_prometheus(cls, path: str, snapshot: dict, labels: dict | None = None) -> None:
+        """
+        Writes a snapshot to a Prometheus text file, e.g. for the node
+        exporter textfile collector. The file is replaced atomically.
+        """
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(cls.prometheus(snapshot, labels))
+        os.replace(temporary, path)
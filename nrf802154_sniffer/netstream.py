@@ -0,0 +1,382 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Network outputs: ZigBee Encapsulation Protocol (ZEP) version 2 over UDP,
+which Wireshark decodes natively, and pcap over TCP to any number of
+clients.
+
+The TCP stream is a sequence of messages, each a 32-bit big-endian length
+followed by that many bytes: the pcap file header first, then whole pcap
+records. To watch a remote sniffer in Wireshark:
+python -m nrf802154_sniffer.netstream sniffer-host:17760 | wireshark -k -i -
+"""
+
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    from .fcs import FCS_LENGTH, fcs_valid
+except ImportError:
+    from fcs import FCS_LENGTH, fcs_valid
+
+ZEP_PORT = 17754
+NTP_EPOCH_OFFSET = 2208988800
+
+
+class ZepSender:
+    """
+    Sends frames as ZEP v2 data packets, with the same interface as
+    PcapWriter. Wireshark dissects one ZEP packet per datagram, so frames
+    are not packed together; instead datagrams are built in a preallocated
+    buffer and sent back to back once max_count are pending or the oldest
+    is max_delay seconds old.
+
+    Frames are sent in LQI mode: the two FCS bytes carry the RSSI and the
+    CRC OK bit in the CC24xx format, so Wireshark shows both RSSI and LQI.
+    With fcs set, frames come with their FCS, which is checked to set the
+    CRC OK bit and then replaced.
+    """
+
+    # Preamble, version, type, channel, device ID, LQI mode, LQI,
+    # NTP timestamp, sequence number, reserved, length.
+    HEADER = struct.Struct(">2sBBBHBBIII10xB")
+    MAX_FRAME_LENGTH = 125
+    SLOT_SIZE = HEADER.size + MAX_FRAME_LENGTH + 2
+    CC24XX_CRC_OK = 0x80
+
+    def __init__(self, address, device_id=0, max_delay=0.005, max_count=64, fcs=False):
+        self.address = address
+        self.fcs = fcs
+        self.device_id = device_id
+        self.max_delay = max_delay
+        self.max_count = max_count
+        self.socket = socket.socket(socket.AF_INET6 if ":" in address[0] else socket.AF_INET, socket.SOCK_DGRAM)
+        self.buffer = bytearray(max_count * self.SLOT_SIZE)
+        self.view = memoryview(self.buffer)
+        self.lengths = []
+        self.sequence = 0
+        self.deadline = None
+        self.flush_count = 0
+        self.errors = 0
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        crc_ok = self.CC24XX_CRC_OK
+        if self.fcs:
+            if not fcs_valid(frame):
+                crc_ok = 0
+            frame = frame[:-FCS_LENGTH]
+        frame = frame[:self.MAX_FRAME_LENGTH]
+        offset = len(self.lengths) * self.SLOT_SIZE
+        seconds, microseconds = divmod(timestamp, 1000000)
+        self.HEADER.pack_into(
+            self.buffer, offset,
+            b"EX", 2, 1, channel, self.device_id, 0, lqi,
+            seconds + NTP_EPOCH_OFFSET, (microseconds << 32) // 1000000,
+            self.sequence & 0xFFFFFFFF, len(frame) + 2,
+        )
+        self.sequence += 1
+        offset += self.HEADER.size
+        end = offset + len(frame)
+        self.buffer[offset:end] = frame
+        self.buffer[end] = rssi & 0xFF
+        self.buffer[end + 1] = crc_ok | min(lqi, 0x7F)
+        self.lengths.append(end + 2 - offset + self.HEADER.size)
+
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.max_delay
+        if len(self.lengths) >= self.max_count:
+            self.flush()
+
+    def timeout(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def poll(self) -> None:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self) -> None:
+        sendto = self.socket.sendto
+        address = self.address
+        view = self.view
+        for index, length in enumerate(self.lengths):
+            offset = index * self.SLOT_SIZE
+            try:
+                sendto(view[offset:offset + length], address)
+            except OSError:
+                # Datagrams are best effort; a missing listener must not
+                # stop the capture.
+                self.errors += 1
+        self.lengths = []
+        self.deadline = None
+        self.flush_count += 1
+
+    def close(self) -> None:
+        self.flush()
+        self.socket.close()
+
+
+class _Client:
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.chunks = deque()
+        self.size = 0
+        self.dropped_bytes = 0
+
+
+class TcpPcapServer:
+    """
+    Serves length-prefixed pcap to TCP clients, with the same interface as
+    PcapWriter. Records are batched by a PcapWriter and every flushed batch
+    is queued for all clients. Sockets are non-blocking and served by a
+    background thread; each client has its own buffer of at most
+    max_buffer bytes. A client whose buffer is full either misses batches
+    (drop) or is disconnected (disconnect).
+    """
+
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+    POLICIES = (DROP, DISCONNECT)
+    LENGTH = struct.Struct(">I")
+    SEND_BUFFER = 64 * 1024
+
+    def __init__(self, address, header: bytes, writer_class, dlt, max_buffer=1024 * 1024, policy=DROP,
+                 max_delay=0.005, max_bytes=64 * 1024, fcs=False):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown lag policy: %s" % policy)
+        self.header = self.LENGTH.pack(len(header)) + header
+        self.max_buffer = max_buffer
+        self.policy = policy
+        self.clients: dict[socket.socket, _Client] = {}
+        self.lock = threading.Lock()
+        self.disconnected = 0
+
+        self.listener = socket.create_server(address)
+        self.listener.setblocking(False)
+        self.wakeup_read, self.wakeup_write = socket.socketpair()
+        self.wakeup_read.setblocking(False)
+        self.wakeup_write.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name="tcp pcap server", daemon=True)
+        self.thread.start()
+
+        self.writer = writer_class(self, dlt, max_delay, max_bytes, fcs)
+
+    @property
+    def address(self):
+        return self.listener.getsockname()
+
+    # Writer interface, delegated to the batching PcapWriter, which calls
+    # write() with every batch.
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        self.writer.write_packet(frame, channel, rssi, lqi, timestamp)
+
+    def timeout(self) -> float | None:
+        return self.writer.timeout()
+
+    def poll(self) -> None:
+        self.writer.poll()
+
+    def flush(self) -> None:
+        self.writer.flush()
+
+    @property
+    def flush_count(self) -> int:
+        return self.writer.flush_count
+
+    def write(self, data) -> int:
+        """
+        Queues a batch of whole pcap records for every client.
+        """
+        chunk = self.LENGTH.pack(len(data)) + bytes(data)
+        with self.lock:
+            for client in list(self.clients.values()):
+                if client.size + len(chunk) > self.max_buffer:
+                    if self.policy == self.DISCONNECT:
+                        self._disconnect(client)
+                    else:
+                        client.dropped_bytes += len(chunk)
+                    continue
+                was_empty = not client.chunks
+                client.chunks.append(chunk)
+                client.size += len(chunk)
+                if was_empty:
+                    self.selector.modify(client.socket, selectors.EVENT_WRITE)
+        try:
+            self.wakeup_write.send(b"\0")
+        except BlockingIOError:
+            pass
+        return len(data)
+
+    def _disconnect(self, client: _Client) -> None:
+        self.selector.unregister(client.socket)
+        client.socket.close()
+        del self.clients[client.socket]
+        self.disconnected += 1
+
+    def _send(self, client: _Client) -> None:
+        while client.chunks:
+            chunk = client.chunks[0]
+            try:
+                sent = client.socket.send(chunk)
+            except BlockingIOError:
+                return
+            except OSError:
+                self._disconnect(client)
+                return
+            client.size -= sent
+            if sent < len(chunk):
+                client.chunks[0] = chunk[sent:]
+                return
+            client.chunks.popleft()
+        self.selector.modify(client.socket, selectors.EVENT_READ)
+
+    def serve(self) -> None:
+        while self.running:
+            for key, events in self.selector.select(1.0):
+                sock = key.fileobj
+                with self.lock:
+                    if sock is self.listener:
+                        try:
+                            conn, address = self.listener.accept()
+                        except BlockingIOError:
+                            continue
+                        conn.setblocking(False)
+                        # Keep the backlog in the client buffer, where the
+                        # lag policy sees it, rather than in the kernel.
+                        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SEND_BUFFER)
+                        client = self.clients[conn] = _Client(conn, address)
+                        client.chunks.append(self.header)
+                        client.size = len(self.header)
+                        self.selector.register(conn, selectors.EVENT_WRITE)
+                    elif sock is self.wakeup_read:
+                        try:
+                            while self.wakeup_read.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif (client := self.clients.get(sock)) is not None:
+                        if events & selectors.EVENT_WRITE:
+                            self._send(client)
+                        elif events & selectors.EVENT_READ:
+                            # Clients do not talk; readable means closed.
+                            try:
+                                closed = not sock.recv(4096)
+                            except OSError:
+                                closed = True
+                            if closed:
+                                self._disconnect(client)
+
+    def status(self) -> list[dict]:
+        with self.lock:
+            return [
+                {"address": str(c.address), "buffered_bytes": c.size, "dropped_bytes": c.dropped_bytes}
+                for c in self.clients.values()
+            ]
+
+    def close(self) -> None:
+        self.flush()
+        # Give clients a moment to receive the last batch.
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            with self.lock:
+                if not any(c.chunks for c in self.clients.values()):
+                    break
+            time.sleep(0.01)
+        self.running = False
+        self.wakeup_write.send(b"\0")
+        self.thread.join()
+        for sock in list(self.clients):
+            sock.close()
+        self.listener.close()
+        self.wakeup_read.close()
+        self.wakeup_write.close()
+        self.selector.close()
+
+
+def parse_address(value: str, default_port: int, default_host: str = "") -> tuple[str, int]:
+    """
+    Parses HOST, HOST:PORT, [IPV6]:PORT or PORT.
+    """
+    if value.isdigit():
+        return default_host, int(value)
+    if value.startswith("["):
+        host, _, port = value[1:].partition("]")
+        return host, int(port.lstrip(":") or default_port)
+    host, separator, port = value.rpartition(":")
+    if not separator or ":" in host:
+        return value, default_port
+    return host, int(port)
+
+
+def receive(address, output) -> None:
+    """
+    Connects to a TCP pcap stream and writes the plain pcap to output.
+    """
+    with socket.create_connection(address) as sock, sock.makefile("rb") as stream:
+        while header := stream.read(TcpPcapServer.LENGTH.size):
+            data = stream.read(TcpPcapServer.LENGTH.unpack(header)[0])
+            output.write(data)
+            output.flush()
+
+
+def main() -> None:
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Write the pcap stream of a remote nRF Sniffer for 802.15.4 to stdout")
+    parser.add_argument("address", help="HOST:PORT of a sniffer started with --tcp-listen")
+    args = parser.parse_args()
+    try:
+        receive(parse_address(args.address, 17760, "localhost"), sys.stdout.buffer)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == "__main__":
+    main()
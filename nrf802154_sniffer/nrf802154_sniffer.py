@@ -45,6 +45,19 @@ is_standalone = __name__ == "__main__"
 if is_standalone:
     sys.path.insert(0, os.getcwd())
 
+    # Wireshark runs the extcap to list interfaces, DLTs and config on every
+    # start; answer those before importing the capture machinery.
+    if __package__:
+        from . import discovery
+    else:
+        import discovery
+
+    if discovery.run(sys.argv[1:]):
+        sys.exit(0)
+
+import heapq
+import importlib
+import itertools
 import re
 import signal
 import struct
@@ -52,25 +65,79 @@ import threading
 import time
 import logging
 from argparse import ArgumentParser
-from binascii import a2b_hex
+from binascii import a2b_hex, crc_hqx
+from operator import getitem
+from contextlib import ExitStack, contextmanager
 from serial import Serial, SerialException
-from serial.tools.list_ports import comports
-from multiprocessing import Queue, Process, freeze_support
+from multiprocessing import Condition, Event, Queue, Process, RawArray, RawValue, freeze_support
+from collections import deque
+from concurrent.futures import Future
+from queue import Empty
+import dataclasses
 from dataclasses import dataclass
 from threading import Thread
 from enum import IntEnum
 
 
-@dataclass
+def import_sibling(name: str):
+    """
+    Imports a module shipped next to this one. Works both when this file
+    is imported as part of the package and when it runs as the standalone
+    extcap script.
+    """
+    if __package__:
+        return importlib.import_module(f".{name}", __package__)
+    return importlib.import_module(name)
+
+
+discovery = import_sibling("discovery")
+fcs = import_sibling("fcs")
+DeviceClock = import_sibling("clock").DeviceClock
+TapHeader = import_sibling("tap").TapHeader
+
+
+@dataclass(slots=True)
 class SnifferPacket:
     content: bytes
     timestamp: int
     lqi: int
     rssi: int
 
+@dataclass
+class PacketBatch:
+    packets: list
+    # Index of the device the packets come from in a multi-device capture.
+    source: int = 0
+    # time.monotonic_ns() of the serial read of the oldest packet and of
+    # queuing the batch, set only when metrics are enabled.
+    read_time: int = 0
+    queued_time: int = 0
+    # Channel the packets were received on, if the reader knows it.
+    channel: int | None = None
+    # UNIX time in microseconds of the serial read that returned the newest
+    # packet, for the clock model of the device; 0 if the reader does not
+    # know it.
+    host_time: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class CapturedPacket:
+    """
+    Packet handed out by the streaming API, with the timestamp already
+    converted to UNIX time in microseconds.
+    """
+    content: bytes
+    timestamp: int
+    channel: int
+    rssi: int
+    lqi: int
+
+
 @dataclass
 class ControlPacket:
     content: bytes
+    number: int = 0
+    command: int = 0
 
 
 @dataclass
@@ -78,28 +145,715 @@ class ExitEvent:
     reason: str = ""
 
 
+@dataclass
+class DeviceReply:
+    """
+    Sent by a reader when its device rejected a command issued during the
+    capture.
+    """
+    error: str
+    source: int = 0
+    # Channel the device stayed on, if the command was a retune.
+    channel: int | None = None
+
+
+@dataclass
+class ParseResult:
+    packets: list
+    # Lines carrying the "received:" marker whose fields could not be parsed.
+    malformed: int = 0
+    # Lines without the marker, e.g. empty lines or shell replies.
+    ignored: int = 0
+    # Frames whose FCS did not match, whether dropped or not.
+    bad_fcs: int = 0
+
+
+class LineParser:
+    """
+    Regex-free parser for the "received:" lines printed by the firmware.
+    Works directly on bytes or memoryview objects and reports malformed
+    lines through counters in ParseResult instead of raising.
+
+    A batch of at least BATCH_MIN_LINES well-formed lines is parsed as a
+    whole: joined, split into fields and converted column by column with
+    map(), so that no Python code runs per frame. Smaller batches, and
+    batches with any other line such as a shell reply, are parsed line
+    by line.
+    """
+
+    MARKER = b"received:"
+    # Fields of a line as printed by the firmware, one space apart.
+    FIELDS = 8
+    TAGS = ((0, MARKER), (2, b"power:"), (4, b"lqi:"), (6, b"time:"))
+    # Below this many lines, joining and splitting costs more than it saves.
+    BATCH_MIN_LINES = 16
+
+    # RSSI and LQI always fit in this range, so they are looked up instead
+    # of going through int().
+    SMALL_INTS = {b"%d" % i: i for i in range(-128, 256)}
+    STRIP_FCS = slice(None, -fcs.FCS_LENGTH)
+
+    @classmethod
+    def parse_line(cls, line) -> SnifferPacket | None:
+        """
+        Parses a single line. Returns None if the line is not a valid
+        "received:" line.
+        """
+        result = cls.parse_lines((line,))
+        return result.packets[0] if result.packets else None
+
+    @classmethod
+    def parse_lines(cls, lines, fcs_policy=fcs.PASS, keep_fcs=False) -> ParseResult:
+        """
+        Parses an iterable of lines in one call.
+        Unless fcs_policy is fcs.PASS, the FCS of every frame is checked
+        and frames with a bad one are counted, and also left out with
+        fcs.DROP. The FCS is stripped from the packets unless keep_fcs is
+        set.
+        """
+        if lines.__class__ is not list:
+            lines = list(lines)
+        result = None
+        if len(lines) >= cls.BATCH_MIN_LINES:
+            result = cls._parse_batch(lines, fcs_policy, keep_fcs)
+        if result is None:
+            result = cls._parse_each(lines, fcs_policy, keep_fcs)
+        return result
+
+    @classmethod
+    def _parse_batch(cls, lines: list, fcs_policy, keep_fcs) -> ParseResult | None:
+        """
+        Parses lines that are all well-formed, or returns None. Trailing
+        line ends are left to int(), which ignores them.
+        """
+        fields = cls.FIELDS
+        tokens = b" ".join(lines).split(b" ")
+        count = len(lines)
+        if len(tokens) != fields * count:
+            return None
+        for index, tag in cls.TAGS:
+            if tokens[index::fields].count(tag) != count:
+                return None
+        small_int = cls.SMALL_INTS.__getitem__
+        try:
+            contents = list(map(a2b_hex, tokens[1::fields]))
+            rssis = list(map(small_int, tokens[3::fields]))
+            lqis = list(map(small_int, tokens[5::fields]))
+            timestamps = list(map(int, tokens[7::fields]))
+        except (ValueError, KeyError):
+            return None
+
+        bad_fcs = 0
+        if fcs_policy != fcs.PASS:
+            # Same as fcs.fcs_valid, a column at a time.
+            valid = [
+                length >= fcs.FCS_LENGTH and not crc
+                for length, crc in zip(
+                    map(len, contents),
+                    map(crc_hqx, map(bytes.translate, contents, itertools.repeat(fcs.REVERSED_BITS)), itertools.repeat(0)),
+                )
+            ]
+            bad_fcs = count - sum(valid)
+            if bad_fcs and fcs_policy == fcs.DROP:
+                contents = list(itertools.compress(contents, valid))
+                timestamps = list(itertools.compress(timestamps, valid))
+                lqis = list(itertools.compress(lqis, valid))
+                rssis = list(itertools.compress(rssis, valid))
+        if not keep_fcs:
+            contents = map(getitem, contents, itertools.repeat(cls.STRIP_FCS))
+        return ParseResult(list(map(SnifferPacket, contents, timestamps, lqis, rssis)), bad_fcs=bad_fcs)
+
+    @classmethod
+    def _parse_each(cls, lines, fcs_policy, keep_fcs) -> ParseResult:
+        marker = cls.MARKER
+        # The firmware separates the marker and the payload with one space.
+        skip = len(marker) + 1
+        small_ints = cls.SMALL_INTS
+        check = fcs_policy != fcs.PASS
+        drop = fcs_policy == fcs.DROP
+        table = fcs.REVERSED_BITS
+        end = None if keep_fcs else -fcs.FCS_LENGTH
+        packets = []
+        append = packets.append
+        malformed = 0
+        ignored = 0
+        bad_fcs = 0
+        for line in lines:
+            if line.__class__ is not bytes:
+                line = bytes(line)
+            if not line.startswith(marker):
+                start = line.find(marker)
+                if start < 0:
+                    ignored += 1
+                    continue
+                line = line[start:]
+            try:
+                # Split from the right so that the long payload is not scanned.
+                head, power, rssi, lqi_tag, lqi, time_tag, timestamp = line.rsplit(None, 6)
+                if power != b"power:" or lqi_tag != b"lqi:" or time_tag != b"time:":
+                    raise ValueError
+                try:
+                    content = a2b_hex(head[skip:])
+                except ValueError:
+                    content = a2b_hex(head[skip:].strip())
+                # Same as fcs.fcs_valid, inlined for the hot loop.
+                if check and (len(content) < fcs.FCS_LENGTH or crc_hqx(content.translate(table), 0)):
+                    bad_fcs += 1
+                    if drop:
+                        continue
+                append(SnifferPacket(
+                    # The last two bytes are the FCS.
+                    content[:end],
+                    int(timestamp),
+                    small_ints[lqi],
+                    small_ints[rssi],
+                ))
+            except (ValueError, KeyError):
+                malformed += 1
+        return ParseResult(packets, malformed, ignored, bad_fcs)
+
+
+class DeviceError(RuntimeError):
+    pass
+
+
+class DeviceSession:
+    """
+    Command layer over the shell of the sniffer firmware. The firmware
+    prints no prompt and nothing at all when a command succeeds, so a
+    command is taken as done once the device has been quiet for
+    CONFIRM_DELAY, or after COMMAND_TIMEOUT if it keeps printing frames.
+    The lines printed in the meantime are the reply and are checked for
+    the shell's error messages; frames are skipped.
+    """
+
+    ANSI_ESCAPE = re.compile(rb"\x1b\[[0-9;?]*[A-Za-z]")
+    # The error messages in the firmware images: its own argument check for
+    # the channel command and those of the shell.
+    SHELL_ERROR = re.compile(
+        rb"invalid number of parameters: \d+"
+        rb"|\S+: (?:command not found|wrong parameter count|unknown parameter: .*)"
+        rb"|Please specify a subcommand\."
+        rb"|Too many arguments in the command\."
+    )
+    # Quiet time after which the device is taken to have accepted a command.
+    CONFIRM_DELAY = 0.05
+    # Longest wait for a command while the device keeps printing.
+    COMMAND_TIMEOUT = 1.0
+    POLL_INTERVAL = 0.005
+
+    def __init__(self, serial, timeout=COMMAND_TIMEOUT):
+        self.serial = serial
+        self.timeout = timeout
+        self.pending = b""
+
+    @classmethod
+    def reply_lines(cls, lines) -> list[bytes]:
+        """
+        Returns the non-empty lines that are not frames, without terminal
+        escapes.
+        """
+        return [line for line in map(cls.clean_line, lines) if line]
+
+    @classmethod
+    def clean_line(cls, line: bytes) -> bytes:
+        """
+        Returns a line of shell output without terminal escapes, or nothing
+        for frames.
+        """
+        if LineParser.MARKER in line:
+            return b""
+        if b"\x1b" in line:
+            line = cls.ANSI_ESCAPE.sub(b"", line)
+        return line.strip()
+
+    @classmethod
+    def find_error(cls, lines) -> str | None:
+        """
+        Returns the first line of shell output reporting an error, if any.
+        """
+        for line in lines:
+            text = cls.clean_line(line)
+            if text and cls.SHELL_ERROR.fullmatch(text):
+                return text.decode(errors="replace")
+        return None
+
+    def command(self, command: bytes) -> list[bytes]:
+        """
+        Sends a shell command and returns the lines printed in reply once
+        the device is ready for the next one. Raises DeviceError as soon as
+        the shell rejects the command.
+        """
+        self.serial.write(command + b"\r\n")
+        lines = []
+        data = self.pending
+        now = time.monotonic()
+        quiet = now + self.CONFIRM_DELAY
+        deadline = now + self.timeout
+        while True:
+            head, newline, data = data.rpartition(b"\n")
+            if newline:
+                new = [line for line in head.split(b"\n") if LineParser.MARKER not in line]
+                error = self.find_error(new)
+                if error is not None:
+                    self.pending = data
+                    raise DeviceError("Sniffer device rejected '%s': %s" % (command.decode(), error))
+                lines += new
+            now = time.monotonic()
+            if now >= quiet or now >= deadline:
+                break
+            waiting = self.serial.in_waiting
+            if waiting:
+                data += self.serial.read(waiting)
+                quiet = time.monotonic() + self.CONFIRM_DELAY
+            else:
+                time.sleep(self.POLL_INTERVAL)
+        self.pending = data
+        # With echo still on, the shell repeats the command first.
+        return [line for line in self.reply_lines(lines) if line != command]
+
+    def sync(self) -> None:
+        """
+        Discards stale output and ends any partially typed command, so that
+        the next reply answers the next command.
+        """
+        self.serial.reset_input_buffer()
+        self.pending = b""
+        self.command(b"")
+
+
+class RetuneConfirmation:
+    """
+    Watches the shell output after live retunes. The firmware prints
+    nothing when it accepts a channel command and cannot report its
+    channel, so a reader sends the single channel command and hands the
+    lines it could not parse as frames to check() until the confirmation
+    window closes. A shell error within the window means the device
+    stayed on the channel it was on before.
+    """
+
+    def __init__(self, source: int = 0):
+        self.source = source
+        self.channel = None
+        # Channel the device is on if the retune is rejected.
+        self.previous = None
+        self.awaiting = False
+        self.deadline = None
+
+    def sent(self, channel: int, previous: int | None) -> None:
+        self.channel = channel
+        self.previous = previous
+        self.awaiting = True
+        self.deadline = time.monotonic() + DeviceSession.COMMAND_TIMEOUT
+
+    def check(self, lines) -> list[DeviceReply]:
+        """
+        Looks for a shell error in lines. Returns a DeviceReply with the
+        channel the device stayed on if it rejected the retune.
+        """
+        error = DeviceSession.find_error(lines)
+        if error is None:
+            return []
+        self.awaiting = False
+        return [DeviceReply(
+            "Sniffer device rejected 'channel %d': %s" % (self.channel, error), self.source, self.previous
+        )]
+
+    def expire(self) -> None:
+        """
+        Closes the confirmation window once it is over; the retune is then
+        taken as accepted.
+        """
+        if self.awaiting and time.monotonic() >= self.deadline:
+            self.awaiting = False
+
+
 class DLT(IntEnum):
     # Various options for pcap files: http://www.tcpdump.org/linktypes.html
-    DLT_IEEE802_15_4_NOFCS = 230
-    DLT_IEEE802_15_4_TAP = 283
+    DLT_IEEE802_15_4_NOFCS = discovery.DLT_IEEE802_15_4_NOFCS
+    DLT_IEEE802_15_4_TAP = discovery.DLT_IEEE802_15_4_TAP
+    DLT_IEEE802_15_4_WITHFCS = discovery.DLT_IEEE802_15_4_WITHFCS
+
+
+def pcap_header(dlt) -> bytes:
+    """
+    Returns the pcap file header for the given link type.
+    """
+    header = bytearray()
+    header += struct.pack("<L", int("a1b2c3d4", 16))
+    header += struct.pack("<H", 2)  # Pcap Major Version
+    header += struct.pack("<H", 4)  # Pcap Minor Version
+    header += struct.pack("<I", int(0))  # Timezone
+    header += struct.pack("<I", int(0))  # Accurancy of timestamps
+    header += struct.pack("<L", int("000000ff", 16))  # Max Length of capture frame
+    header += struct.pack("<L", dlt)  # DLT
+    return bytes(header)
+
+
+class PcapWriter:
+    """
+    Buffered writer of pcap records.
+    Records are packed in place into a preallocated buffer and written out
+    with a single write once max_bytes are buffered or the oldest buffered
+    record is max_delay seconds old. Callers waiting for input should block
+    for at most timeout() seconds and call poll() afterwards.
+    """
+
+    # Record header: timestamp seconds, timestamp microseconds,
+    # captured length, original length.
+    RECORD_HEADER = struct.Struct("<LLLL")
+
+    # Record header followed by the TAP TLVs, without and with the FCS
+    # type TLV.
+    TAP_RECORD_HEADER = TapHeader("<LLLL")
+    TAP_FCS_RECORD_HEADER = TapHeader("<LLLL", fcs=True)
+    TAP_LENGTH = TAP_RECORD_HEADER.length
+
+    # Largest frame the 802.15.4 PHY can carry.
+    MAX_FRAME_LENGTH = 127
+
+    def __init__(self, file, dlt, max_delay=0.005, max_bytes=64 * 1024, fcs=False):
+        self.file = file
+        self.dlt = dlt
+        self.tap = dlt == DLT.DLT_IEEE802_15_4_TAP
+        # Whether frames end with their FCS, which TAP records declare.
+        self.fcs = fcs
+        self.tap_header = self.TAP_FCS_RECORD_HEADER if fcs else self.TAP_RECORD_HEADER
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.buffer = bytearray(max_bytes + self.TAP_FCS_RECORD_HEADER.size + self.MAX_FRAME_LENGTH)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.deadline = None
+        self.flush_count = 0
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        """
+        Appends a record to the buffer, flushing it if a limit is reached.
+        """
+        length = len(frame)
+        if length > self.MAX_FRAME_LENGTH:
+            frame = frame[:self.MAX_FRAME_LENGTH]
+            length = self.MAX_FRAME_LENGTH
+
+        offset = self.length
+        seconds, microseconds = divmod(timestamp, 1000000)
+        if self.tap:
+            header = self.tap_header
+            caplength = length + header.length
+            header.pack_into(self.buffer, offset, (seconds, microseconds, caplength, caplength), channel, rssi, lqi)
+            offset += header.size
+        else:
+            self.RECORD_HEADER.pack_into(
+                self.buffer, offset, seconds, microseconds, length, length
+            )
+            offset += self.RECORD_HEADER.size
+        self.length = offset + length
+        self.buffer[offset:self.length] = frame
+
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.max_delay
+        if self.length >= self.max_bytes:
+            self.flush()
+
+    def timeout(self) -> float | None:
+        """
+        Returns how long the caller may wait before poll() has to be called,
+        or None if nothing is buffered.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def poll(self) -> None:
+        """
+        Flushes the buffer if the oldest record has reached max_delay.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self) -> None:
+        view = self.view[:self.length]
+        while view:
+            written = self.file.write(view)
+            view = view[written:]
+        self.length = 0
+        self.deadline = None
+        self.flush_count += 1
+
+
+class OutputGroup:
+    """
+    Writes every record to several outputs, with the same interface as
+    PcapWriter.
+    """
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        for writer in self.writers:
+            writer.write_packet(frame, channel, rssi, lqi, timestamp)
+
+    def timeout(self) -> float | None:
+        return min((t for w in self.writers if (t := w.timeout()) is not None), default=None)
+
+    def poll(self) -> None:
+        for writer in self.writers:
+            writer.poll()
+
+    def flush(self) -> None:
+        for writer in self.writers:
+            writer.flush()
+
+    @property
+    def flush_count(self) -> int:
+        return sum(writer.flush_count for writer in self.writers)
+
+
+class FlowControl:
+    """
+    Bounds the frames and bytes in flight between the reader processes and
+    the writer. The counters live in shared memory, so one instance serves
+    all processes of a capture.
+
+    When a batch does not fit, the reader applies the overload policy:
+    drop-newest discards the frames that do not fit, drop-oldest keeps the
+    newest frames in a local buffer of the same size and discards the
+    oldest ones, and block stops reading the serial port until the writer
+    catches up.
+    """
+
+    DROP_NEWEST = "drop-newest"
+    DROP_OLDEST = "drop-oldest"
+    BLOCK = "block"
+    POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+    def __init__(self, max_frames=None, max_bytes=None, policy=DROP_NEWEST):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown overload policy: %s" % policy)
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.condition = Condition()
+        self.frames = RawValue("q", 0)
+        self.bytes = RawValue("q", 0)
+        self.dropped = RawValue("q", 0)
+        # Reader side only: frames held back under the drop-oldest policy.
+        self.pending = deque()
+
+    def _fits(self, packets, frames, size) -> int:
+        """
+        Returns how many of the leading packets fit on top of the given
+        frames and bytes. Must be called with the condition held.
+        """
+        count = 0
+        for p in packets:
+            frames += 1
+            size += len(p.content)
+            if (self.max_frames is not None and frames > self.max_frames) or (
+                self.max_bytes is not None and size > self.max_bytes
+            ):
+                break
+            count += 1
+        return count
+
+    def _reserve(self, packets, wait: bool) -> int:
+        """
+        Reserves room for as many of the leading packets as fit. If wait is
+        set, blocks until at least one fits.
+        """
+        with self.condition:
+            while True:
+                count = self._fits(packets, self.frames.value, self.bytes.value)
+                if count == 0 and packets and self.frames.value == 0:
+                    # A single frame above the byte limit must not stall the capture.
+                    count = 1
+                if count or not wait:
+                    break
+                self.condition.wait(0.1)
+            self.frames.value += count
+            self.bytes.value += sum(len(p.content) for p in packets[:count])
+            return count
+
+    def _drop(self, count: int) -> None:
+        with self.condition:
+            self.dropped.value += count
+
+    def send(
+        self, queue, packets: list, source: int = 0, read_time: int = 0,
+        channel: int | None = None, host_time: int = 0,
+    ) -> int:
+        """
+        Reader side. Queues as many packets as the limits allow and applies
+        the overload policy to the rest. Under drop-oldest, call this
+        periodically even without new packets to flush the held back ones.
+        Returns the number of packets queued.
+        """
+        queued = 0
+
+        def put(batch):
+            nonlocal queued
+            queued += len(batch)
+            queue.put(PacketBatch(batch, source, read_time, time.monotonic_ns() if read_time else 0, channel, host_time))
+
+        if self.policy == self.DROP_OLDEST:
+            self.pending.extend(packets)
+            keep = self._fits(reversed(self.pending), 0, 0)
+            if len(self.pending) > keep:
+                self._drop(len(self.pending) - keep)
+                for _ in range(len(self.pending) - keep):
+                    self.pending.popleft()
+            packets = list(self.pending)
+            count = self._reserve(packets, False)
+            for _ in range(count):
+                self.pending.popleft()
+            if count:
+                put(packets[:count])
+        elif self.policy == self.BLOCK:
+            while packets:
+                count = self._reserve(packets, True)
+                put(packets[:count])
+                packets = packets[count:]
+        else:
+            count = self._reserve(packets, False)
+            if count < len(packets):
+                self._drop(len(packets) - count)
+            if count:
+                put(packets[:count])
+        return queued
+
+    def release(self, packets: list) -> None:
+        """
+        Writer side. Returns the room taken by packets taken off the queue.
+        """
+        with self.condition:
+            self.frames.value -= len(packets)
+            self.bytes.value -= sum(len(p.content) for p in packets)
+            self.condition.notify_all()
+
+
+class TimestampMerger:
+    """
+    Bounded-latency k-way merge of per-source packet streams.
+    Every source delivers its packets in timestamp order. A packet is
+    released once every source has delivered a packet at least as new,
+    or once it is max_delay microseconds older than the current time, so
+    an idle source holds the others back by at most max_delay.
+    """
+
+    def __init__(self, sources: int, max_delay: int):
+        self.heap = []
+        self.max_delay = max_delay
+        self.latest = [None] * sources
+        self.counter = itertools.count()
+
+    def push(self, source: int, timestamp: int, item) -> None:
+        heapq.heappush(self.heap, (timestamp, next(self.counter), item))
+        if self.latest[source] is None or timestamp > self.latest[source]:
+            self.latest[source] = timestamp
+
+    def pop_ready(self, now: int) -> list:
+        """
+        Returns the (timestamp, item) pairs that can be released at now,
+        in timestamp order.
+        """
+        limit = now - self.max_delay
+        if None not in self.latest:
+            limit = max(limit, min(self.latest))
+        ready = []
+        while self.heap and self.heap[0][0] <= limit:
+            timestamp, _, item = heapq.heappop(self.heap)
+            ready.append((timestamp, item))
+        return ready
+
+    def timeout(self, now: int) -> float | None:
+        """
+        Returns the seconds until the oldest held packet is released by
+        the latency bound, or None if nothing is held.
+        """
+        if not self.heap:
+            return None
+        return max(0.0, (self.heap[0][0] + self.max_delay - now) / 10**6)
+
+    def drain(self) -> list:
+        ready = [(timestamp, item) for timestamp, _, item in sorted(self.heap)]
+        self.heap = []
+        return ready
 
 
 class Nrf802154Sniffer:
 
     # USB device identification.
-    NORDICSEMI_VID = 0x1915
-    SNIFFER_802154_PID = 0x154B
+    NORDICSEMI_VID = discovery.NORDICSEMI_VID
+    SNIFFER_802154_PID = discovery.SNIFFER_802154_PID
 
     # Helpers for Wireshark argument parsing.
-    CTRL_ARG_CHANNEL = 0
-    CTRL_ARG_LOGGER = 6
+    CTRL_ARG_CHANNEL = discovery.CTRL_ARG_CHANNEL
+    CTRL_ARG_LOGGER = discovery.CTRL_ARG_LOGGER
+
+    # Extcap control protocol commands.
+    CTRL_CMD_INITIALIZED = 0
+    CTRL_CMD_SET = 1
+    CTRL_CMD_ADD = 2
+    CTRL_HEADER = struct.Struct(">cBHBB")
+
+    CHANNELS = discovery.CHANNELS
+
+    # Interface capturing from all connected dongles at once.
+    MULTI_INTERFACE = discovery.MULTI_INTERFACE
+    # Longest a frame of a multi-device capture is held back waiting for
+    # frames from the other devices, in microseconds.
+    MERGE_MAX_DELAY = 50000
 
     # Pattern for packets being printed over serial.
     RCV_REGEX = r"received:\s+([0-9a-fA-F]+)\s+power:\s+(-?\d+)\s+lqi:\s+(\d+)\s+time:\s+(-?\d+)"
 
     TIMER_MAX = 2**32
 
-    def __init__(self, connection_open_timeout=None):
+    # Chunked serial reader tuning: packets are forwarded to the writer once
+    # either limit is reached, whichever comes first.
+    BATCH_MAX_PACKETS = 64
+    BATCH_MAX_DELAY = 0.005
+    # Longest unterminated line kept between reads before it is discarded.
+    MAX_PENDING_LINE = 4096
+
+    # Limits for buffering pcap records before they are written to the fifo.
+    FLUSH_MAX_DELAY = 0.005
+    FLUSH_MAX_BYTES = 64 * 1024
+
+    # Transports between the serial reader process and the writer.
+    # Longest the readers get to end on their own when a capture stops.
+    STOP_TIMEOUT = 1.0
+
+    # Default port of the TCP pcap output.
+    TCP_PORT = 17760
+
+    # Capture engines of the standalone script; see aio.py for the other.
+    ENGINE_PROCESS = "process"
+    ENGINE_ASYNCIO = "asyncio"
+
+    TRANSPORT_QUEUE = "queue"
+    TRANSPORT_SHM = "shm"
+    RING_SLOTS = 4096
+    # Longest the writer waits on the ring before checking the queue
+    # for control events.
+    RING_POLL_INTERVAL = 0.05
+
+    def __init__(self, connection_open_timeout=None, config: "SnifferConfig | None" = None, **options):
+        """
+        Takes the capture options as a SnifferConfig, as keyword arguments
+        of SnifferConfig, or both, the keyword arguments overriding the
+        config. connection_open_timeout is still accepted as the first
+        positional argument.
+        """
+        if connection_open_timeout is not None:
+            options["connection_open_timeout"] = connection_open_timeout
+        if config is None:
+            config = SnifferConfig(**options)
+        elif options:
+            config = dataclasses.replace(config, **options)
+        self.config = config
         self.queue = Queue()
         self.logger = logging.getLogger(__name__)
         self.dev = None
@@ -109,42 +863,247 @@ class Nrf802154Sniffer:
         self.fifo = None
         self.dlt = DLT.DLT_IEEE802_15_4_TAP
         self.processes: list[Process] = []
+        # Processes that end on stop_event, and only need killing if they
+        # do not within STOP_TIMEOUT.
+        self.readers: list[Process] = []
+        self.stop_event = Event()
         self.windows_mode = is_standalone and os.name == "nt"
-        self.first_local_timestamp = None
-        self.first_sniffer_timestamp = None
         self.thread = None
+        # Outcome of starting and of running the threaded capture.
+        self.started = None
+        self.finished = None
+        self.ring = None
+        self.devices: list[tuple[str, int]] = []
+        self.flow = None
+        if config.max_in_flight_frames is not None or config.max_in_flight_bytes is not None:
+            self.flow = FlowControl(config.max_in_flight_frames, config.max_in_flight_bytes, config.overload_policy)
+        self.control_out_fifo = None
+        self.stream_buffer = deque()
+        self.stream_ended = False
+        # Clock model of every device, by source.
+        self.clocks: dict[int, DeviceClock] = {}
+        # Requested channel of every device, shared with the readers.
+        self.tuning = None
+        # Whether frames keep their FCS, which depends on the metadata.
+        self.keep_fcs = False
+        # Frames with a bad FCS seen by the reader of every device.
+        self.fcs_errors = None
+        self.ring_backlog = deque()
+        self.toolbar_ready = False
+
+        hooks = import_sibling("hooks")
+        capture_hooks = []
+        self.metrics = None
+        if config.metrics_enabled:
+            self.metrics = import_sibling("metrics").CaptureMetrics()
+            capture_hooks.append(
+                hooks.MetricsHook(self, self.metrics, config.metrics_interval, config.metrics_file)
+            )
+        self.talkers = None
+        if config.talkers_enabled:
+            self.talkers = import_sibling("talkers").TopTalkers(config.talkers_capacity)
+            capture_hooks.append(
+                hooks.TalkersHook(self, self.talkers, config.talkers_interval, config.talkers_file)
+            )
+        self.survey = None
+        if config.survey_dwell:
+            self.survey = import_sibling("survey").ChannelSurvey(
+                config.survey_channels or self.CHANNELS, config.survey_dwell, config.survey_rounds
+            )
+            capture_hooks.append(hooks.SurveyHook(self, self.survey, config.survey_file))
+        # Optional consumers of the captured frames.
+        self.hooks = hooks.HookGroup(capture_hooks)
 
-    def correct_time(self, sniffer_timestamp):
+    def device_clock(self, source: int = 0) -> DeviceClock:
+        """
+        Returns the clock model of a device, created on its first frame.
+        """
+        clock = self.clocks.get(source)
+        if clock is None:
+            clock = self.clocks[source] = DeviceClock(self.TIMER_MAX)
+        return clock
+
+    def correct_time(self, sniffer_timestamp, host_time=None):
         """
         Sniffer timestamps are relative to device boot.
         Wireshark expects the packets to have UNIX timestamp.
-        This function converts sniffer timestamps to UNIX time.
+        This function converts sniffer timestamps to UNIX time, through the
+        clock model of the device; host_time is the UNIX time in
+        microseconds at which the frame was read, now if not given.
         """
-        if self.first_local_timestamp is None:
-            # First received packets - set the reference time and convert to microseconds.
-            self.first_local_timestamp = int(time.time()*(10**6))
-            self.first_sniffer_timestamp = sniffer_timestamp
-            return self.first_local_timestamp
-        else:
-            return self.first_local_timestamp - self.first_sniffer_timestamp + sniffer_timestamp
+        return self.device_clock().convert(sniffer_timestamp, host_time)
+
+    def correct_source_time(self, source, sniffer_timestamp, host_time=None):
+        """
+        Same as correct_time, but keeps a separate clock model for every
+        device of a multi-device capture, as each counts from its own boot.
+        """
+        return self.device_clock(source).convert(sniffer_timestamp, host_time)
+
+    @staticmethod
+    def packet_filter(capture_filter: str | None):
+        """
+        Compiles a capture filter into a predicate over packets, or returns
+        None if there is no filter.
+        """
+        if not capture_filter:
+            return None
+        predicate = import_sibling("capture_filter").compile_filter(capture_filter)
+        return lambda p: predicate(p.content, p.rssi, p.lqi)
 
     @classmethod
     def serial_reader(
         cls,
         serial_port: str,
         queue: Queue,
+        capture_filter: str | None = None,
+        fcs_policy=fcs.PASS,
+        keep_fcs=False,
+        fcs_errors=None,
     ) -> None:
+        """
+        Reads the device line by line and queues every packet on its own.
+        Frames are checked against their FCS as LineParser.parse_lines does
+        for fcs_policy and keep_fcs; bad ones are counted in fcs_errors[0].
+        """
         serial = Serial(serial_port, exclusive=True)
+        packet_filter = cls.packet_filter(capture_filter)
         while True:
             try:
                 value = serial.readline()
-                try:
-                    packet = cls.parse_packet(value)
-                    queue.put(packet)
-                except:
-                    ...
+                result = LineParser.parse_lines((value,), fcs_policy, keep_fcs)
+                if result.bad_fcs and fcs_errors is not None:
+                    fcs_errors[0] += result.bad_fcs
+                for packet in result.packets:
+                    if packet_filter is None or packet_filter(packet):
+                        queue.put(packet)
+            except:
+                queue.put(ExitEvent(f"Sniffer device {serial_port} was disconnected."))
+
+    @classmethod
+    def chunked_serial_reader(
+        cls,
+        serial_port: str,
+        queue: Queue,
+        batch_size: int = BATCH_MAX_PACKETS,
+        batch_delay: float = BATCH_MAX_DELAY,
+        ring=None,
+        source: int = 0,
+        flow: FlowControl | None = None,
+        capture_filter: str | None = None,
+        metrics=None,
+        tuning=None,
+        stop=None,
+        fcs_policy=fcs.PASS,
+        keep_fcs=False,
+        fcs_errors=None,
+    ) -> None:
+        """
+        Variant of serial_reader that drains whatever the port has buffered
+        in one read and splits the lines itself, keeping partial lines
+        across reads. Parsed packets are sent to the queue as PacketBatch
+        objects of at most batch_size packets, held back no longer than
+        batch_delay seconds.
+        If a SharedMemoryRing is given, packets are stored in it right away
+        instead and the queue only carries events.
+        Batches are tagged with source to tell devices apart when several
+        readers share one queue. With a FlowControl, batches are only queued
+        within its limits. Packets not matching capture_filter are dropped
+        before they are queued. Counters and latencies are recorded in
+        metrics, if given.
+        tuning is a shared array with the requested channel of every source.
+        When it changes, the device is retuned with a channel command on the
+        open port, and batches are tagged with the channel they were
+        received on. A DeviceReply is queued if the shell rejects the
+        command within RetuneConfirmation's window. The reader returns once
+        the stop event is set.
+        Frames are checked against their FCS as LineParser.parse_lines does
+        for fcs_policy and keep_fcs, so that dropped frames never reach the
+        queue; bad ones are counted in fcs_errors[source].
+        """
+        serial = Serial(serial_port, exclusive=True, timeout=batch_delay)
+        packet_filter = cls.packet_filter(capture_filter)
+        pending = b""
+        batch = []
+        deadline = None
+        read_time = 0
+        parsed_time = 0
+        host_time = 0
+        channel = tuning[source] if tuning is not None else None
+        tuned = channel
+        confirmation = RetuneConfirmation(source)
+        while stop is None or not stop.is_set():
+            try:
+                chunk = serial.read(serial.in_waiting or 1)
             except:
                 queue.put(ExitEvent(f"Sniffer device {serial_port} was disconnected."))
+                return
+
+            if chunk:
+                if metrics is not None:
+                    chunk_time = time.monotonic_ns()
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                if len(pending) > cls.MAX_PENDING_LINE:
+                    pending = b""
+                result = LineParser.parse_lines(lines, fcs_policy, keep_fcs)
+                packets = result.packets
+                if result.bad_fcs and fcs_errors is not None:
+                    fcs_errors[source] += result.bad_fcs
+                if confirmation.awaiting and result.ignored:
+                    for reply in confirmation.check(lines):
+                        if reply.channel is not None:
+                            channel = reply.channel
+                        queue.put(reply)
+                if packet_filter is not None:
+                    packets = [p for p in packets if packet_filter(p)]
+                if metrics is not None:
+                    parsed_time = time.monotonic_ns()
+                    metrics.record_parse(
+                        len(lines), len(result.packets), result.malformed,
+                        len(result.packets) - len(packets), chunk_time, parsed_time,
+                    )
+                    if packets and not batch:
+                        read_time = chunk_time
+                if packets:
+                    host_time = time.time_ns() // 1000
+                batch += packets
+                if ring is not None:
+                    ring.put_packets(batch, channel or 0, host_time)
+                    ring.notify()
+                    if metrics is not None and batch:
+                        metrics.record_queued(len(batch), parsed_time, time.monotonic_ns())
+                    batch = []
+                if batch and deadline is None:
+                    deadline = time.monotonic() + batch_delay
+
+            if confirmation.awaiting:
+                confirmation.expire()
+
+            retune = tuning is not None and tuning[source] != tuned
+            if batch and (retune or len(batch) >= batch_size or time.monotonic() >= deadline):
+                if flow is None:
+                    queue.put(PacketBatch(
+                        batch, source, read_time, time.monotonic_ns() if read_time else 0, channel, host_time
+                    ))
+                    queued = len(batch)
+                else:
+                    queued = flow.send(queue, batch, source, read_time, channel, host_time)
+                if metrics is not None and queued:
+                    metrics.record_queued(queued, parsed_time, time.monotonic_ns())
+                batch = []
+                deadline = None
+            elif flow is not None and flow.pending and not chunk:
+                flow.send(queue, [], source, channel=channel)
+
+            if retune:
+                confirmation.sent(tuning[source], channel)
+                channel = tuned = tuning[source]
+                try:
+                    serial.write(b"channel %d\r\n" % channel)
+                except:
+                    queue.put(ExitEvent(f"Sniffer device {serial_port} was disconnected."))
+                    return
 
     @classmethod
     def parse_packet(cls, value: bytes) -> SnifferPacket:
@@ -166,16 +1125,32 @@ class Nrf802154Sniffer:
         control_in: str,
         queue: Queue,
     ) -> None:
+        """
+        Reads extcap control messages sent by the Wireshark toolbar and
+        passes them to the writer as ControlPacket objects.
+        """
         with open(control_in, "rb", 0) as control_in_fifo:
             try:
                 while True:
-                    value = control_in_fifo.read()
+                    header = control_in_fifo.read(cls.CTRL_HEADER.size)
+                    if len(header) < cls.CTRL_HEADER.size:
+                        raise EOFError
+                    _, length_high, length_low, _, _ = cls.CTRL_HEADER.unpack(header)
+                    payload = control_in_fifo.read((length_high << 16 | length_low) - 2)
+                    queue.put(cls.parse_control(header + payload))
             except:
                 queue.put(ExitEvent("Wireshark connection lost."))
 
-    @staticmethod
-    def parse_control(value: bytes) -> ControlPacket:
-        return ControlPacket(content=value)
+    @classmethod
+    def parse_control(cls, value: bytes) -> ControlPacket:
+        """
+        Parses an extcap control message: sync byte, 24-bit length, control
+        number, command and payload.
+        """
+        sync, _, _, number, command = cls.CTRL_HEADER.unpack_from(value)
+        if sync != b"T":
+            raise ValueError("Invalid control message")
+        return ControlPacket(value[cls.CTRL_HEADER.size:], number, command)
 
     def stop_sig_handler(self, *args, **kwargs):
         """
@@ -190,30 +1165,42 @@ class Nrf802154Sniffer:
 
     def stop_thread(self):
         """
-        Stop the threaded capture.
+        Stop the threaded capture. Raises what ended the capture if it
+        failed.
         """
         self._stop()
         self.queue.put(ExitEvent())
         self.thread.join()
+        self.finished.result()
 
     def _stop(self):
+        # Killing a reader while it writes to the queue would leave half a
+        # message in it, so readers get the chance to finish first.
+        self.stop_event.set()
+        deadline = time.monotonic() + self.STOP_TIMEOUT
         for process in self.processes:
+            if process in self.readers:
+                process.join(max(0.0, deadline - time.monotonic()))
             process.kill()
             process.join()
 
         self.processes = []
+        self.readers = []
+        self.stop_event.clear()
 
-        try:
-            if self.dev:
-                serial = Serial(self.dev, exclusive=True, timeout=0.1)
-                serial.write(b"\r\n")
-                serial.write(b"sleep\r\n")
-                serial.flush()
-                serial.read(100000)
-                serial.reset_input_buffer()
-                serial.close()
-        except SerialException:
-            pass
+        devices = [dev for dev, _ in self.devices] if self.devices else [self.dev]
+        for dev in devices:
+            try:
+                if dev:
+                    with Serial(dev, exclusive=True, timeout=0.1) as serial:
+                        session = DeviceSession(serial)
+                        session.sync()
+                        session.command(b"sleep")
+                        serial.reset_input_buffer()
+            except SerialException:
+                pass
+            except DeviceError as e:
+                self.logger.warning("%s", e)
 
     @staticmethod
     def extcap_interfaces():
@@ -221,26 +1208,31 @@ class Nrf802154Sniffer:
         Wireshark-related method that returns configuration options.
         :return: string with wireshark-compatible information
         """
-        res = []
-        res.append(
-            "extcap {version=0.8.0}{help=https://github.com/NordicSemiconductor/nRF-Sniffer-for-802.15.4}{display=nRF Sniffer for 802.15.4}"
-        )
-        for port in comports():
-            if (
-                port.vid == Nrf802154Sniffer.NORDICSEMI_VID
-                and port.pid == Nrf802154Sniffer.SNIFFER_802154_PID
-            ):
-                res.append(
-                    "interface {value=%s}{display=nRF Sniffer for 802.15.4}"
-                    % (port.device,)
-                )
+        return discovery.extcap_interfaces()
 
-        res.append(
-            "control {number=%d}{type=button}{role=logger}{display=Log}{tooltip=Show capture log}"
-            % Nrf802154Sniffer.CTRL_ARG_LOGGER
-        )
+    @staticmethod
+    def sniffer_ports(max_age=0.0):
+        """
+        Returns the serial ports of all connected sniffer devices, sorted.
+        Enumerates the ports unless max_age allows reusing a recent listing.
+        """
+        return discovery.sniffer_ports(max_age)
 
-        return "\n".join(res)
+    @staticmethod
+    def multi_devices(channels):
+        """
+        Pairs the connected sniffer devices with the given channels,
+        in port order.
+        :param channels: comma separated list of channels
+        :return: list of (device, channel) pairs
+        """
+        channels = [int(channel) for channel in channels.split(",")]
+        ports = Nrf802154Sniffer.sniffer_ports()
+        if len(channels) > len(ports):
+            raise ValueError(
+                "%d channels given but only %d sniffer devices connected" % (len(channels), len(ports))
+            )
+        return list(zip(ports, channels))
 
     @staticmethod
     def extcap_dlts():
@@ -248,83 +1240,21 @@ class Nrf802154Sniffer:
         Wireshark-related method that returns configuration options.
         :return: string with wireshark-compatible information
         """
-        res = []
-        res.append(
-            "dlt {number=%d}{name=IEEE802_15_4_TAP}{display=IEEE 802.15.4 TAP}"
-            % DLT.DLT_IEEE802_15_4_TAP
-        )
-        res.append(
-            "dlt {number=%d}{name=IEEE802_15_4_NOFCS}{display=IEEE 802.15.4 without FCS}"
-            % DLT.DLT_IEEE802_15_4_NOFCS
-        )
-
-        return "\n".join(res)
+        return discovery.extcap_dlts()
 
     @staticmethod
-    def extcap_config(option):
+    def extcap_config(option, interface=None):
         """
         Wireshark-related method that returns configuration options.
         :return: string with wireshark-compatible information
         """
-        args = []
-        values = []
-        res = []
-
-        args.append(
-            (
-                0,
-                "--channel",
-                "Channel",
-                "IEEE 802.15.4 channel",
-                "selector",
-                "{required=true}{default=11}",
-            )
-        )
-        args.append(
-            (
-                1,
-                "--metadata",
-                "Out-Of-Band meta-data",
-                "Packet header containing out-of-band meta-data for channel, RSSI and LQI",
-                "selector",
-                "{default=none}",
-            )
-        )
-
-        if len(option) <= 0:
-            for arg in args:
-                res.append(
-                    "arg {number=%d}{call=%s}{display=%s}{tooltip=%s}{type=%s}%s" % arg
-                )
-
-            values = values + [
-                (0, "%d" % i, "%d" % i, "true" if i == 11 else "false")
-                for i in range(11, 27)
-            ]
-
-            values.append((1, "ieee802154-tap", "IEEE 802.15.4 TAP", "true"))
-            values.append((1, "none", "None", "false"))
-
-        for value in values:
-            res.append("value {arg=%d}{value=%s}{display=%s}{default=%s}" % value)
-        res.append(
-            "control {number=4}{type=button}{role=logger}{display=Log}{tooltip=Show capture log}"
-        )
-        return "\n".join(res)
+        return discovery.extcap_config(option, interface)
 
     def pcap_header(self):
         """
         Returns pcap header to be written into pcap file.
         """
-        header = bytearray()
-        header += struct.pack("<L", int("a1b2c3d4", 16))
-        header += struct.pack("<H", 2)  # Pcap Major Version
-        header += struct.pack("<H", 4)  # Pcap Minor Version
-        header += struct.pack("<I", int(0))  # Timezone
-        header += struct.pack("<I", int(0))  # Accurancy of timestamps
-        header += struct.pack("<L", int("000000ff", 16))  # Max Length of capture frame
-        header += struct.pack("<L", self.dlt)  # DLT
-        return header
+        return bytearray(pcap_header(self.dlt))
 
     @staticmethod
     def pcap_packet(
@@ -333,108 +1263,773 @@ class Nrf802154Sniffer:
         """
         Creates pcap packet to be seved in pcap file.
         """
-        pcap = bytearray()
-
-        caplength = len(frame)
-
         if dlt == DLT.DLT_IEEE802_15_4_TAP:
-            caplength += 28
-
-        pcap += struct.pack("<L", timestamp // 1000000)  # Timestamp seconds
-        pcap += struct.pack("<L", timestamp % 1000000)  # Timestamp microseconds
-        pcap += struct.pack("<L", caplength)  # Length captured
-        pcap += struct.pack("<L", caplength)  # Length in frame
-
-        if dlt == DLT.DLT_IEEE802_15_4_TAP:
-            # Append TLVs according to 802.15.4 TAP specification:
-            # https://github.com/jkcko/ieee802.15.4-tap
-            pcap += struct.pack("<HH", 0, 28)
-            pcap += struct.pack("<HHf", 1, 4, rssi)
-            pcap += struct.pack("<HHHH", 3, 3, channel, 0)
-            pcap += struct.pack("<HHI", 10, 1, lqi)
-
-        pcap += frame
+            header = PcapWriter.TAP_RECORD_HEADER
+            caplength = len(frame) + header.length
+            record = (timestamp // 1000000, timestamp % 1000000, caplength, caplength)
+            return header.pack(record, channel, rssi, lqi) + frame
 
-        return bytes(pcap)
+        caplength = len(frame)
+        return PcapWriter.RECORD_HEADER.pack(
+            timestamp // 1000000, timestamp % 1000000, caplength, caplength
+        ) + frame
 
-    def append_process(self, target, args):
+    def append_process(self, target, args, kwargs=None):
         # Given all the multiplatform quirks, using subprocesses is the
         # best bet at making things somewhat clean.
-        self.processes.append(Process(target=target, args=args, daemon=True))
+        process = Process(target=target, args=args, kwargs=kwargs or {}, daemon=True)
+        self.processes.append(process)
+        if kwargs and "stop" in kwargs:
+            self.readers.append(process)
+
+    def reader_options(self, **kwargs):
+        """
+        Returns the keyword arguments for chunked_serial_reader.
+        """
+        return dict(
+            batch_size=self.config.batch_size,
+            batch_delay=self.config.batch_delay,
+            capture_filter=self.config.capture_filter,
+            metrics=self.metrics,
+            tuning=self.tuning,
+            stop=self.stop_event,
+            fcs_policy=self.config.fcs_policy,
+            keep_fcs=self.keep_fcs,
+            fcs_errors=self.fcs_errors,
+            **kwargs,
+        )
 
     def start_processes(self):
         for process in self.processes:
             process.start()
 
-    def _start(
-        self, fifo, dev, channel, metadata=None, control_in=None, control_out=None
-    ):
+    def add_readers(self, devices, control_in=None):
         """
-        This method starts the sniffer capture and blocks until the process is killed.
+        Puts every device of the capture, given as (device, channel) pairs,
+        into receive mode and adds its reader process, and one for the
+        Wireshark control fifo if given. The source of a device is its
+        index in devices.
         """
-        self.channel = channel
-        self.dev = dev
-        self.control_in = control_in
-        self.control_out = control_out
-        self.fifo = fifo
-
-        if metadata == "ieee802154-tap":
-            # For Wireshark 3.0 and later
-            self.dlt = DLT.DLT_IEEE802_15_4_TAP
-        else:
-            self.dlt = DLT.DLT_IEEE802_15_4_NOFCS
-
-        serial = Serial(self.dev, exclusive=True, timeout=0.1)
-        serial.write(b"sleep\r\n")
-        serial.write(b"shell echo off\r\n")
-        serial.flush()
-        serial.readall()
-        serial.write(b"channel " + bytes(str(self.channel).encode()) + b"\r\n")
-        serial.write(b"receive\r\n")
-        serial.flush()
-        serial.close()
-
-        self.append_process(target=self.serial_reader, args=(self.dev, self.queue))
+        self.tuning = RawArray("i", [channel for _, channel in devices])
+        self.fcs_errors = RawArray("q", len(devices))
+        self.clocks = {}
+        for dev, channel in devices:
+            self.configure_device(dev, channel)
+
+        if self.config.transport == self.TRANSPORT_SHM:
+            self.ring = import_sibling("shm_ring").SharedMemoryRing.create(self.config.ring_slots)
+        for source, (dev, channel) in enumerate(devices):
+            if self.ring is not None:
+                self.append_process(
+                    target=self.chunked_serial_reader,
+                    args=(dev, self.queue),
+                    kwargs=self.reader_options(source=source, ring=self.ring),
+                )
+            elif self.config.chunked_reader:
+                self.append_process(
+                    target=self.chunked_serial_reader,
+                    args=(dev, self.queue),
+                    kwargs=self.reader_options(source=source, flow=self.flow),
+                )
+            else:
+                self.append_process(
+                    target=self.serial_reader,
+                    args=(
+                        dev,
+                        self.queue,
+                        self.config.capture_filter,
+                        self.config.fcs_policy,
+                        self.keep_fcs,
+                        self.fcs_errors,
+                    ),
+                )
 
-        if self.control_in:
+        if control_in:
             self.append_process(
-                target=self.control_reader, args=(self.control_in, self.queue)
+                target=self.control_reader, args=(control_in, self.queue)
             )
 
+    def begin_capture(self, fifo, devices, metadata=None, control_in=None, control_out=None):
+        """
+        Starts the readers of a capture to a fifo from the given
+        (device, channel) pairs.
+        """
+        self.control_in = control_in
+        self.control_out = control_out
+        self.fifo = fifo
+        self.set_metadata(metadata)
+        self.add_readers(devices, control_in)
+        if self.started is not None and not self.started.done():
+            self.started.set_result(None)
+
         if self.control_out:
-            fh = open(self.control_out, "wb", 0)
+            self.control_out_fifo = open(self.control_out, "wb", 0)
 
         self.start_processes()
 
+    def finish_capture(self):
+        """
+        Reports on a capture that has ended and releases its transport.
+        """
+        self.report_drops()
+        self.report_fcs_errors()
+        self.report_clocks()
+        self.hooks.stop()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def hooks_timeout(self, timeout):
+        """
+        Shortens a writer loop wait so that the capture hooks are not late.
+        """
+        remaining = self.hooks.timeout()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def _start(
+        self, fifo, dev, channel, metadata=None, control_in=None, control_out=None
+    ):
+        """
+        This method starts the sniffer capture and blocks until the process is killed.
+        In survey mode, the capture starts on the first surveyed channel.
+        """
+        self.channel = channel if self.survey is None else self.survey.channel
+        self.dev = dev
+        self.begin_capture(fifo, [(self.dev, self.channel)], metadata, control_in, control_out)
+
         try:
-            with open(self.fifo, "wb", 0) as fifo:
-                fifo.write(self.pcap_header())
-                fifo.flush()
+            with self.open_output() as writer:
+                self.hooks.start(writer)
+
+                while True:
+                    try:
+                        packet = self._receive(self.hooks_timeout(writer.timeout()))
+                    except Empty:
+                        writer.flush()
+                        self.hooks.poll(writer)
+                        continue
 
-                while packet := self.queue.get():
                     match packet:
                         case SnifferPacket(content, timestamp, lqi, rssi):
-                            pcap = self.pcap_packet(
-                                content, self.dlt, self.channel, rssi, lqi, self.correct_time(timestamp)
+                            writer.write_packet(
+                                content, self.channel, rssi, lqi, self.correct_time(timestamp)
                             )
-                            fifo.write(pcap)
+                            self.hooks.add(PacketBatch([packet]), self.channel)
+                        case PacketBatch(packets):
+                            channel = self.channel if packet.channel is None else packet.channel
+                            convert = self.device_clock().convert
+                            host_time = packet.host_time or time.time_ns() // 1000
+                            for p in packets:
+                                writer.write_packet(
+                                    p.content, channel, p.rssi, p.lqi, convert(p.timestamp, host_time)
+                                )
+                            self.hooks.add(packet, channel)
+                            if self.flow is not None and self.ring is None:
+                                self.flow.release(packets)
+                        case ControlPacket():
+                            self.handle_control(packet)
+                        case DeviceReply():
+                            self.handle_reply(packet)
                         case ExitEvent(reason):
+                            writer.flush()
                             if reason:
                                 sys.stderr.write(reason)
                             self._stop()
                             break
+                    writer.poll()
+                    self.hooks.poll(writer)
         except BrokenPipeError:
             self._stop()
+        finally:
+            self.finish_capture()
+
+    def _start_multi(
+        self, fifo, devices, metadata=None, control_in=None, control_out=None
+    ):
+        """
+        This method starts a capture from several sniffer devices, each on
+        its own channel, and blocks until the process is killed.
+        Frames of all devices are merged in timestamp order into one pcap
+        stream and tagged with the channel they were received on.
+        Raises ValueError if the config has options that only work with
+        one device; see SnifferConfig.multi_device_errors.
+        :param devices: list of (device, channel) pairs
+        """
+        errors = self.config.multi_device_errors()
+        if errors:
+            raise ValueError("Captures from several devices do not support %s" % ", ".join(errors))
+        self.devices = list(devices)
+        self.begin_capture(fifo, self.devices, metadata, control_in, control_out)
+
+        merger = TimestampMerger(len(self.devices), self.MERGE_MAX_DELAY)
+        try:
+            with self.open_output() as writer:
+                self.hooks.start(writer)
+
+                while True:
+                    now = int(time.time()*(10**6))
+                    timeouts = [t for t in (writer.timeout(), merger.timeout(now)) if t is not None]
+                    try:
+                        packet = self.queue.get(timeout=self.hooks_timeout(min(timeouts, default=None)))
+                    except Empty:
+                        packet = None
+
+                    match packet:
+                        case PacketBatch(packets, source):
+                            channel = self.devices[source][1] if packet.channel is None else packet.channel
+                            convert = self.device_clock(source).convert
+                            host_time = packet.host_time or time.time_ns() // 1000
+                            for p in packets:
+                                merger.push(source, convert(p.timestamp, host_time), (p, channel))
+                            self.hooks.add(packet, channel)
+                            if self.flow is not None:
+                                self.flow.release(packets)
+                        case ControlPacket():
+                            self.handle_control(packet)
+                        case DeviceReply():
+                            self.handle_reply(packet)
+                        case ExitEvent(reason):
+                            for timestamp, (p, channel) in merger.drain():
+                                writer.write_packet(p.content, channel, p.rssi, p.lqi, timestamp)
+                            writer.flush()
+                            if reason:
+                                sys.stderr.write(reason)
+                            self._stop()
+                            break
+
+                    for timestamp, (p, channel) in merger.pop_ready(int(time.time()*(10**6))):
+                        writer.write_packet(p.content, channel, p.rssi, p.lqi, timestamp)
+                    writer.poll()
+                    self.hooks.poll(writer)
+        except BrokenPipeError:
+            self._stop()
+        finally:
+            self.finish_capture()
+
+    @contextmanager
+    def open_output(self):
+        """
+        Opens the capture outputs and yields their record writer. The main
+        output is the Wireshark fifo, a ring of pcapng files when recording
+        to a directory, a capture archive, or pcap files of the frames
+        around triggers; ZEP and TCP network outputs can be added to it or
+        used on their own.
+        """
+        with ExitStack() as stack:
+            writers = []
+            if self.config.archive is not None:
+                writer = import_sibling("archive").ArchiveWriter(self.config.archive, fcs=self.keep_fcs)
+                stack.callback(writer.close)
+                writers.append(writer)
+            elif self.config.record_dir is not None:
+                interfaces = [
+                    (channel, "%s channel %d" % (dev, channel))
+                    for dev, channel in (self.devices or [(self.dev, self.channel)])
+                ]
+                writer = import_sibling("pcapng").RotatingRecorder(
+                    self.config.record_dir,
+                    self.dlt,
+                    interfaces,
+                    max_file_bytes=self.config.record_file_bytes,
+                    max_file_seconds=self.config.record_file_seconds,
+                    max_files=self.config.record_files,
+                    fcs=self.keep_fcs,
+                )
+                stack.callback(writer.close)
+                writers.append(writer)
+            elif self.config.trigger_dir is not None:
+                compile_filter = import_sibling("capture_filter").compile_filter
+                writer = import_sibling("trigger").TriggerRecorder(
+                    self.config.trigger_dir,
+                    pcap_header(self.dlt),
+                    PcapWriter,
+                    self.dlt,
+                    [(trigger, compile_filter(trigger)) for trigger in self.config.triggers],
+                    pre_seconds=self.config.trigger_pre_seconds,
+                    pre_bytes=self.config.trigger_pre_bytes,
+                    post_seconds=self.config.trigger_post_seconds,
+                    on_incident=self.log_incident,
+                    fcs=self.keep_fcs,
+                )
+                stack.callback(writer.close)
+                writers.append(writer)
+            elif self.fifo is not None:
+                fifo = stack.enter_context(open(self.fifo, "wb", 0))
+                fifo.write(pcap_header(self.dlt))
+                fifo.flush()
+                writers.append(PcapWriter(fifo, self.dlt, self.config.flush_delay, self.config.flush_size, self.keep_fcs))
+
+            if self.config.zep is not None:
+                netstream = import_sibling("netstream")
+                writer = netstream.ZepSender(netstream.parse_address(self.config.zep, netstream.ZEP_PORT), fcs=self.keep_fcs)
+                stack.callback(writer.close)
+                writers.append(writer)
+            if self.config.tcp_listen is not None:
+                netstream = import_sibling("netstream")
+                writer = netstream.TcpPcapServer(
+                    netstream.parse_address(self.config.tcp_listen, self.TCP_PORT),
+                    pcap_header(self.dlt),
+                    PcapWriter,
+                    self.dlt,
+                    self.config.net_buffer,
+                    self.config.net_lag_policy,
+                    self.config.flush_delay,
+                    self.config.flush_size,
+                    self.keep_fcs,
+                )
+                stack.callback(writer.close)
+                writers.append(writer)
+
+            yield writers[0] if len(writers) == 1 else OutputGroup(writers)
+
+    def _receive(self, timeout):
+        """
+        Returns the next item for the writer loop, raising Empty on timeout.
+        With the shared memory transport, frames come from the ring and
+        events from the queue.
+        """
+        if self.ring is None:
+            return self.queue.get(timeout=timeout)
+
+        try:
+            return self.queue.get_nowait()
+        except Empty:
+            pass
+        if not self.ring_backlog:
+            if timeout is None or timeout > self.RING_POLL_INTERVAL:
+                timeout = self.RING_POLL_INTERVAL
+            items = self.ring.get_batch(self.config.ring_slots, timeout)
+            if not items:
+                raise Empty
+            self.ring_backlog = self.ring_runs(items)
+        items = self.ring_backlog.popleft()
+        _, _, _, _, channel, host_time = items[0]
+        return PacketBatch(
+            [SnifferPacket(content, timestamp, lqi, rssi) for content, timestamp, lqi, rssi, _, _ in items],
+            channel=channel,
+            host_time=host_time,
+        )
+
+    @staticmethod
+    def ring_runs(items) -> deque:
+        """
+        Splits frames read from the ring into runs of one serial read, as
+        batches carry a single channel and host receive time.
+        """
+        first, last = items[0], items[-1]
+        if first[4] == last[4] and first[5] == last[5]:
+            return deque((items,))
+        runs = deque()
+        start = 0
+        channel, host_time = first[4], first[5]
+        for index, item in enumerate(items):
+            if item[5] != host_time or item[4] != channel:
+                runs.append(items[start:index])
+                start = index
+                channel, host_time = item[4], item[5]
+        runs.append(items[start:])
+        return runs
+
+    def stats(self) -> dict | None:
+        """
+        Returns a snapshot of the capture metrics, or None if metrics are
+        not enabled.
+        """
+        if self.metrics is None:
+            return None
+        if self.ring is not None:
+            depth = len(self.ring)
+        elif self.flow is not None:
+            depth = self.flow.frames.value
+        else:
+            depth = 0
+        return self.metrics.snapshot(frames_dropped=self.dropped_frames(), queue_depth=depth)
+
+    def end_capture(self):
+        """
+        Makes the writer loop end the capture as if the device was gone.
+        """
+        self.queue.put(ExitEvent())
+
+    def dropped_frames(self) -> int:
+        """
+        Returns the number of frames dropped because the writer fell behind.
+        """
+        dropped = 0
+        if self.flow is not None:
+            dropped += self.flow.dropped.value
+        if self.ring is not None:
+            dropped += self.ring.overruns
+        return dropped
+
+    def report_drops(self):
+        """
+        Reports frames dropped during the capture on stderr and in the
+        Wireshark capture log.
+        """
+        dropped = self.dropped_frames()
+        if not dropped:
+            return
+        message = "%d frames dropped because the capture consumer fell behind.\n" % dropped
+        sys.stderr.write(message)
+        self.logger.warning(message.strip())
+        self.control_log(message)
+
+    def report_fcs_errors(self):
+        """
+        Reports frames whose FCS did not match on stderr and in the
+        Wireshark capture log.
+        """
+        if self.fcs_errors is None or not sum(self.fcs_errors):
+            return
+        message = "%d frames with a bad FCS %s.\n" % (
+            sum(self.fcs_errors), "dropped" if self.config.fcs_policy == fcs.DROP else "received",
+        )
+        sys.stderr.write(message)
+        self.logger.warning(message.strip())
+        self.control_log(message)
+
+    def report_clocks(self) -> None:
+        """
+        Logs the state of the clock model of every device.
+        """
+        for source, clock in sorted(self.clocks.items()):
+            stats = clock.stats()
+            message = f"Clock of device {source}: {stats['wraps']} timer wraps, {stats['resyncs']} resyncs"
+            if stats["skew_error_ppm"] is not None:
+                message += (
+                    f", skew {stats['skew_ppm']:+.3f} ± {stats['skew_error_ppm']:.3f} ppm"
+                    f", residual {stats['residual_us']:.0f} us"
+                )
+            self.logger.info(message)
+
+    def log_incident(self, incident: dict) -> None:
+        """
+        Logs an incident written by trigger-based capture.
+        """
+        message = "Trigger '%s' at %s: %d frames (%d triggers) written to %s" % (
+            incident["trigger"],
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(incident["time"] / 1e6)),
+            incident["frames"],
+            incident["triggers"],
+            incident["path"],
+        )
+        self.logger.info(message)
+        self.control_log(message + "\n")
+
+    def control_log(self, message: str):
+        """
+        Appends a message to the log of the Wireshark toolbar, if connected.
+        """
+        if self.control_out_fifo is None:
+            return
+        try:
+            self.write_control(self.CTRL_ARG_LOGGER, self.CTRL_CMD_ADD, message.encode())
+        except OSError:
+            pass
+
+    def write_control(self, number: int, command: int, payload: bytes = b""):
+        """
+        Sends a message to the Wireshark toolbar as defined by the extcap
+        control protocol: sync byte, 24-bit length, control number,
+        command and payload.
+        """
+        length = len(payload) + 2
+        self.control_out_fifo.write(
+            self.CTRL_HEADER.pack(b"T", length >> 16, length & 0xFFFF, number, command) + payload
+        )
+
+    def set_channel(self, channel: int, source: int = 0):
+        """
+        Retunes a running capture to another channel without restarting it.
+        The reader sends a single channel command on the open serial port,
+        and frames read after it are tagged with the new channel. Raises
+        RuntimeError with the line by line reader, which cannot retune.
+        :param source: index of the device in a multi-device capture
+        """
+        if channel not in self.CHANNELS:
+            raise ValueError("Invalid channel: %s" % channel)
+        if self.tuning is None:
+            raise RuntimeError("No capture is running")
+        if not self.config.chunked_reader:
+            raise RuntimeError("The line by line reader cannot retune a running capture")
+        self.tuning[source] = channel
+        if self.devices:
+            self.devices[source] = (self.devices[source][0], channel)
+        else:
+            self.channel = channel
+
+    def handle_control(self, control: ControlPacket):
+        """
+        Applies a message from the Wireshark toolbar.
+        """
+        if control.command == self.CTRL_CMD_INITIALIZED:
+            # Wireshark sends the toolbar values before this; show the
+            # channel actually captured on instead of applying them.
+            self.toolbar_ready = True
+            if not self.devices and self.control_out_fifo is not None:
+                try:
+                    self.write_control(self.CTRL_ARG_CHANNEL, self.CTRL_CMD_SET, b"%d" % self.channel)
+                except OSError:
+                    pass
+        elif control.number == self.CTRL_ARG_CHANNEL and control.command == self.CTRL_CMD_SET:
+            if not self.toolbar_ready:
+                return
+            if self.devices:
+                self.control_log("Channel selection is not supported when capturing from several devices")
+                return
+            try:
+                self.set_channel(int(control.content))
+            except ValueError:
+                self.control_log("Invalid channel: %s" % control.content.decode(errors="replace"))
+                return
+            except RuntimeError as e:
+                self.control_log(str(e))
+                return
+            self.control_log("Retuned to channel %d" % self.channel)
+
+    def handle_reply(self, reply: DeviceReply):
+        """
+        Reports a command the device rejected during the capture. If the
+        device stayed on another channel than requested, the capture and
+        the toolbar follow it.
+        """
+        self.logger.error("%s", reply.error)
+        self.control_log(reply.error)
+        if reply.channel is None:
+            return
+        if self.devices:
+            self.devices[reply.source] = (self.devices[reply.source][0], reply.channel)
+            return
+        self.channel = reply.channel
+        if self.toolbar_ready and self.control_out_fifo is not None:
+            try:
+                self.write_control(self.CTRL_ARG_CHANNEL, self.CTRL_CMD_SET, b"%d" % self.channel)
+            except OSError:
+                pass
+
+    def set_metadata(self, metadata):
+        if metadata == "ieee802154-tap":
+            # For Wireshark 3.0 and later
+            self.dlt = DLT.DLT_IEEE802_15_4_TAP
+        elif metadata == "ieee802154-fcs":
+            self.dlt = DLT.DLT_IEEE802_15_4_WITHFCS
+        else:
+            self.dlt = DLT.DLT_IEEE802_15_4_NOFCS
+        # Frames keep their FCS where the output has room for it.
+        self.keep_fcs = (
+            self.dlt == DLT.DLT_IEEE802_15_4_WITHFCS
+            or (self.dlt == DLT.DLT_IEEE802_15_4_TAP and self.config.fcs_policy == fcs.FLAG)
+        )
+        if self.config.fcs_policy == fcs.FLAG and not self.keep_fcs:
+            self.logger.warning("Frames with a bad FCS can only be flagged with TAP or FCS metadata.")
+
+    @staticmethod
+    def configure_device(dev, channel):
+        """
+        Puts the sniffer device into receive mode on the given channel.
+        Raises DeviceError if the device rejects a command.
+        """
+        with Serial(dev, exclusive=True, timeout=0.1) as serial:
+            session = DeviceSession(serial)
+            session.sync()
+            session.command(b"sleep")
+            session.command(b"shell echo off")
+            session.command(b"channel %d" % channel)
+            session.command(b"receive")
 
     def start_threaded(
         self, fifo, dev, channel, metadata=None, control_in=None, control_out=None
     ):
         """
-        This method starts the sniffer capture in a separate thread.
-        Use .stop_threaded to end the process.
+        This method starts the sniffer capture in a separate thread, and
+        returns once the device is receiving. Raises what stopped the
+        capture from starting, such as DeviceError.
+        Use .stop_thread to end the process.
+        """
+        self.run_threaded(self._start, (fifo, dev, channel, metadata, control_in, control_out))
+
+    def start_multi_threaded(
+        self, fifo, devices, metadata=None, control_in=None, control_out=None
+    ):
+        """
+        This method starts a multi-device capture in a separate thread, and
+        returns once the devices are receiving. Raises what stopped the
+        capture from starting, such as DeviceError.
+        Use .stop_thread to end the process.
+        :param devices: list of (device, channel) pairs
+        """
+        self.run_threaded(self._start_multi, (fifo, devices, metadata, control_in, control_out))
+
+    def run_threaded(self, target, args):
+        """
+        Runs a capture in a separate thread, waiting for it to start. A
+        capture that fails later raises from .stop_thread.
         """
-        self.thread = Thread(target=self._start, args=(fifo, dev, channel, metadata, control_in, control_out))
+        self.started = Future()
+        self.finished = Future()
+        self.thread = Thread(target=self._run_thread, args=(target, args))
         self.thread.start()
+        try:
+            self.started.result()
+        except BaseException:
+            self.thread.join()
+            raise
+
+    def _run_thread(self, target, args):
+        try:
+            target(*args)
+        except BaseException as e:
+            if self.started.done():
+                self.logger.error("Capture failed: %s", e)
+                self.finished.set_exception(e)
+            else:
+                self.started.set_exception(e)
+                self.finished.set_result(None)
+        else:
+            if not self.started.done():
+                self.started.set_result(None)
+            self.finished.set_result(None)
+
+    def start_stream(self, dev, channel, keep_fcs=False):
+        """
+        Starts a capture whose packets are retrieved in-process with
+        .get_batch, .iter_packets or .aiter_packets instead of being written
+        to a fifo. Use .stop_stream to end it. With keep_fcs, packets end
+        with their FCS. The capture hooks are driven by the .get_batch
+        calls; in survey mode, the capture starts on the first surveyed
+        channel and ends when the survey is complete.
+        """
+        self.channel = channel if self.survey is None else self.survey.channel
+        self.dev = dev
+        self.keep_fcs = keep_fcs
+        self.stream_buffer = deque()
+        self.stream_ended = False
+        # Held by .get_batch while it receives; .stop_stream takes it
+        # before releasing the transport.
+        self.stream_lock = threading.Lock()
+        self.stream_stopping = False
+        self.add_readers([(self.dev, self.channel)])
+        self.start_processes()
+        self.hooks.start(None)
+
+    def stop_stream(self):
+        """
+        Stops a capture started with .start_stream. A .get_batch blocked in
+        another thread, such as the executor call of .aiter_packets,
+        returns the packets it already has within RING_POLL_INTERVAL, and
+        later calls only drain what is left; the transport is released
+        once no call is receiving any more.
+        """
+        self._stop()
+        self.stream_stopping = True
+        with self.stream_lock:
+            self.stream_ended = True
+        self.finish_capture()
+
+    def get_batch(self, max_n=BATCH_MAX_PACKETS, timeout=None) -> list[CapturedPacket]:
+        """
+        Returns up to max_n captured packets, waiting up to timeout seconds
+        (forever if None) for the first one. Returns an empty list on
+        timeout or once the capture has ended.
+        """
+        with self.stream_lock:
+            return self._get_batch(max_n, timeout)
+
+    def _get_batch(self, max_n, timeout):
+        buffer = self.stream_buffer
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Waits are cut into RING_POLL_INTERVAL slices so that .stop_stream
+        # is noticed.
+        while len(buffer) < max_n and not self.stream_ended and not self.stream_stopping:
+            if buffer:
+                wait = 0
+            elif deadline is None:
+                wait = self.RING_POLL_INTERVAL
+            else:
+                wait = min(self.RING_POLL_INTERVAL, max(0.0, deadline - time.monotonic()))
+            try:
+                item = self._receive(wait)
+            except Empty:
+                self.hooks.poll(None)
+                if buffer or deadline is not None and time.monotonic() >= deadline:
+                    break
+                continue
+
+            match item:
+                case PacketBatch(packets):
+                    channel = self.channel if item.channel is None else item.channel
+                    convert = self.device_clock().convert
+                    host_time = item.host_time or time.time_ns() // 1000
+                    buffer.extend(
+                        CapturedPacket(p.content, convert(p.timestamp, host_time), channel, p.rssi, p.lqi)
+                        for p in packets
+                    )
+                    self.hooks.add(item, channel)
+                    if self.flow is not None and self.ring is None:
+                        self.flow.release(packets)
+                case SnifferPacket(content, timestamp, lqi, rssi):
+                    buffer.append(CapturedPacket(content, self.correct_time(timestamp), self.channel, rssi, lqi))
+                    self.hooks.add(PacketBatch([item]), self.channel)
+                case DeviceReply():
+                    self.handle_reply(item)
+                case ExitEvent(reason):
+                    if reason:
+                        self.logger.error(reason)
+                    self.stream_ended = True
+            self.hooks.poll(None)
+
+        return [buffer.popleft() for _ in range(min(max_n, len(buffer)))]
+
+    def iter_packets(self, max_n=BATCH_MAX_PACKETS):
+        """
+        Yields captured packets until the capture ends.
+        """
+        while batch := self.get_batch(max_n):
+            yield from batch
+
+    async def aiter_packets(self, max_n=BATCH_MAX_PACKETS, poll_interval=0.1):
+        """
+        Asynchronously yields captured packets until the capture ends.
+        Waiting for packets happens in the default executor, re-checked
+        every poll_interval seconds so that cancellation is not held up.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await loop.run_in_executor(None, self.get_batch, max_n, poll_interval)
+            for packet in batch:
+                yield packet
+            if not batch and self.stream_ended:
+                return
+
+    def _attach(self, fifo, socket_path, dev, metadata=None):
+        """
+        Streams the capture of a device owned by the capture daemon
+        (python -m nrf802154_sniffer.daemon) into the fifo, instead of
+        opening the device. The daemon decides the channel.
+        """
+        import socket
+
+        self.set_metadata(metadata)
+        dlt = {DLT.DLT_IEEE802_15_4_TAP: b"tap", DLT.DLT_IEEE802_15_4_WITHFCS: b"fcs"}.get(self.dlt, b"nofcs")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall(b"attach %s %s\n" % (dev.encode(), dlt))
+            data = client.recv(1 << 16)
+            if data.startswith(b"error"):
+                sys.stderr.write("Capture daemon: %s" % data.decode(errors="replace"))
+                sys.exit(1)
+            try:
+                with open(fifo, "wb", 0) as f:
+                    while data:
+                        f.write(data)
+                        data = client.recv(1 << 16)
+            except BrokenPipeError:
+                pass
 
     def extcap_capture(
         self, fifo, dev, channel, metadata=None, control_in=None, control_out=None
@@ -493,16 +2088,209 @@ class Nrf802154Sniffer:
             "--extcap-control-out", help="Used to send control messages to toolbar"
         )
 
+        parser.add_argument(
+            "--engine",
+            help="Capture engine: reader processes, or a single process with an asyncio event loop (POSIX only)",
+            choices=[Nrf802154Sniffer.ENGINE_PROCESS, Nrf802154Sniffer.ENGINE_ASYNCIO],
+            default=Nrf802154Sniffer.ENGINE_PROCESS,
+        )
+
+        parser.add_argument(
+            "--transport",
+            help="Transport between the serial reader and the writer",
+            choices=[Nrf802154Sniffer.TRANSPORT_QUEUE, Nrf802154Sniffer.TRANSPORT_SHM],
+            default=Nrf802154Sniffer.TRANSPORT_QUEUE,
+        )
+
+        parser.add_argument(
+            "--max-in-flight-frames",
+            help="Most frames buffered between the serial reader and the writer",
+            type=int,
+        )
+        parser.add_argument(
+            "--max-in-flight-bytes",
+            help="Most frame bytes buffered between the serial reader and the writer",
+            type=int,
+        )
+        parser.add_argument(
+            "--overload-policy",
+            help="What to do with new frames when the buffer limits are reached",
+            choices=FlowControl.POLICIES,
+            default=FlowControl.BLOCK,
+        )
+
+        parser.add_argument(
+            "--metrics-interval",
+            help="Log capture metrics every given number of seconds",
+            type=float,
+        )
+        parser.add_argument(
+            "--metrics-file",
+            help="Write capture metrics to this file in Prometheus text format",
+        )
+
+        parser.add_argument(
+            "--talkers-interval",
+            help="Log the busiest sources every given number of seconds",
+            type=float,
+        )
+        parser.add_argument(
+            "--talkers-file",
+            help="Write per-PAN and per-address top talker counts to this file as JSON",
+        )
+        parser.add_argument(
+            "--talkers-capacity",
+            help="Most PANs and addresses counted at once; rarer ones have approximate counts",
+            type=int,
+            default=1024,
+        )
+
+        parser.add_argument(
+            "--record",
+            help="Use together with capture to record to rotating pcapng files in this directory instead of a fifo",
+        )
+        parser.add_argument(
+            "--record-file-size",
+            help="Start a new file once the current one reaches this many megabytes",
+            type=float,
+        )
+        parser.add_argument(
+            "--record-file-duration",
+            help="Start a new file once the current one is this many seconds old",
+            type=float,
+        )
+        parser.add_argument(
+            "--record-files",
+            help="Keep only this many most recent files",
+            type=int,
+        )
+
+        parser.add_argument(
+            "--archive",
+            help="Use together with capture to append to a compressed, indexed capture archive instead of a fifo",
+        )
+
+        parser.add_argument(
+            "--trigger-dir",
+            help="Use together with capture to write only the frames around triggers to pcap files in this "
+            "directory instead of a fifo",
+        )
+        parser.add_argument(
+            "--trigger",
+            help="Capture filter expression of frames that trigger writing; repeat for several",
+            action="append",
+        )
+        parser.add_argument(
+            "--trigger-pre",
+            help="Seconds of frames before a trigger to write",
+            type=float,
+            default=10.0,
+        )
+        parser.add_argument(
+            "--trigger-pre-size",
+            help="Megabytes of memory holding the frames before a trigger",
+            type=float,
+            default=4.0,
+        )
+        parser.add_argument(
+            "--trigger-post",
+            help="Seconds of frames after the last trigger to write",
+            type=float,
+            default=10.0,
+        )
+
+        parser.add_argument(
+            "--survey-dwell",
+            help="Survey channels, staying this many seconds on each",
+            type=float,
+        )
+        parser.add_argument(
+            "--survey-channels",
+            help="Comma separated channels to survey, all by default",
+        )
+        parser.add_argument(
+            "--survey-rounds",
+            help="End the capture after this many rounds through the surveyed channels",
+            type=int,
+        )
+        parser.add_argument(
+            "--survey-file",
+            help="Write the survey summary to this file as JSON",
+        )
+
+        parser.add_argument(
+            "--zep",
+            help="Also send frames as ZEP over UDP to HOST[:PORT], port 17754 by default",
+        )
+        parser.add_argument(
+            "--tcp-listen",
+            help="Also serve length-prefixed pcap to TCP clients on [HOST:]PORT",
+        )
+        parser.add_argument(
+            "--net-buffer",
+            help="Kilobytes buffered per TCP client",
+            type=int,
+            default=1024,
+        )
+        parser.add_argument(
+            "--net-lag-policy",
+            help="What to do with TCP clients whose buffer is full",
+            choices=["drop", "disconnect"],
+            default="drop",
+        )
+
+        parser.add_argument(
+            "--daemon-socket",
+            help="Use together with capture to attach to the capture daemon listening on this socket",
+        )
+
         parser.add_argument("--channel", help="IEEE 802.15.4 capture channel [11-26]")
+        parser.add_argument(
+            "--channels",
+            help="Comma separated capture channels, one per device, for the %s interface"
+            % Nrf802154Sniffer.MULTI_INTERFACE,
+        )
         parser.add_argument(
             "--metadata", help="Meta-Data type to use for captured packets"
         )
+        parser.add_argument(
+            "--fcs-policy",
+            help="What to do with frames whose FCS does not match: pass them unchecked, drop them, "
+            "or flag them in the output, which needs TAP or FCS metadata",
+            choices=fcs.POLICIES,
+            default=fcs.PASS,
+        )
 
         result, unknown = parser.parse_known_args()
 
         if result.capture and not result.extcap_interface:
             parser.error("--extcap-interface is required if --capture is present")
 
+        if sum(1 for option in (result.record, result.archive, result.trigger_dir) if option) > 1:
+            parser.error("--record, --archive and --trigger-dir cannot be used together")
+
+        if result.trigger_dir and not result.trigger:
+            parser.error("--trigger-dir needs at least one --trigger")
+        for trigger in result.trigger or []:
+            try:
+                import_sibling("capture_filter").compile_filter(trigger)
+            except ValueError as e:
+                parser.error("Invalid trigger '%s': %s" % (trigger, e))
+
+        if result.extcap_interface == Nrf802154Sniffer.MULTI_INTERFACE and (
+            result.survey_dwell or result.transport != Nrf802154Sniffer.TRANSPORT_QUEUE
+        ):
+            parser.error("Channel surveys and the shared memory transport capture from a single device")
+
+        if result.engine == Nrf802154Sniffer.ENGINE_ASYNCIO and (
+            result.extcap_interface == Nrf802154Sniffer.MULTI_INTERFACE
+            or result.daemon_socket
+            or result.metrics_interval
+            or result.metrics_file
+            or result.transport != Nrf802154Sniffer.TRANSPORT_QUEUE
+        ):
+            parser.error("The asyncio engine captures from a single device, without metrics or shared memory")
+
         return result
 
     def __str__(self):
@@ -512,6 +2300,99 @@ class Nrf802154Sniffer:
         return self.__str__()
 
 
+@dataclass
+class SnifferConfig:
+    """
+    Options of a capture. Nrf802154Sniffer takes one of these, or the same
+    options as keyword arguments.
+    """
+
+    # Serial reader and transport to the writer.
+    connection_open_timeout: float | None = None
+    chunked_reader: bool = True
+    batch_size: int = Nrf802154Sniffer.BATCH_MAX_PACKETS
+    batch_delay: float = Nrf802154Sniffer.BATCH_MAX_DELAY
+    transport: str = Nrf802154Sniffer.TRANSPORT_QUEUE
+    ring_slots: int = Nrf802154Sniffer.RING_SLOTS
+    # Unbounded unless a limit is given; frames are only dropped if the
+    # overload policy says so.
+    max_in_flight_frames: int | None = None
+    max_in_flight_bytes: int | None = None
+    overload_policy: str = FlowControl.BLOCK
+    capture_filter: str | None = None
+    fcs_policy: str = fcs.PASS
+
+    # Outputs.
+    flush_delay: float = Nrf802154Sniffer.FLUSH_MAX_DELAY
+    flush_size: int = Nrf802154Sniffer.FLUSH_MAX_BYTES
+    record_dir: str | None = None
+    record_file_bytes: int | None = None
+    record_file_seconds: float | None = None
+    record_files: int | None = None
+    archive: str | None = None
+    trigger_dir: str | None = None
+    triggers: list[str] | None = None
+    trigger_pre_seconds: float = 10.0
+    trigger_pre_bytes: int = 4 * 1024 * 1024
+    trigger_post_seconds: float = 10.0
+    zep: str | None = None
+    tcp_listen: str | None = None
+    net_buffer: int = 1024 * 1024
+    net_lag_policy: str = "drop"
+
+    # Capture hooks.
+    metrics: bool = False
+    metrics_interval: float | None = None
+    metrics_file: str | None = None
+    talkers: bool = False
+    talkers_interval: float | None = None
+    talkers_file: str | None = None
+    talkers_capacity: int = 1024
+    survey_dwell: float | None = None
+    survey_channels: list[int] | None = None
+    survey_rounds: int | None = None
+    survey_file: str | None = None
+
+    def __post_init__(self):
+        if self.transport not in (Nrf802154Sniffer.TRANSPORT_QUEUE, Nrf802154Sniffer.TRANSPORT_SHM):
+            raise ValueError("Unknown transport: %s" % self.transport)
+        if self.overload_policy not in FlowControl.POLICIES:
+            raise ValueError("Unknown overload policy: %s" % self.overload_policy)
+        if self.fcs_policy not in fcs.POLICIES:
+            raise ValueError("Unknown FCS policy: %s" % self.fcs_policy)
+        if self.survey_dwell and not self.chunked_reader:
+            raise ValueError("Channel surveys need the chunked reader to retune the device")
+        self.capture_filter = self.capture_filter or None
+        self.triggers = list(self.triggers or [])
+        # Fail early on invalid filters; the readers compile their own copy.
+        compile_filter = import_sibling("capture_filter").compile_filter
+        for expression in filter(None, [self.capture_filter, *self.triggers]):
+            compile_filter(expression)
+
+    @property
+    def metrics_enabled(self) -> bool:
+        return bool(self.metrics or self.metrics_interval or self.metrics_file)
+
+    @property
+    def talkers_enabled(self) -> bool:
+        return bool(self.talkers or self.talkers_interval or self.talkers_file)
+
+    def multi_device_errors(self) -> list[str]:
+        """
+        Returns the options that a capture from several devices does not
+        support: surveys hop the channel of a single device, and the
+        devices share the queue transport of the chunked reader.
+        """
+        errors = []
+        if self.survey_dwell:
+            errors.append("channel surveys")
+        if self.transport != Nrf802154Sniffer.TRANSPORT_QUEUE:
+            errors.append("the %s transport" % self.transport)
+        if not self.chunked_reader:
+            errors.append("the line by line reader")
+        return errors
+
+
 if is_standalone:
     freeze_support()
     args = Nrf802154Sniffer.parse_args()
@@ -520,7 +2401,53 @@ if is_standalone:
         format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO
     )
 
-    sniffer_comm = Nrf802154Sniffer()
+    if args.extcap_capture_filter and not args.capture:
+        # Wireshark validates capture filters by running the extcap without
+        # --capture; any output marks the filter as invalid.
+        try:
+            import_sibling("capture_filter").compile_filter(args.extcap_capture_filter)
+        except ValueError as e:
+            print(e)
+        sys.exit(0)
+
+    engine = Nrf802154Sniffer
+    if args.engine == Nrf802154Sniffer.ENGINE_ASYNCIO:
+        # The engine subclasses the classes of this script, not of a second
+        # copy of it imported under its module name.
+        sys.modules.setdefault("nrf802154_sniffer", sys.modules[__name__])
+        engine = import_sibling("aio").AsyncNrf802154Sniffer
+
+    sniffer_comm = engine(SnifferConfig(
+        transport=args.transport,
+        max_in_flight_frames=args.max_in_flight_frames,
+        max_in_flight_bytes=args.max_in_flight_bytes,
+        overload_policy=args.overload_policy,
+        capture_filter=args.extcap_capture_filter,
+        metrics_interval=args.metrics_interval,
+        metrics_file=args.metrics_file,
+        record_dir=args.record,
+        record_file_bytes=int(args.record_file_size * 1024 * 1024) if args.record_file_size else None,
+        record_file_seconds=args.record_file_duration,
+        record_files=args.record_files,
+        archive=args.archive,
+        survey_dwell=args.survey_dwell,
+        survey_channels=[int(c) for c in args.survey_channels.split(",")] if args.survey_channels else None,
+        survey_rounds=args.survey_rounds,
+        survey_file=args.survey_file,
+        zep=args.zep,
+        tcp_listen=args.tcp_listen,
+        net_buffer=args.net_buffer * 1024,
+        net_lag_policy=args.net_lag_policy,
+        fcs_policy=args.fcs_policy,
+        talkers_interval=args.talkers_interval,
+        talkers_file=args.talkers_file,
+        talkers_capacity=args.talkers_capacity,
+        trigger_dir=args.trigger_dir,
+        triggers=args.trigger,
+        trigger_pre_seconds=args.trigger_pre,
+        trigger_pre_bytes=int(args.trigger_pre_size * 1024 * 1024),
+        trigger_post_seconds=args.trigger_post,
+    ))
 
     if args.extcap_interfaces:
         print(sniffer_comm.extcap_interfaces())
@@ -533,9 +2460,44 @@ if is_standalone:
             option = args.extcap_reload_option
         else:
             option = ""
-        print(sniffer_comm.extcap_config(option))
+        print(sniffer_comm.extcap_config(option, args.extcap_interface))
+
+    capture = args.capture and (
+        args.fifo or args.record or args.archive or args.trigger_dir or args.zep or args.tcp_listen
+    )
+
+    if capture and args.daemon_socket:
+        signal.signal(signal.SIGINT, sniffer_comm._stop_and_exit)
+        signal.signal(signal.SIGTERM, sniffer_comm._stop_and_exit)
+        sniffer_comm._attach(args.fifo, args.daemon_socket, args.extcap_interface, args.metadata)
+    elif capture and args.extcap_interface == Nrf802154Sniffer.MULTI_INTERFACE:
+        signal.signal(signal.SIGINT, sniffer_comm._stop_and_exit)
+        signal.signal(signal.SIGTERM, sniffer_comm._stop_and_exit)
+        sniffer_comm._start_multi(
+            args.fifo,
+            Nrf802154Sniffer.multi_devices(args.channels or "11"),
+            args.metadata,
+            args.extcap_control_in,
+            args.extcap_control_out,
+        )
+    elif capture and args.engine == Nrf802154Sniffer.ENGINE_ASYNCIO:
+        import asyncio
+
+        async def capture_until_signal():
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, sniffer_comm.stop)
+            await sniffer_comm.capture(
+                args.fifo,
+                args.extcap_interface,
+                int(args.channel) if args.channel else 11,
+                args.metadata,
+                args.extcap_control_in,
+                args.extcap_control_out,
+            )
 
-    if args.capture and args.fifo:
+        asyncio.run(capture_until_signal())
+    elif capture:
         channel = int(args.channel) if args.channel else 11
         signal.signal(signal.SIGINT, sniffer_comm._stop_and_exit)
         signal.signal(signal.SIGTERM, sniffer_comm._stop_and_exit)
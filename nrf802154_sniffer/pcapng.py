@@ -0,0 +1,347 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+pcapng output: a buffered writer with one interface description block per
+capture channel, and a recorder that rotates files by size or age and only
+keeps the most recent ones.
+"""
+
+import glob
+import os
+import struct
+import time
+from collections import deque
+
+try:
+    from .tap import TapHeader
+except ImportError:
+    from tap import TapHeader
+
+BLOCK_SECTION_HEADER = 0x0A0D0D0A
+BLOCK_INTERFACE_DESCRIPTION = 0x00000001
+BLOCK_ENHANCED_PACKET = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+OPT_END = 0
+OPT_COMMENT = 1
+OPT_SHB_USERAPPL = 4
+OPT_IF_NAME = 2
+OPT_IF_DESCRIPTION = 3
+OPT_IF_TSRESOL = 9
+
+DLT_IEEE802_15_4_TAP = 283
+
+
+def _option(code: int, value: bytes) -> bytes:
+    return struct.pack("<HH", code, len(value)) + value + bytes(-len(value) % 4)
+
+
+def _block(block_type: int, body: bytes) -> bytes:
+    length = 12 + len(body)
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+def section_header_block(application: str = "nRF Sniffer for 802.15.4") -> bytes:
+    options = _option(OPT_SHB_USERAPPL, application.encode()) + _option(OPT_END, b"")
+    return _block(BLOCK_SECTION_HEADER, struct.pack("<IHHq", BYTE_ORDER_MAGIC, 1, 0, -1) + options)
+
+
+def interface_description_block(dlt: int, name: str, description: str) -> bytes:
+    """
+    Interface with microsecond timestamps, as written by the sniffer.
+    """
+    options = (
+        _option(OPT_IF_NAME, name.encode())
+        + _option(OPT_IF_DESCRIPTION, description.encode())
+        + _option(OPT_IF_TSRESOL, bytes([6]))
+        + _option(OPT_END, b"")
+    )
+    return _block(BLOCK_INTERFACE_DESCRIPTION, struct.pack("<HHI", dlt, 0, 0) + options)
+
+
+class PcapngWriter:
+    """
+    Buffered writer of pcapng enhanced packet blocks, with the same
+    interface as PcapWriter. Every capture channel gets its own interface
+    description block, so the channel is known even without TAP metadata.
+    :param interfaces: (channel, description) pairs to declare up front;
+                       other channels are declared on their first frame
+    """
+
+    # Enhanced packet block header: type, length, interface, timestamp
+    # high and low words, captured length, original length.
+    EPB_HEADER = struct.Struct("<IIIIIII")
+
+    # The same header followed by the TAP TLVs, without and with the FCS
+    # type TLV.
+    TAP_EPB_HEADER = TapHeader("<IIIIIII")
+    TAP_FCS_EPB_HEADER = TapHeader("<IIIIIII", fcs=True)
+
+    TRAILER = struct.Struct("<I")
+    MAX_FRAME_LENGTH = 127
+    MAX_BLOCK_SIZE = TAP_FCS_EPB_HEADER.size + MAX_FRAME_LENGTH + 3 + TRAILER.size
+
+    def __init__(self, file, dlt, interfaces=(), max_delay=1.0, max_bytes=1024 * 1024, fcs=False):
+        self.file = file
+        self.dlt = dlt
+        self.tap = dlt == DLT_IEEE802_15_4_TAP
+        # Whether frames end with their FCS, which TAP records declare.
+        self.fcs = fcs
+        self.tap_header = self.TAP_FCS_EPB_HEADER if fcs else self.TAP_EPB_HEADER
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.buffer = bytearray(max_bytes + self.MAX_BLOCK_SIZE)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.deadline = None
+        self.flush_count = 0
+        self.declared = list(interfaces)
+        self.interfaces = {}
+        if file is not None:
+            self.write_headers()
+
+    def write_headers(self) -> None:
+        """
+        Starts a new section and declares the known interfaces in it.
+        """
+        self.interfaces = {}
+        self.append(section_header_block())
+        for channel, description in self.declared:
+            self.add_interface(channel, description)
+
+    def add_interface(self, channel: int, description: str = "") -> int:
+        if channel in self.interfaces:
+            return self.interfaces[channel]
+        self.interfaces[channel] = len(self.interfaces)
+        if (channel, description) not in self.declared:
+            self.declared.append((channel, description))
+        self.append(
+            interface_description_block(
+                self.dlt, "nrf802154-ch%d" % channel, description or "IEEE 802.15.4 channel %d" % channel
+            )
+        )
+        return self.interfaces[channel]
+
+    def append(self, block: bytes) -> None:
+        if self.length + len(block) > len(self.buffer):
+            self.flush()
+        self.buffer[self.length:self.length + len(block)] = block
+        self.length += len(block)
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        """
+        Appends an enhanced packet block to the buffer, flushing it if a
+        limit is reached.
+        """
+        interface = self.interfaces.get(channel)
+        if interface is None:
+            interface = self.add_interface(channel)
+
+        length = len(frame)
+        if length > self.MAX_FRAME_LENGTH:
+            frame = frame[:self.MAX_FRAME_LENGTH]
+            length = self.MAX_FRAME_LENGTH
+
+        offset = self.length
+        if self.tap:
+            caplength = length + self.tap_header.length
+        else:
+            caplength = length
+        padding = -caplength % 4
+        block_length = self.EPB_HEADER.size + caplength + padding + self.TRAILER.size
+        high, low = timestamp >> 32, timestamp & 0xFFFFFFFF
+        if self.tap:
+            header = self.tap_header
+            header.pack_into(
+                self.buffer, offset,
+                (BLOCK_ENHANCED_PACKET, block_length, interface, high, low, caplength, caplength),
+                channel, rssi, lqi,
+            )
+            offset += header.size
+        else:
+            self.EPB_HEADER.pack_into(
+                self.buffer, offset,
+                BLOCK_ENHANCED_PACKET, block_length, interface, high, low, caplength, caplength,
+            )
+            offset += self.EPB_HEADER.size
+        end = offset + length
+        self.buffer[offset:end] = frame
+        end += padding
+        self.buffer[end - padding:end] = bytes(padding)
+        self.TRAILER.pack_into(self.buffer, end, block_length)
+        self.length = end + self.TRAILER.size
+
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.max_delay
+        if self.length >= self.max_bytes:
+            self.flush()
+
+    def timeout(self) -> float | None:
+        """
+        Returns how long the caller may wait before poll() has to be called,
+        or None if nothing is buffered.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def poll(self) -> None:
+        """
+        Flushes the buffer if the oldest record has reached max_delay.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self) -> None:
+        view = self.view[:self.length]
+        while view:
+            written = self.file.write(view)
+            view = view[written:]
+        self.length = 0
+        self.deadline = None
+        self.flush_count += 1
+
+    def close(self) -> None:
+        self.flush()
+
+
+class RotatingRecorder(PcapngWriter):
+    """
+    Records to a ring of pcapng files in a directory. A new file is started
+    once the current one reaches max_file_bytes or max_file_seconds, and
+    only the newest max_files files are kept, including files left by
+    previous runs with the same prefix. Every file starts with its own
+    section and interface description blocks, so each one can be opened
+    on its own. Files are synced to disk when they are closed.
+    """
+
+    SUFFIX = ".pcapng"
+
+    def __init__(
+        self,
+        directory,
+        dlt,
+        interfaces=(),
+        max_file_bytes=None,
+        max_file_seconds=None,
+        max_files=None,
+        prefix="nrf802154",
+        max_delay=1.0,
+        max_bytes=1024 * 1024,
+        fcs=False,
+    ):
+        super().__init__(None, dlt, interfaces, max_delay, max_bytes, fcs)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.max_files = max_files
+        self.file_bytes = 0
+        self.file_deadline = None
+        self.path = None
+
+        os.makedirs(directory, exist_ok=True)
+        # Indexes outgrow their zero padding, so files are ordered by the
+        # number rather than the name.
+        previous = []
+        for path in glob.glob(os.path.join(glob.escape(directory), prefix + "_*" + self.SUFFIX)):
+            index = self.file_index(path)
+            if index is not None:
+                previous.append((index, path))
+        previous.sort()
+        self.files = deque(path for _, path in previous)
+        self.index = previous[-1][0] + 1 if previous else 0
+        self.open_next()
+
+    def file_index(self, path: str) -> int | None:
+        """
+        Returns the index in the name of a file of this recorder, or None
+        for other files matching the prefix.
+        """
+        name = os.path.basename(path)[len(self.prefix) + 1:]
+        index = name.split("_")[0]
+        return int(index) if index.isascii() and index.isdigit() else None
+
+    def open_next(self) -> None:
+        name = "%s_%05d_%s%s" % (self.prefix, self.index, time.strftime("%Y%m%d%H%M%S"), self.SUFFIX)
+        self.index += 1
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path, "wb", 0)
+        self.files.append(self.path)
+        while self.max_files and len(self.files) > self.max_files:
+            try:
+                os.remove(self.files.popleft())
+            except FileNotFoundError:
+                pass
+        self.file_bytes = 0
+        if self.max_file_seconds:
+            self.file_deadline = time.monotonic() + self.max_file_seconds
+        self.write_headers()
+
+    def close_file(self) -> None:
+        self.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def rotate(self) -> None:
+        self.close_file()
+        self.open_next()
+
+    def rotation_due(self) -> bool:
+        if self.max_file_bytes and self.file_bytes + self.length >= self.max_file_bytes:
+            return True
+        return self.file_deadline is not None and time.monotonic() >= self.file_deadline
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        if self.rotation_due():
+            self.rotate()
+        super().write_packet(frame, channel, rssi, lqi, timestamp)
+
+    def poll(self) -> None:
+        super().poll()
+        if self.file_deadline is not None and time.monotonic() >= self.file_deadline:
+            self.rotate()
+
+    def flush(self) -> None:
+        self.file_bytes += self.length
+        super().flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.close_file()
@@ -0,0 +1,217 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Single-producer single-consumer ring buffer in shared memory, used to pass
+sniffed frames from the serial reader process to the capture writer without
+pickling them.
+"""
+
+import struct
+from multiprocessing import Event, shared_memory
+
+
+class SharedMemoryRing:
+    """
+    Ring of fixed-size slots, each holding one frame with its timestamp,
+    RSSI, LQI, channel and the host time at which the reader received it.
+
+    The producer and the consumer each own one monotonically increasing
+    64-bit index; the slot used is the index modulo the slot count, so
+    wrap-around never needs special casing. When the ring is full, put()
+    drops the new frame and increments the overrun counter instead of
+    overwriting frames the consumer has not read yet.
+    """
+
+    # Write index, overrun counter and consumer-waiting flag share the first
+    # cache line; the read index lives on its own line.
+    INDEX = struct.Struct("<Q")
+    WRITE_OFFSET = 0
+    OVERRUN_OFFSET = 8
+    WAITING_OFFSET = 16
+    READ_OFFSET = 64
+    HEADER_SIZE = 128
+
+    # Slot layout: timestamp, host receive time in microseconds, RSSI, LQI,
+    # channel, frame length, frame.
+    SLOT_HEADER = struct.Struct("<qqhBBB")
+    MAX_FRAME_LENGTH = 127
+    SLOT_SIZE = 152
+
+    def __init__(self, shm, slots: int, event, owner: bool):
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots = slots
+        self.event = event
+        self.owner = owner
+
+    @classmethod
+    def create(cls, slots: int = 4096) -> "SharedMemoryRing":
+        shm = shared_memory.SharedMemory(create=True, size=cls.HEADER_SIZE + slots * cls.SLOT_SIZE)
+        shm.buf[:cls.HEADER_SIZE] = bytes(cls.HEADER_SIZE)
+        return cls(shm, slots, Event(), True)
+
+    @classmethod
+    def attach(cls, name: str, slots: int, event) -> "SharedMemoryRing":
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the segment with the
+            # resource tracker, which would unlink it when this process exits.
+            from multiprocessing import resource_tracker
+
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, slots, event, False)
+
+    def __reduce__(self):
+        return type(self).attach, (self.shm.name, self.slots, self.event)
+
+    def _load(self, offset: int) -> int:
+        return self.INDEX.unpack_from(self.buf, offset)[0]
+
+    def _store(self, offset: int, value: int) -> None:
+        self.INDEX.pack_into(self.buf, offset, value)
+
+    @property
+    def overruns(self) -> int:
+        return self._load(self.OVERRUN_OFFSET)
+
+    def __len__(self) -> int:
+        return self._load(self.WRITE_OFFSET) - self._load(self.READ_OFFSET)
+
+    def put(self, content: bytes, timestamp: int, rssi: int, lqi: int, channel: int = 0, host_time: int = 0) -> bool:
+        """
+        Producer side. Stores one frame; returns False if the ring was full
+        and the frame was dropped. Call notify() once a batch is stored.
+        """
+        write = self._load(self.WRITE_OFFSET)
+        if write - self._load(self.READ_OFFSET) >= self.slots:
+            self._store(self.OVERRUN_OFFSET, self._load(self.OVERRUN_OFFSET) + 1)
+            return False
+
+        length = min(len(content), self.MAX_FRAME_LENGTH)
+        offset = self.HEADER_SIZE + (write % self.slots) * self.SLOT_SIZE
+        self.SLOT_HEADER.pack_into(self.buf, offset, timestamp, host_time, rssi, lqi, channel, length)
+        offset += self.SLOT_HEADER.size
+        self.buf[offset:offset + length] = content[:length]
+        # Publish the slot only once it is completely written.
+        self._store(self.WRITE_OFFSET, write + 1)
+        return True
+
+    def put_packets(self, packets, channel: int = 0, host_time: int = 0) -> int:
+        """
+        Producer side. Stores objects with content, timestamp, rssi and lqi
+        attributes, received on channel at host_time (UNIX time in
+        microseconds), publishing them all at once.
+        Returns the number of packets dropped because the ring was full.
+        Call notify() afterwards.
+        """
+        write = self._load(self.WRITE_OFFSET)
+        free = self.slots - (write - self._load(self.READ_OFFSET))
+        dropped = max(0, len(packets) - free)
+        if dropped:
+            self._store(self.OVERRUN_OFFSET, self._load(self.OVERRUN_OFFSET) + dropped)
+            packets = packets[:free]
+
+        buf = self.buf
+        pack_into = self.SLOT_HEADER.pack_into
+        header_size = self.SLOT_HEADER.size
+        max_length = self.MAX_FRAME_LENGTH
+        for index, p in enumerate(packets, write):
+            content = p.content
+            length = len(content)
+            if length > max_length:
+                content = content[:max_length]
+                length = max_length
+            offset = self.HEADER_SIZE + (index % self.slots) * self.SLOT_SIZE
+            pack_into(buf, offset, p.timestamp, host_time, p.rssi, p.lqi, channel, length)
+            offset += header_size
+            buf[offset:offset + length] = content
+        self._store(self.WRITE_OFFSET, write + len(packets))
+        return dropped
+
+    def notify(self) -> None:
+        """
+        Producer side. Wakes the consumer if it is waiting for frames. This
+        is a plain shared memory read unless the consumer is actually asleep.
+        """
+        if self.buf[self.WAITING_OFFSET]:
+            self.buf[self.WAITING_OFFSET] = 0
+            self.event.set()
+
+    def _read(self, max_count: int) -> list:
+        read = self._load(self.READ_OFFSET)
+        end = min(self._load(self.WRITE_OFFSET), read + max_count)
+        items = []
+        unpack_from = self.SLOT_HEADER.unpack_from
+        header_size = self.SLOT_HEADER.size
+        buf = self.buf
+        for index in range(read, end):
+            offset = self.HEADER_SIZE + (index % self.slots) * self.SLOT_SIZE
+            timestamp, host_time, rssi, lqi, channel, length = unpack_from(buf, offset)
+            offset += header_size
+            items.append((bytes(buf[offset:offset + length]), timestamp, lqi, rssi, channel, host_time))
+        if end != read:
+            self._store(self.READ_OFFSET, end)
+        return items
+
+    def get_batch(self, max_count: int, timeout: float | None) -> list:
+        """
+        Consumer side. Returns up to max_count (content, timestamp, lqi, rssi,
+        channel, host_time) tuples, waiting up to timeout seconds for the
+        first one. Returns an empty list on timeout.
+        """
+        items = self._read(max_count)
+        if items or timeout == 0:
+            return items
+
+        self.buf[self.WAITING_OFFSET] = 1
+        # Frames stored before the flag was raised would not be signalled.
+        items = self._read(max_count)
+        if not items:
+            self.event.wait(timeout)
+            items = self._read(max_count)
+        self.buf[self.WAITING_OFFSET] = 0
+        self.event.clear()
+        return items
+
+    def close(self) -> None:
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
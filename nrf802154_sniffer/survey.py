@@ -0,0 +1,238 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Channel survey: cycles the capture through a list of channels and keeps
+per-channel statistics of what was heard on each of them.
+"""
+
+import json
+import time
+
+try:
+    from .ieee802154 import AddressMode, decode_addressing
+except ImportError:
+    from ieee802154 import AddressMode, decode_addressing
+
+
+class ChannelStats:
+    """
+    Incremental statistics of the frames received on one channel. RSSI and
+    LQI are kept as histograms, so percentiles cost nothing per frame.
+    """
+
+    RSSI_MIN = -128
+
+    def __init__(self, channel: int):
+        self.channel = channel
+        self.frames = 0
+        self.bytes = 0
+        self.dwell = 0.0
+        self.rssi = [0] * 256
+        self.lqi = [0] * 256
+        self.pans = set()
+        self.short_addresses = set()
+        self.extended_addresses = set()
+
+    def add(self, packets) -> None:
+        rssi = self.rssi
+        lqi = self.lqi
+        for p in packets:
+            self.bytes += len(p.content)
+            rssi[min(max(p.rssi, self.RSSI_MIN), 127) - self.RSSI_MIN] += 1
+            lqi[p.lqi & 0xFF] += 1
+            fields = decode_addressing(p.content)
+            if fields is None:
+                continue
+            dst_pan, dst_mode, dst_addr, src_pan, src_mode, src_addr = fields
+            if dst_pan is not None:
+                self.pans.add(dst_pan)
+            if src_pan is not None:
+                self.pans.add(src_pan)
+            for mode, address in ((dst_mode, dst_addr), (src_mode, src_addr)):
+                if mode == AddressMode.SHORT and address != 0xFFFF:
+                    self.short_addresses.add(address)
+                elif mode == AddressMode.EXTENDED:
+                    self.extended_addresses.add(address)
+        self.frames += len(packets)
+
+    @staticmethod
+    def percentile(histogram: list[int], offset: int, fraction: float) -> int | None:
+        total = sum(histogram)
+        if not total:
+            return None
+        rank = fraction * (total - 1)
+        seen = 0
+        for index, count in enumerate(histogram):
+            seen += count
+            if seen > rank:
+                return index + offset
+        return None
+
+    def summary(self) -> dict:
+        return {
+            "channel": self.channel,
+            "dwell": round(self.dwell, 3),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "rate": round(self.frames / self.dwell, 2) if self.dwell else 0.0,
+            "rssi": {
+                "p10": self.percentile(self.rssi, self.RSSI_MIN, 0.1),
+                "p50": self.percentile(self.rssi, self.RSSI_MIN, 0.5),
+                "p90": self.percentile(self.rssi, self.RSSI_MIN, 0.9),
+            },
+            "lqi": {
+                "p10": self.percentile(self.lqi, 0, 0.1),
+                "p50": self.percentile(self.lqi, 0, 0.5),
+                "p90": self.percentile(self.lqi, 0, 0.9),
+            },
+            "pans": ["0x%04x" % pan for pan in sorted(self.pans)],
+            "short_addresses": len(self.short_addresses),
+            "extended_addresses": len(self.extended_addresses),
+        }
+
+
+class ChannelSurvey:
+    """
+    Schedule and statistics of a channel survey. The capture stays on each
+    channel for dwell seconds; after the given number of rounds through
+    all channels the survey is complete, or it cycles forever if rounds is
+    None.
+    """
+
+    def __init__(self, channels, dwell: float, rounds: int | None = None):
+        if not channels:
+            raise ValueError("No channels to survey")
+        if dwell <= 0:
+            raise ValueError("Invalid dwell time: %s" % dwell)
+        self.channels = list(channels)
+        self.dwell = dwell
+        self.rounds = rounds
+        self.stats = {channel: ChannelStats(channel) for channel in self.channels}
+        self.position = 0
+        self.round = 0
+        self.started = None
+        self.deadline = None
+
+    @property
+    def channel(self) -> int:
+        return self.channels[self.position]
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self.deadline = self.started + self.dwell
+
+    def add(self, packets, channel: int) -> None:
+        stats = self.stats.get(channel)
+        if stats is not None:
+            stats.add(packets)
+
+    def timeout(self) -> float | None:
+        """
+        Returns how long the caller may wait before poll() has to be called.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def poll(self):
+        """
+        Returns the channel to switch to once the dwell time is over, None
+        while staying on the current channel, or False when the survey is
+        complete. The statistics of the channel just left are final for
+        this round.
+        """
+        if self.deadline is None or time.monotonic() < self.deadline:
+            return None
+        now = time.monotonic()
+        self.stats[self.channel].dwell += now - self.started
+        self.position += 1
+        if self.position == len(self.channels):
+            self.position = 0
+            self.round += 1
+            if self.rounds is not None and self.round >= self.rounds:
+                self.deadline = None
+                return False
+        self.started = now
+        self.deadline = now + self.dwell
+        return self.channel
+
+    def stop(self) -> None:
+        if self.deadline is not None:
+            self.stats[self.channel].dwell += time.monotonic() - self.started
+            self.deadline = None
+
+    def summary(self) -> list[dict]:
+        return [self.stats[channel].summary() for channel in self.channels]
+
+    @staticmethod
+    def format_percentiles(values: dict) -> str:
+        return "/".join("-" if values[p] is None else str(values[p]) for p in ("p10", "p50", "p90"))
+
+    @classmethod
+    def format_channel(cls, summary: dict) -> str:
+        return "channel %d: %d frames, %.1f frames/s, RSSI %s dBm, LQI %s, PANs %s, %d+%d addresses" % (
+            summary["channel"],
+            summary["frames"],
+            summary["rate"],
+            cls.format_percentiles(summary["rssi"]),
+            cls.format_percentiles(summary["lqi"]),
+            ",".join(summary["pans"]) or "-",
+            summary["short_addresses"],
+            summary["extended_addresses"],
+        )
+
+    def format_table(self) -> str:
+        lines = ["%7s %8s %9s %14s %12s %6s %9s  %s" % (
+            "channel", "frames", "frames/s", "RSSI p10/50/90", "LQI p10/50/90", "short", "extended", "PANs"
+        )]
+        for s in self.summary():
+            lines.append("%7d %8d %9.1f %14s %12s %6d %9d  %s" % (
+                s["channel"],
+                s["frames"],
+                s["rate"],
+                self.format_percentiles(s["rssi"]),
+                self.format_percentiles(s["lqi"]),
+                s["short_addresses"],
+                s["extended_addresses"],
+                ",".join(s["pans"]) or "-",
+            ))
+        return "\n".join(lines)
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"dwell": self.dwell, "rounds": self.round, "channels": self.summary()}, f, indent=2)
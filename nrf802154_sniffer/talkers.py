@@ -0,0 +1,227 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Top talkers: per-PAN and per-address frame, byte and RSSI counts of a
+capture in bounded memory, for watching the health of a busy network
+without dissecting every frame in Wireshark.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import time
+
+try:
+    from .ieee802154 import FC_DST_ADDR_MODE_SHIFT, FC_SRC_ADDR_MODE_SHIFT, AddressMode, MacHeader
+except ImportError:
+    from ieee802154 import FC_DST_ADDR_MODE_SHIFT, FC_SRC_ADDR_MODE_SHIFT, AddressMode, MacHeader
+
+# Plain int, to keep IntEnum comparisons out of the per-frame loop.
+SHORT = int(AddressMode.SHORT)
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitter sketch (Metwally, Agrawal and El Abbadi):
+    counts at most capacity keys. A key that is not counted yet takes the
+    place of the one with the lowest count and starts from that count,
+    which becomes its error. Counts are thus overestimated by at most
+    their error, and every key seen more than total / capacity times is
+    counted.
+
+    Bytes and RSSI of a key only cover the count - error frames seen since
+    it was last taken in.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+        self.capacity = capacity
+        # Key to [count, error, bytes, RSSI sum].
+        self.counters = {}
+        # (count, serial, key) of every counted key. Counts are only
+        # updated here when the entry reaches the top, so they may lag
+        # behind, but never exceed, the count of the key.
+        self.heap = []
+        self.serials = itertools.count()
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self.counters)
+
+    def add(self, key, length: int, rssi: int) -> None:
+        self.total += 1
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += 1
+            counter[2] += length
+            counter[3] += rssi
+            return
+        if len(self.counters) < self.capacity:
+            floor = 0
+        else:
+            floor = self.evict()
+        self.counters[key] = [floor + 1, floor, length, rssi]
+        heapq.heappush(self.heap, (floor + 1, next(self.serials), key))
+
+    def evict(self) -> int:
+        """
+        Stops counting the key with the lowest count and returns its count.
+        """
+        heap = self.heap
+        counters = self.counters
+        while True:
+            count, serial, key = heap[0]
+            current = counters[key][0]
+            if current == count:
+                heapq.heappop(heap)
+                del counters[key]
+                return count
+            heapq.heapreplace(heap, (current, serial, key))
+
+    def top(self, n: int | None = None) -> list[tuple]:
+        """
+        Returns (key, count, error, bytes, mean RSSI) of the n keys with
+        the highest counts, highest first.
+        """
+        # A shallow copy is taken in one go, so other threads may call this
+        # while frames are being added.
+        counters = self.counters.copy()
+        items = heapq.nlargest(n or len(counters), counters.items(), key=lambda item: item[1][0])
+        result = []
+        for key, (count, error, length, rssi) in items:
+            seen = count - error
+            result.append((key, count, error, length, round(rssi / seen, 1) if seen else None))
+        return result
+
+
+class TopTalkers:
+    """
+    Frame counts of the busiest PANs, sources and destinations, each kept
+    in a SpaceSaving sketch of the given capacity. Short addresses are
+    counted together with their PAN ID, as they are only unique within a
+    PAN. Frames are added with add(), from the writer loop or from the
+    batches of the streaming API.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.pans = SpaceSaving(capacity)
+        self.sources = SpaceSaving(capacity)
+        self.destinations = SpaceSaving(capacity)
+        self.frames = 0
+        self.bytes = 0
+        # Frames whose addressing fields could not be decoded.
+        self.undecoded = 0
+        self.start = time.time()
+
+    def add(self, packets, channel=None) -> None:
+        """
+        Counts packets, anything with content and rssi attributes. The
+        channel is not used; it is taken to match ChannelSurvey.add.
+        """
+        pans = self.pans
+        sources = self.sources
+        destinations = self.destinations
+        undecoded = MacHeader.UNDECODED
+        frames = total = 0
+        for p in packets:
+            content = p.content
+            length = len(content)
+            rssi = p.rssi
+            frames += 1
+            total += length
+            header = MacHeader(content)
+            if header.offsets() is undecoded:
+                self.undecoded += 1
+                continue
+            dst_pan, dst_addr, src_pan, src_addr = header.addressing()
+            pan = dst_pan if src_pan is None else src_pan
+            if pan is not None:
+                pans.add(pan, length, rssi)
+            fc = header.fc
+            if src_addr is not None:
+                short = fc >> FC_SRC_ADDR_MODE_SHIFT == SHORT
+                sources.add((src_pan, src_addr) if short else src_addr, length, rssi)
+            if dst_addr is not None:
+                short = fc >> FC_DST_ADDR_MODE_SHIFT & 3 == SHORT
+                destinations.add((dst_pan, dst_addr) if short else dst_addr, length, rssi)
+        self.frames += frames
+        self.bytes += total
+
+    @staticmethod
+    def format_address(key) -> dict:
+        if isinstance(key, tuple):
+            pan, address = key
+            return {"pan": None if pan is None else "0x%04x" % pan, "address": "0x%04x" % address}
+        return {"address": ":".join("%02x" % b for b in key.to_bytes(8, "big"))}
+
+    @staticmethod
+    def format_entry(fields: dict, count: int, error: int, length: int, rssi: float | None) -> dict:
+        return {**fields, "frames": count, "error": error, "bytes": length, "rssi": rssi}
+
+    def snapshot(self, n: int = 20) -> dict:
+        """
+        Returns the totals and the n busiest PANs, sources and destinations.
+        Frame counts are upper bounds, off by at most their error.
+        """
+        return {
+            "time": round(time.time(), 3),
+            "duration": round(time.time() - self.start, 3),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "undecoded": self.undecoded,
+            "capacity": self.pans.capacity,
+            "pans": [
+                self.format_entry({"pan": "0x%04x" % pan}, *counts) for pan, *counts in self.pans.top(n)
+            ],
+            "sources": [
+                self.format_entry(self.format_address(key), *counts) for key, *counts in self.sources.top(n)
+            ],
+            "destinations": [
+                self.format_entry(self.format_address(key), *counts) for key, *counts in self.destinations.top(n)
+            ],
+        }
+
+    def dump(self, path: str, n: int = 20) -> None:
+        """
+        Writes a snapshot to a JSON file. The file is replaced atomically.
+        """
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(n), f, indent=2)
+        os.replace(temporary, path)
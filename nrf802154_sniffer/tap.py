@@ -0,0 +1,105 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+TLVs of the 802.15.4 TAP link type (https://github.com/jkcko/ieee802.15.4-tap),
+shared by the pcap and pcapng writers.
+"""
+
+import struct
+
+# TAP header, RSSI, channel assignment and LQI.
+TLV_FORMAT = "HH" "HHf" "HHHH" "HHI"
+# The same with an FCS type TLV in front, for frames that keep their FCS.
+# Wireshark checks it and marks frames where it does not match.
+FCS_TLV_FORMAT = "HH" "HHI" "HHf" "HHHH" "HHI"
+
+TLV_LENGTH = struct.calcsize("<" + TLV_FORMAT)
+FCS_TLV_LENGTH = struct.calcsize("<" + FCS_TLV_FORMAT)
+
+TLV_FCS_TYPE = 0
+TLV_RSSI = 1
+TLV_CHANNEL_ASSIGNMENT = 3
+TLV_LQI = 10
+FCS_16BIT = 1
+
+
+class TapHeader:
+    """
+    Record header of a capture format followed by the TAP TLVs, packed
+    with one struct call.
+    :param record_format: struct format of the record header, with its
+                          byte order
+    :param fcs: whether frames end with their FCS, which the TLVs declare
+    """
+
+    __slots__ = ("struct", "size", "length", "fcs")
+
+    def __init__(self, record_format: str, fcs=False):
+        self.struct = struct.Struct(record_format + (FCS_TLV_FORMAT if fcs else TLV_FORMAT))
+        self.size = self.struct.size
+        # Length of the TLVs, which precede the frame in the record data.
+        self.length = FCS_TLV_LENGTH if fcs else TLV_LENGTH
+        self.fcs = fcs
+
+    def pack_into(self, buffer, offset: int, record: tuple, channel: int, rssi: int, lqi: int) -> None:
+        """
+        Packs the record header fields followed by the TLVs for a frame
+        received on channel with the given RSSI and LQI.
+        """
+        if self.fcs:
+            self.struct.pack_into(
+                buffer, offset, *record,
+                0, self.length,
+                TLV_FCS_TYPE, 1, FCS_16BIT,
+                TLV_RSSI, 4, rssi,
+                TLV_CHANNEL_ASSIGNMENT, 3, channel, 0,
+                TLV_LQI, 1, lqi,
+            )
+        else:
+            self.struct.pack_into(
+                buffer, offset, *record,
+                0, self.length,
+                TLV_RSSI, 4, rssi,
+                TLV_CHANNEL_ASSIGNMENT, 3, channel, 0,
+                TLV_LQI, 1, lqi,
+            )
+
+    def pack(self, record: tuple, channel: int, rssi: int, lqi: int) -> bytes:
+        buffer = bytearray(self.size)
+        self.pack_into(buffer, 0, record, channel, rssi, lqi)
+        return bytes(buffer)
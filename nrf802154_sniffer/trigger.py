@@ -0,0 +1,285 @@
+# Copyright (c) 2019, Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form, except as embedded into a Nordic
+#    Semiconductor ASA integrated circuit in a product or a software update for
+#    such product, must reproduce the above copyright notice, this list of
+#    conditions and the following disclaimer in the documentation and/or other
+#    materials provided with the distribution.
+#
+# 3. Neither the name of Nordic Semiconductor ASA nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# 4. This software, with or without modification, must only be used with a
+#    Nordic Semiconductor ASA integrated circuit.
+#
+# 5. Any software provided in binary form under this license must not be reverse
+#    engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY NORDIC SEMICONDUCTOR ASA "AS IS" AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY, NONINFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL NORDIC SEMICONDUCTOR ASA OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Trigger-based capture: the most recent frames are kept in a bounded
+in-memory ring, and only the frames around frames matching a trigger are
+written out, to a pcap file per incident.
+"""
+
+import glob
+import os
+import struct
+import time
+
+
+class FrameRing:
+    """
+    Ring of the most recent frames, packed into a buffer of capacity bytes
+    allocated up front. Every record is a header with the timestamp,
+    channel, RSSI, LQI and length of the frame, followed by the frame.
+    Records are evicted oldest first once the buffer is full or they are
+    more than max_age microseconds older than the newest one.
+    """
+
+    HEADER = struct.Struct("<qBhBB")
+    TIMESTAMP = struct.Struct("<q")
+    LENGTH_OFFSET = HEADER.size - 1
+    MAX_FRAME_LENGTH = 127
+
+    def __init__(self, capacity: int, max_age: int | None = None):
+        if capacity < self.HEADER.size + self.MAX_FRAME_LENGTH:
+            raise ValueError("Frame ring of %d bytes cannot hold a frame" % capacity)
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.max_age = max_age
+        self.evicted = 0
+        self.clear()
+
+    def clear(self) -> None:
+        # Records are in [head, tail), or in [head, wrap) and [0, tail)
+        # once writing has wrapped to the start of the buffer.
+        self.head = self.tail = 0
+        self.wrap = None
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def pop(self) -> None:
+        """
+        Drops the oldest record.
+        """
+        self.head += self.HEADER.size + self.buffer[self.head + self.LENGTH_OFFSET]
+        self.count -= 1
+        if not self.count:
+            self.clear()
+        elif self.head == self.wrap:
+            self.head = 0
+            self.wrap = None
+
+    def append(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        if len(frame) > self.MAX_FRAME_LENGTH:
+            frame = frame[:self.MAX_FRAME_LENGTH]
+        size = self.HEADER.size + len(frame)
+        while True:
+            if self.wrap is None:
+                if self.tail + size <= self.capacity:
+                    break
+                self.wrap = self.tail
+                self.tail = 0
+                continue
+            if self.tail + size <= self.head:
+                break
+            self.pop()
+            self.evicted += 1
+
+        self.HEADER.pack_into(self.buffer, self.tail, timestamp, channel, rssi, lqi, len(frame))
+        start = self.tail + self.HEADER.size
+        self.tail = start + len(frame)
+        self.buffer[start:self.tail] = frame
+        self.count += 1
+
+        if self.max_age is not None:
+            while self.count > 1 and timestamp - self.TIMESTAMP.unpack_from(self.buffer, self.head)[0] > self.max_age:
+                self.pop()
+                self.evicted += 1
+
+    def records(self):
+        """
+        Yields (frame, channel, rssi, lqi, timestamp) for every record,
+        oldest first.
+        """
+        offset = self.head
+        end = self.tail if self.wrap is None else self.wrap
+        for _ in range(self.count):
+            if offset == end:
+                offset, end = 0, self.tail
+            timestamp, channel, rssi, lqi, length = self.HEADER.unpack_from(self.buffer, offset)
+            offset += self.HEADER.size
+            yield bytes(self.buffer[offset:offset + length]), channel, rssi, lqi, timestamp
+            offset += length
+
+
+class TriggerRecorder:
+    """
+    Writes only the frames around trigger frames, with the same interface
+    as PcapWriter. Frames are kept in a FrameRing holding the last
+    pre_seconds or pre_bytes of the capture. A frame matching one of the
+    triggers starts an incident: a pcap file in directory with the frames
+    of the ring, followed by every frame up to post_seconds after the last
+    matching frame, so that triggers with overlapping windows share a file.
+    Incidents are passed to on_incident, if given, once their file is
+    closed.
+    :param triggers: (name, predicate) pairs, the predicates being called
+                     as predicate(content, rssi, lqi) for every frame
+    """
+
+    SUFFIX = ".pcap"
+
+    def __init__(
+        self,
+        directory,
+        header: bytes,
+        writer_class,
+        dlt,
+        triggers,
+        pre_seconds=10.0,
+        pre_bytes=4 * 1024 * 1024,
+        post_seconds=10.0,
+        on_incident=None,
+        prefix="trigger",
+        max_delay=1.0,
+        max_bytes=1024 * 1024,
+        fcs=False,
+    ):
+        self.directory = directory
+        self.header = header
+        self.writer_class = writer_class
+        self.dlt = dlt
+        self.triggers = list(triggers)
+        self.post = int(post_seconds * 1e6)
+        self.on_incident = on_incident
+        self.prefix = prefix
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.fcs = fcs
+        self.ring = FrameRing(pre_bytes, int(pre_seconds * 1e6))
+        self.flush_count = 0
+        self.file = None
+        self.writer = None
+        self.incident = None
+        # Timestamp after which the open incident ends.
+        self.until = None
+        self.incidents = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Incidents are numbered on from the highest index found; the
+        # number may outgrow its zero padding, so names are not compared.
+        self.index = 0
+        for path in glob.glob(os.path.join(glob.escape(directory), prefix + "_*" + self.SUFFIX)):
+            index = os.path.basename(path)[len(prefix) + 1:].split("_")[0]
+            if index.isascii() and index.isdigit():
+                self.index = max(self.index, int(index) + 1)
+
+    def match(self, frame: bytes, rssi: int, lqi: int) -> str | None:
+        for name, predicate in self.triggers:
+            if predicate(frame, rssi, lqi):
+                return name
+        return None
+
+    def write_packet(self, frame: bytes, channel: int, rssi: int, lqi: int, timestamp: int) -> None:
+        if self.writer is not None and timestamp > self.until:
+            self.close_incident()
+        trigger = self.match(frame, rssi, lqi)
+        if self.writer is not None:
+            self.writer.write_packet(frame, channel, rssi, lqi, timestamp)
+            self.incident["frames"] += 1
+            if trigger is not None:
+                self.incident["triggers"] += 1
+                self.until = timestamp + self.post
+        else:
+            self.ring.append(frame, channel, rssi, lqi, timestamp)
+            if trigger is not None:
+                self.open_incident(trigger, timestamp)
+
+    def open_incident(self, trigger: str, timestamp: int) -> None:
+        name = "%s_%05d_%s%s" % (
+            self.prefix, self.index, time.strftime("%Y%m%d%H%M%S", time.localtime(timestamp / 1e6)), self.SUFFIX
+        )
+        self.index += 1
+        path = os.path.join(self.directory, name)
+        self.file = open(path, "wb", 0)
+        self.file.write(self.header)
+        self.writer = self.writer_class(self.file, self.dlt, self.max_delay, self.max_bytes, self.fcs)
+        records = self.ring.records()
+        first = next(records)
+        self.writer.write_packet(*first)
+        for record in records:
+            self.writer.write_packet(*record)
+        self.incident = {
+            "path": path,
+            "trigger": trigger,
+            "time": timestamp,
+            "start": first[4],
+            "frames": len(self.ring),
+            "triggers": 1,
+        }
+        self.ring.clear()
+        self.until = timestamp + self.post
+        self.incidents += 1
+
+    def close_incident(self) -> None:
+        self.writer.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        incident = self.incident
+        incident["end"] = min(self.until, time.time_ns() // 1000)
+        self.file = self.writer = self.incident = self.until = None
+        if self.on_incident is not None:
+            self.on_incident(incident)
+
+    def timeout(self) -> float | None:
+        """
+        Returns how long the caller may wait before poll() has to be called,
+        or None if no incident is open.
+        """
+        if self.writer is None:
+            return None
+        remaining = max(0.0, (self.until - time.time_ns() // 1000) / 1e6)
+        timeout = self.writer.timeout()
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def poll(self) -> None:
+        """
+        Flushes the open incident, and closes it once its post-trigger
+        window has passed without frames.
+        """
+        if self.writer is None:
+            return
+        if time.time_ns() // 1000 > self.until:
+            self.close_incident()
+        else:
+            self.writer.poll()
+
+    def flush(self) -> None:
+        if self.writer is not None:
+            self.writer.flush()
+        self.flush_count += 1
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.close_incident()
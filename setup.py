@@ -48,6 +48,9 @@ setuptools.setup(
     author='Nordic Semiconductor',
     url='https://github.com/NordicPlayground/nRF-802.15.4-sniffer/',
     install_requires=REQUIREMENTS,
+    extras_require={
+        'analysis': ['numpy', 'pyarrow']
+    },
     include_package_data=True,
     packages=['nrf802154_sniffer'],
     package_data={
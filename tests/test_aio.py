@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from nrf802154_sniffer.aio import AsyncNrf802154Sniffer
+from nrf802154_sniffer.fake_device import FakeSnifferDevice
+
+
+class BlockedWriter:
+    """
+    Capture output that blocks until released, like a fifo nobody reads.
+    """
+
+    flush_count = 0
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.written = 0
+
+    def write_packet(self, frame, channel, rssi, lqi, timestamp):
+        self.released.wait()
+        self.written += 1
+
+    def timeout(self):
+        return None
+
+    def poll(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def capture(monkeypatch):
+    writer = BlockedWriter()
+    monkeypatch.setattr(AsyncNrf802154Sniffer, "open_output", contextmanager(lambda self: (yield writer)))
+    with FakeSnifferDevice(rate=5000) as device:
+        sniffer = AsyncNrf802154Sniffer()
+        sniffer.start_threaded(None, device.port, 11)
+        yield sniffer, device, writer
+        writer.released.set()
+        sniffer.stop_thread()
+
+
+def test_blocked_output_pauses_reading_but_not_the_loop(capture):
+    sniffer, _, writer = capture
+    assert wait_for(lambda: sniffer.output_batches >= sniffer.MAX_OUTPUT_BATCHES)
+    assert not sniffer.reading
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0), sniffer.loop).result(timeout=0.5)
+
+    writer.released.set()
+    assert wait_for(lambda: sniffer.reading)
+    assert wait_for(lambda: writer.written > 0)
+
+
+def test_retune_records_the_channel_when_the_command_is_sent(capture):
+    sniffer, device, writer = capture
+    writer.released.set()
+    sniffer.set_channel(15)
+    assert wait_for(lambda: device.channel.value == 15)
+    assert sniffer.channel == 15
+    assert (sniffer.confirmation.channel, sniffer.confirmation.previous) == (15, 11)
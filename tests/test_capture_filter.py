@@ -0,0 +1,84 @@
+import re
+
+import pytest
+
+from nrf802154_sniffer.capture_filter import CaptureFilterError, compile_filter
+
+# Data frame in PAN 0x1a62 from short address 0x0001 to broadcast.
+BROADCAST = bytes.fromhex("418801621affff0100") + b"payload"
+# Secured data frame from extended address 00:11:22:33:44:55:66:77 to 0x1234.
+SECURED = bytes.fromhex("49d802621a34127766554433221100") + b"payload"
+# Beacon of PAN 0x1a62 from its coordinator, 0x0000.
+BEACON = bytes.fromhex("008003621a0000") + b"beacon"
+ACK = bytes.fromhex("020056")
+FRAMES = {"broadcast": BROADCAST, "secured": SECURED, "beacon": BEACON, "ack": ACK, "empty": b"", "short": b"\x41"}
+
+
+def matching(expression, rssi=-50, lqi=200):
+    predicate = compile_filter(expression)
+    return {name for name, frame in FRAMES.items() if predicate(frame, rssi, lqi)}
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("type data", {"broadcast", "secured"}),
+        ("type beacon", {"beacon"}),
+        ("type ack", {"ack"}),
+        ("TYPE CMD", set()),
+        ("security", {"secured"}),
+        ("pan 0x1a62", {"broadcast", "secured", "beacon"}),
+        ("src pan 0x1a62", {"broadcast", "secured", "beacon"}),
+        ("dst pan 0x1a62", {"broadcast", "secured"}),
+        ("pan 6754", {"broadcast", "secured", "beacon"}),
+        ("dst 0xffff", {"broadcast"}),
+        ("src 0x0001", {"broadcast"}),
+        ("addr 0x1234", {"secured"}),
+        ("addr 0", {"beacon"}),
+        ("src 00:11:22:33:44:55:66:77", {"secured"}),
+        ("src 0x0011223344556677", {"secured"}),
+        ("dst 00:11:22:33:44:55:66:77", set()),
+        ("type data and not dst 0xffff", {"secured"}),
+        ("type beacon or type ack", {"beacon", "ack"}),
+        ("type data && !(security || src 0x0001)", set()),
+        ("not (type data)", {"beacon", "ack", "empty", "short"}),
+        ("type data or type ack and security", {"broadcast", "secured"}),
+    ],
+)
+def test_frames_matching_an_expression(expression, expected):
+    assert matching(expression) == expected
+
+
+def test_rssi_and_lqi_comparisons():
+    assert compile_filter("rssi >= -80")(ACK, -80, 0)
+    assert not compile_filter("rssi >= -80")(ACK, -81, 0)
+    assert compile_filter("lqi != 255 and rssi < 0")(ACK, -1, 254)
+    assert compile_filter("lqi == 0x10")(ACK, 0, 16)
+
+
+@pytest.mark.parametrize(
+    "expression, message",
+    [
+        ("", "Expected filter primitive"),
+        ("type", "Expected frame type"),
+        ("type frame", "Unknown frame type"),
+        ("pan 0x10000", "out of range"),
+        ("pan x", "Invalid PAN ID"),
+        ("src 00:11:22", "Invalid extended address"),
+        ("dst 0x1ffff", "out of range"),
+        ("rssi -80", "Expected comparison"),
+        ("rssi > loud", "Invalid rssi value"),
+        ("(type data", "Expected ')'"),
+        ("type data)", "Unexpected token"),
+        ("type data and", "Expected filter primitive"),
+        ("channel 11", "Unknown filter primitive"),
+        ("type data $", "Unexpected token"),
+    ],
+)
+def test_invalid_expressions(expression, message):
+    with pytest.raises(CaptureFilterError, match=re.escape(message)):
+        compile_filter(expression)
+
+
+def test_errors_are_value_errors():
+    assert issubclass(CaptureFilterError, ValueError)
@@ -0,0 +1,100 @@
+import os
+import pty
+import queue
+import threading
+import time
+import tty
+
+import pytest
+
+from nrf802154_sniffer import fcs
+from nrf802154_sniffer.nrf802154_sniffer import Nrf802154Sniffer, PacketBatch
+
+PAYLOAD = bytes.fromhex("41881a621affff0100aabb")
+FRAME = PAYLOAD + fcs.crc16(PAYLOAD).to_bytes(2, "little")
+
+
+def line(timestamp):
+    return b"received: %s power: -42 lqi: 200 time: %d\r\n" % (FRAME.hex().encode(), timestamp)
+
+
+@pytest.fixture
+def reader():
+    """
+    Runs chunked_serial_reader on a pty; the test writes the device side.
+    """
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    out = queue.Queue()
+    stop = threading.Event()
+    threads = []
+
+    def start(**kwargs):
+        thread = threading.Thread(
+            target=Nrf802154Sniffer.chunked_serial_reader,
+            args=(os.ttyname(slave), out),
+            kwargs=dict(stop=stop, **kwargs),
+        )
+        thread.start()
+        threads.append(thread)
+        # Opening the port discards what was written before.
+        time.sleep(0.2)
+        return master, out
+
+    yield start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    os.close(master)
+    os.close(slave)
+
+
+def batches(out, count, timeout=2.0):
+    packets = []
+    sizes = []
+    deadline = time.monotonic() + timeout
+    while len(packets) < count and time.monotonic() < deadline:
+        try:
+            batch = out.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        assert isinstance(batch, PacketBatch)
+        packets += batch.packets
+        sizes.append(len(batch.packets))
+    return packets, sizes
+
+
+def test_lines_split_across_reads_are_joined(reader):
+    master, out = reader(batch_delay=0.05)
+    data = b"".join(line(i) for i in range(10))
+    for start in range(0, len(data), 37):
+        os.write(master, data[start:start + 37])
+        time.sleep(0.002)
+    packets, _ = batches(out, 10)
+    assert [p.timestamp for p in packets] == list(range(10))
+    assert all(p.content == PAYLOAD for p in packets)
+
+
+def test_full_batch_is_sent_without_waiting(reader):
+    master, out = reader(batch_size=8, batch_delay=1.0)
+    os.write(master, b"".join(line(i) for i in range(20)))
+    started = time.monotonic()
+    packets, _ = batches(out, 20)
+    assert len(packets) == 20
+    assert time.monotonic() - started < 0.5
+
+
+def test_partial_batch_is_sent_after_batch_delay(reader):
+    master, out = reader(batch_size=1000, batch_delay=0.05)
+    os.write(master, line(1) + line(2))
+    started = time.monotonic()
+    packets, _ = batches(out, 2)
+    assert len(packets) == 2
+    assert time.monotonic() - started < 1
+
+
+def test_other_output_is_skipped(reader):
+    master, out = reader(batch_delay=0.05)
+    os.write(master, b"uart:~$ \r\n" + line(1) + b"received: garbage\r\n" + line(2))
+    packets, _ = batches(out, 2)
+    assert [p.timestamp for p in packets] == [1, 2]
@@ -0,0 +1,111 @@
+import random
+
+from nrf802154_sniffer.clock import DeviceClock
+
+TIMER_MAX = 2**32
+EPOCH = 1_700_000_000_000_000
+
+
+def simulate(clock, seconds, interval, skew_ppm=0.0, boot=0, seed=1, delay=2000):
+    """
+    Feeds frames received every interval seconds, read after a random
+    delay of up to delay microseconds, and returns the largest error of
+    the converted timestamps after the first minute.
+    """
+    rng = random.Random(seed)
+    worst = 0
+    device = boot
+    true_host = EPOCH
+    step = int(interval * 1e6)
+    for i in range(int(seconds / interval)):
+        device += step
+        true_host += round(step * (1 + skew_ppm * 1e-6))
+        converted = clock.convert(device % TIMER_MAX, true_host + rng.randrange(delay))
+        if i * interval > 60:
+            worst = max(worst, abs(converted - true_host))
+    return worst
+
+
+def test_extend_counts_wraps():
+    clock = DeviceClock(TIMER_MAX)
+    assert clock.extend(TIMER_MAX - 10) == TIMER_MAX - 10
+    assert clock.extend(5) == TIMER_MAX + 5
+    assert clock.extend(TIMER_MAX // 3) == TIMER_MAX + TIMER_MAX // 3
+    assert clock.wraps == 1
+
+
+def test_extend_keeps_late_frames_before_the_wrap():
+    clock = DeviceClock(TIMER_MAX)
+    clock.extend(TIMER_MAX - 100)
+    assert clock.extend(50) == TIMER_MAX + 50
+    # Stamped before the wrap, read after the frame stamped after it.
+    assert clock.extend(TIMER_MAX - 20) == TIMER_MAX - 20
+    assert clock.extend(60) == TIMER_MAX + 60
+    assert clock.wraps == 1
+
+
+def test_resume_continues_another_extension():
+    first = DeviceClock(TIMER_MAX)
+    values = [TIMER_MAX - 5, 3, TIMER_MAX // 2, TIMER_MAX - 1, 7]
+    extended = [first.extend(v) for v in values]
+    second = DeviceClock(TIMER_MAX)
+    mid = 3
+    for v in values[:mid]:
+        second.extend(v)
+    third = DeviceClock(TIMER_MAX)
+    third.resume(second.last_raw, second.base)
+    assert [third.extend(v) for v in values[mid:]] == extended[mid:]
+
+
+def test_frames_stay_in_order_across_wraps():
+    clock = DeviceClock(TIMER_MAX)
+    # Three hours from a second before a wrap: the 71 minute timer wraps
+    # three times.
+    assert simulate(clock, 3 * 3600, 0.5, boot=TIMER_MAX - 10**6) < 1000
+    assert clock.wraps == 3
+    assert clock.resyncs == 0
+
+
+def test_fit_follows_crystal_drift():
+    clock = DeviceClock(TIMER_MAX)
+    # Without a skew estimate, 40 ppm would be 430 ms off after 3 hours.
+    assert simulate(clock, 3 * 3600, 0.5, skew_ppm=40) < 1000
+    assert abs(clock.stats()["skew_ppm"] - 40) < 1
+    assert clock.stats()["residual_us"] < 1000
+
+
+def test_wraps_hidden_by_a_silence_are_recovered_from_host_time():
+    clock = DeviceClock(TIMER_MAX)
+    simulate(clock, 600, 0.5)
+    raw = clock.last_raw
+    host = clock.last_host
+    # Three hours without frames: the timer wraps twice meanwhile.
+    silence = 3 * 3600 * 10**6
+    converted = clock.convert((raw + silence) % TIMER_MAX, host + silence)
+    assert abs(converted - (host + silence)) < 5000
+    assert clock.wraps == 2
+    assert clock.resyncs == 0
+
+
+def test_device_reset_resyncs_the_model():
+    clock = DeviceClock(TIMER_MAX)
+    simulate(clock, 120, 0.5)
+    host = clock.last_host
+    converted = clock.convert(1000, host + 10**6)
+    assert clock.resyncs == 1
+    assert abs(converted - (host + 10**6)) < 1
+
+
+def test_output_never_goes_backwards():
+    clock = DeviceClock(TIMER_MAX)
+    outputs = [clock.convert(t, EPOCH + t + d) for t, d in [(0, 5000), (1000, 100), (1500, 50), (1600, 9000)]]
+    assert outputs == sorted(outputs)
+
+
+def test_stats_before_the_fit_settles():
+    clock = DeviceClock(TIMER_MAX)
+    clock.convert(100, EPOCH)
+    stats = clock.stats()
+    assert stats["frames"] == 1
+    assert stats["offset"] == EPOCH - 100
+    assert stats["residual_us"] is None
@@ -0,0 +1,86 @@
+import io
+import os
+import struct
+
+import pytest
+
+from nrf802154_sniffer.convert import convert
+from nrf802154_sniffer.nrf802154_sniffer import DLT, Nrf802154Sniffer
+
+TIMER_MAX = Nrf802154Sniffer.TIMER_MAX
+START = 1_700_000_000_000_000
+
+
+def write_log(path, count, first, step):
+    with open(path, "wb") as f:
+        for i in range(count):
+            f.write(
+                b"received: 41%02x621affff0100aabb0000 power: -42 lqi: 200 time: %d\r\n"
+                % (i % 256, (first + i * step) % TIMER_MAX)
+            )
+            if i % 7 == 0:
+                f.write(b"uart:~$ garbage\r\n")
+
+
+def read_pcap(data):
+    offset = 24
+    records = []
+    while offset < len(data):
+        seconds, microseconds, length, _ = struct.unpack_from("<LLLL", data, offset)
+        offset += 16
+        records.append((seconds * 10**6 + microseconds, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_frames_keep_their_spacing_across_timer_wraps(tmp_path, jobs):
+    log = tmp_path / "sniffer.log"
+    step = 250_000
+    write_log(log, 40000, TIMER_MAX - 3_000_000, step)
+    output = io.BytesIO()
+
+    assert convert(str(log), output, start_time=START, jobs=jobs, chunk_size=64 * 1024) == (40000, 0)
+
+    timestamps = [timestamp for timestamp, _ in read_pcap(output.getvalue())]
+    assert timestamps[0] == START
+    assert all(b - a == step for a, b in zip(timestamps, timestamps[1:]))
+
+
+def test_default_start_time_places_the_last_frame_at_mtime(tmp_path):
+    log = tmp_path / "sniffer.log"
+    step = 500_000
+    write_log(log, 20000, TIMER_MAX - 1_000_000, step)
+    os.utime(log, (START / 1e6, START / 1e6))
+    output = io.BytesIO()
+
+    convert(str(log), output, jobs=1, chunk_size=64 * 1024)
+
+    records = read_pcap(output.getvalue())
+    assert records[-1][0] == START
+    assert records[0][0] == START - 19999 * step
+
+
+def test_pcapng_output(tmp_path):
+    log = tmp_path / "sniffer.log"
+    write_log(log, 10, 1000, 1000)
+    output = io.BytesIO()
+
+    convert(str(log), output, "pcapng", DLT.DLT_IEEE802_15_4_TAP, 15, START, jobs=1)
+
+    data = output.getvalue()
+    blocks = []
+    offset = 0
+    while offset < len(data):
+        block_type, length = struct.unpack_from("<II", data, offset)
+        blocks.append(block_type)
+        offset += length
+    assert blocks == [0x0A0D0D0A, 1] + [6] * 10
+
+
+def test_empty_log(tmp_path):
+    log = tmp_path / "sniffer.log"
+    log.write_bytes(b"")
+    output = io.BytesIO()
+    assert convert(str(log), output) == (0, 0)
+    assert len(output.getvalue()) == 24
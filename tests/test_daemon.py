@@ -0,0 +1,40 @@
+import os
+import socket
+
+import pytest
+
+from nrf802154_sniffer.daemon import default_socket, remove_stale_socket
+
+
+def test_default_socket_is_private_to_the_user(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert default_socket() == os.path.join(tmp_path, "nrf802154_sniffer.sock")
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert os.path.basename(os.path.dirname(default_socket())) == "nrf802154_sniffer-%d" % os.getuid()
+
+
+def test_stale_socket_is_removed(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+    remove_stale_socket(path)
+    assert not os.path.exists(path)
+    remove_stale_socket(path)
+
+
+def test_live_daemon_is_left_alone(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+        with pytest.raises(RuntimeError, match="already listening"):
+            remove_stale_socket(path)
+    assert os.path.exists(path)
+
+
+def test_other_files_are_left_alone(tmp_path):
+    path = tmp_path / "daemon.sock"
+    path.write_text("keep")
+    with pytest.raises(RuntimeError, match="not a socket"):
+        remove_stale_socket(str(path))
+    assert path.read_text() == "keep"
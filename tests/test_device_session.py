@@ -0,0 +1,188 @@
+import os
+import time
+
+import pytest
+from serial import Serial as SerialPort
+
+from nrf802154_sniffer.aio import AsyncNrf802154Sniffer
+from nrf802154_sniffer.fake_device import FakeSnifferDevice
+from nrf802154_sniffer.nrf802154_sniffer import (
+    DeviceError,
+    DeviceReply,
+    DeviceSession,
+    Nrf802154Sniffer,
+    RetuneConfirmation,
+)
+
+RED = b"\x1b[1;31m"
+NORMAL = b"\x1b[0m"
+
+
+class Serial:
+    """
+    Serial port whose device answers every command with the next reply.
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.written = []
+        self.buffer = b""
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        self.written.append(data)
+        if self.replies:
+            self.buffer += self.replies.pop(0)
+
+    def read(self, size):
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self.buffer = b""
+
+
+class StreamingSerial(Serial):
+    """
+    Serial port whose device never stops printing frames.
+    """
+
+    in_waiting = 64
+
+    def read(self, size):
+        return b"received: 00 power: -40 lqi: 200 time: 1\r\n"
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b"invalid number of parameters: 1",
+        b"foo: command not found\r",
+        b"sleep: wrong parameter count",
+        b"echo: unknown parameter: colours",
+        b"Please specify a subcommand.",
+        b"Too many arguments in the command.",
+        RED + b"foo: command not found" + NORMAL,
+    ],
+)
+def test_errors(line):
+    assert DeviceSession.find_error([b"", line]) is not None
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b"Unknown frames are skipped",
+        b"error counters cleared",
+        b"invalid frames: 0",
+        b"Echo status: on",
+        b"\x1b[1;33mnot receiving" + NORMAL,
+        b"25",
+        b"received: 00 power: -40 lqi: 200 time: 1 foo: command not found",
+    ],
+)
+def test_other_output_is_not_an_error(line):
+    assert DeviceSession.find_error([line]) is None
+
+
+def test_error_message_is_clean():
+    assert DeviceSession.find_error([RED + b"foo: command not found" + NORMAL + b"\r"]) == "foo: command not found"
+
+
+def test_command_returns_reply():
+    serial = Serial([b"shell echo\r\nEcho status: on\r\n"])
+    assert DeviceSession(serial).command(b"shell echo") == [b"Echo status: on"]
+    assert serial.written == [b"shell echo\r\n"]
+
+
+def test_command_raises_on_error_reply():
+    serial = Serial([b"channel\r\ninvalid number of parameters: 1\r\n"])
+    with pytest.raises(DeviceError, match="rejected 'channel': invalid number of parameters: 1"):
+        DeviceSession(serial).command(b"channel")
+
+
+def test_command_is_done_once_the_device_is_quiet():
+    start = time.monotonic()
+    assert DeviceSession(Serial([])).command(b"receive") == []
+    assert time.monotonic() - start < DeviceSession.COMMAND_TIMEOUT
+
+
+def test_command_is_done_after_timeout_while_frames_arrive():
+    start = time.monotonic()
+    assert DeviceSession(StreamingSerial([]), timeout=0.2).command(b"receive") == []
+    assert 0.2 <= time.monotonic() - start < DeviceSession.COMMAND_TIMEOUT
+
+
+def test_fake_device_replies_like_the_firmware():
+    with FakeSnifferDevice() as device:
+        with SerialPort(device.port, timeout=0.1) as serial:
+            session = DeviceSession(serial)
+            session.sync()
+            assert session.command(b"shell echo") == [b"Echo status: on"]
+            session.command(b"shell echo off")
+            session.command(b"channel 15")
+            for command, error in [
+                (b"channel", "invalid number of parameters: 1"),
+                (b"sleep now", "sleep: wrong parameter count"),
+                (b"shell", "Please specify a subcommand."),
+                (b"tune 15", "tune: command not found"),
+            ]:
+                with pytest.raises(DeviceError, match=error):
+                    session.command(command)
+        assert device.channel.value == 15
+
+
+def test_retune_confirmation_reports_the_channel_kept():
+    confirmation = RetuneConfirmation(2)
+    confirmation.sent(15, 11)
+    assert confirmation.check([b"received: 00 power: -40 lqi: 200 time: 1", b""]) == []
+    assert confirmation.awaiting
+    replies = confirmation.check([b"invalid number of parameters: 1\r"])
+    assert replies == [DeviceReply("Sniffer device rejected 'channel 15': invalid number of parameters: 1", 2, 11)]
+    assert not confirmation.awaiting
+
+
+def test_retune_confirmation_window_closes_without_error(monkeypatch):
+    monkeypatch.setattr(DeviceSession, "COMMAND_TIMEOUT", 0.01)
+    confirmation = RetuneConfirmation()
+    confirmation.sent(15, 11)
+    confirmation.expire()
+    assert confirmation.awaiting
+    time.sleep(0.02)
+    confirmation.expire()
+    assert not confirmation.awaiting
+
+
+def test_line_by_line_reader_cannot_retune():
+    sniffer = Nrf802154Sniffer(chunked_reader=False)
+    sniffer.tuning = [11]
+    with pytest.raises(RuntimeError, match="line by line"):
+        sniffer.set_channel(15)
+    with pytest.raises(ValueError, match="chunked reader"):
+        Nrf802154Sniffer(chunked_reader=False, survey_dwell=1.0)
+
+
+@pytest.mark.parametrize("engine", [Nrf802154Sniffer, AsyncNrf802154Sniffer])
+def test_start_threaded_raises_device_errors(tmp_path, monkeypatch, engine):
+    fifo = os.path.join(tmp_path, "fifo")
+    os.mkfifo(fifo)
+
+    def configure_device(dev, channel):
+        raise DeviceError("Sniffer device rejected 'receive': receive: command not found")
+
+    monkeypatch.setattr(Nrf802154Sniffer, "configure_device", staticmethod(configure_device))
+    with FakeSnifferDevice() as device:
+        sniffer = engine()
+        with pytest.raises(DeviceError, match="command not found"):
+            sniffer.start_threaded(fifo, device.port, 15)
+        sniffer.stop_thread()
+
+
+def test_start_multi_threaded_raises_config_errors():
+    sniffer = Nrf802154Sniffer(survey_dwell=1.0)
+    with pytest.raises(ValueError, match="several devices"):
+        sniffer.start_multi_threaded(None, [("a", 11), ("b", 15)])
+    sniffer.stop_thread()
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from nrf802154_sniffer import discovery
+
+SCRIPT = os.path.join(os.path.dirname(discovery.__file__), "nrf802154_sniffer.py")
+
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("argv", [
+    ["--extcap-interfaces", "--extcap-version=4.2"],
+    ["--extcap-version", "4.2", "--extcap-interfaces"],
+    ["--extcap-interfaces", "--debug"],
+])
+def test_run_answers_queries_with_harmless_options(argv, cache_home, capsys):
+    assert discovery.run(argv)
+    assert capsys.readouterr().out.startswith("extcap {version=")
+
+
+@pytest.mark.parametrize("argv", [
+    [],
+    ["--extcap-version=4.2"],
+    ["--capture", "--extcap-interface", "/dev/ttyACM0"],
+    ["--extcap-interfaces", "--unknown-option"],
+    ["--extcap-interface"],
+])
+def test_run_leaves_other_command_lines_to_the_full_parser(argv, cache_home, capsys):
+    assert not discovery.run(argv)
+    assert capsys.readouterr().out == ""
+
+
+def test_run_checks_capture_filters(capsys):
+    assert discovery.run(["--extcap-capture-filter", "pan 0x1a62"])
+    assert capsys.readouterr().out == ""
+    assert discovery.run(["--extcap-capture-filter", "pan"])
+    assert capsys.readouterr().out != ""
+
+
+def test_cached_interface_query_skips_pyserial_and_multiprocessing(cache_home):
+    env = dict(os.environ, XDG_CACHE_HOME=str(cache_home))
+    command = [sys.executable, "-X", "importtime", SCRIPT, "--extcap-interfaces", "--extcap-version=4.2"]
+    subprocess.run(command, env=env, capture_output=True, check=True)
+    imports = subprocess.run(command, env=env, capture_output=True, check=True).stderr.decode()
+    assert " serial" not in imports
+    assert "multiprocessing" not in imports
+
+
+def test_port_cache_is_private(cache_home):
+    path = discovery.port_cache_path()
+    discovery._write_port_cache(path, "key", ["/dev/ttyACM0"])
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    assert discovery._read_port_cache(path, "key", 5.0) == ["/dev/ttyACM0"]
+    assert discovery._read_port_cache(path, "other", 5.0) is None
+
+
+def test_port_cache_write_does_not_follow_links(cache_home, tmp_path):
+    path = discovery.port_cache_path()
+    os.makedirs(os.path.dirname(path), mode=0o700)
+    victim = tmp_path / "victim"
+    victim.write_text("keep")
+    os.symlink(victim, "%s.%d" % (path, os.getpid()))
+    discovery._write_port_cache(path, "key", ["/dev/ttyACM0"])
+    assert victim.read_text() == "keep"
+
+
+def test_port_cache_needs_a_private_directory(cache_home):
+    path = discovery.port_cache_path()
+    os.makedirs(os.path.dirname(path))
+    os.chmod(os.path.dirname(path), 0o777)
+    discovery._write_port_cache(path, "key", ["/dev/ttyACM0"])
+    assert not os.path.exists(path)
+
+
+def test_no_cache_without_device_set_key(cache_home, monkeypatch):
+    monkeypatch.setattr(discovery, "device_set_key", lambda: None)
+    discovery.sniffer_ports()
+    assert not os.path.exists(discovery.port_cache_path())
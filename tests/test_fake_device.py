@@ -0,0 +1,49 @@
+import random
+from collections import Counter
+
+import pytest
+
+from nrf802154_sniffer.fake_device import MAX_FRAME_LENGTH, MIN_FRAME_LENGTH, FakeSnifferDevice
+from nrf802154_sniffer.fcs import fcs_valid
+
+
+def lengths(frame_sizes, count=2000):
+    rng = random.Random(0)
+    device = FakeSnifferDevice(frame_sizes=frame_sizes)
+    try:
+        return [device.frame_length(rng) for _ in range(count)]
+    finally:
+        device.close()
+
+
+def test_range_is_clamped():
+    sizes = lengths((0, 200))
+    assert min(sizes) == MIN_FRAME_LENGTH
+    assert max(sizes) == MAX_FRAME_LENGTH
+
+
+def test_table_draws_listed_lengths_by_weight():
+    counts = Counter(lengths({23: 6, 60: 3, 127: 1, 90: 0}))
+    assert set(counts) == {23, 60, 127}
+    assert counts[23] > counts[60] > counts[127]
+    assert counts[23] / 2000 == pytest.approx(0.6, abs=0.05)
+
+
+def test_sampler_is_clamped():
+    assert set(lengths(lambda rng: rng.choice([1, 50, 1000]))) == {MIN_FRAME_LENGTH, 50, MAX_FRAME_LENGTH}
+
+
+@pytest.mark.parametrize("table", [{}, {23: -1, 60: 2}, {23: 0, 60: 0}])
+def test_invalid_tables(table):
+    with pytest.raises(ValueError):
+        FakeSnifferDevice(frame_sizes=table)
+
+
+def test_frames_have_the_drawn_length_and_a_valid_fcs():
+    device = FakeSnifferDevice(frame_sizes={40: 1, 127: 1})
+    try:
+        frames = [device.frame(random.Random(seed), seed) for seed in range(20)]
+    finally:
+        device.close()
+    assert {len(frame) for frame in frames} == {40, 127}
+    assert all(fcs_valid(frame) for frame in frames)
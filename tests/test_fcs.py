@@ -0,0 +1,27 @@
+import pytest
+
+from nrf802154_sniffer import fcs
+
+
+def test_crc16_matches_the_kermit_check_value():
+    assert fcs.crc16(b"123456789") == 0x2189
+
+
+def test_fcs_is_sent_least_significant_byte_first():
+    payload = b"123456789"
+    assert fcs.fcs_valid(payload + b"\x89\x21")
+    assert not fcs.fcs_valid(payload + b"\x21\x89")
+
+
+@pytest.mark.parametrize("frame", [b"", b"\x00", b"123456789\x89\x20", b"023456789\x89\x21"])
+def test_invalid_frames(frame):
+    assert not fcs.fcs_valid(frame)
+
+
+def test_check_frames_agrees_with_fcs_valid():
+    payloads = [bytes(range(n)) for n in range(0, 40, 3)]
+    frames = [p + fcs.crc16(p).to_bytes(2, "little") for p in payloads]
+    frames += [f[:-1] + b"\x00" for f in frames if f[-1]]
+    frames += [b"", b"\x01"]
+    assert fcs.check_frames(frames) == [fcs.fcs_valid(f) for f in frames]
+    assert fcs.check_frames(frames)[:len(payloads)] == [True] * len(payloads)
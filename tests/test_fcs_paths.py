@@ -0,0 +1,131 @@
+import struct
+
+import pytest
+
+from nrf802154_sniffer import fcs
+from nrf802154_sniffer import nrf802154_sniffer as sniffer_module
+from nrf802154_sniffer.archive import ArchiveReader, ArchiveWriter
+from nrf802154_sniffer.daemon import DeviceStream
+from nrf802154_sniffer.nrf802154_sniffer import CapturedPacket, DLT, ExitEvent, Nrf802154Sniffer
+
+HEADER = bytes.fromhex("41881a621affff0100")
+
+
+def with_fcs(payload):
+    crc = fcs.crc16(payload)
+    return payload + struct.pack("<H", crc)
+
+
+GOOD = with_fcs(HEADER + b"\x01\x02")
+BAD = GOOD[:-1] + bytes([GOOD[-1] ^ 0xFF])
+
+
+def line(frame, timestamp=1000):
+    return b"received: %s power: -42 lqi: 200 time: %d\r\n" % (frame.hex().encode(), timestamp)
+
+
+def pcap_records(data):
+    offset = 24
+    records = []
+    while offset < len(data):
+        _, _, length, _ = struct.unpack_from("<LLLL", data, offset)
+        offset += 16
+        records.append(data[offset:offset + length])
+        offset += length
+    return records
+
+
+class FakeSerial:
+    lines = []
+
+    def __init__(self, port, **kwargs):
+        self.lines = list(self.lines)
+
+    def readline(self):
+        if not self.lines:
+            raise OSError("disconnected")
+        return self.lines.pop(0)
+
+
+class StopQueue(list):
+    def put(self, item):
+        if isinstance(item, ExitEvent):
+            raise EOFError
+        self.append(item)
+
+
+@pytest.mark.parametrize("keep_fcs", [False, True])
+def test_serial_reader_honours_the_fcs_choice(monkeypatch, keep_fcs):
+    monkeypatch.setattr(sniffer_module, "Serial", FakeSerial)
+    monkeypatch.setattr(FakeSerial, "lines", [line(GOOD), b"uart:~$\r\n", line(BAD)])
+    queue = StopQueue()
+    errors = [0]
+    with pytest.raises(EOFError):
+        Nrf802154Sniffer.serial_reader("/dev/null", queue, None, fcs.FLAG, keep_fcs, errors)
+    assert errors == [1]
+    frames = [p.content for p in queue]
+    assert frames == ([GOOD, BAD] if keep_fcs else [GOOD[:-2], BAD[:-2]])
+
+
+def test_serial_reader_drops_bad_frames(monkeypatch):
+    monkeypatch.setattr(sniffer_module, "Serial", FakeSerial)
+    monkeypatch.setattr(FakeSerial, "lines", [line(GOOD), line(BAD)])
+    queue = StopQueue()
+    with pytest.raises(EOFError):
+        Nrf802154Sniffer.serial_reader("/dev/null", queue, None, fcs.DROP, False, [0])
+    assert [p.content for p in queue] == [GOOD[:-2]]
+
+
+@pytest.mark.parametrize(
+    "metadata, policy, keep_fcs",
+    [
+        (None, fcs.FLAG, False),
+        ("ieee802154-fcs", fcs.PASS, True),
+        ("ieee802154-tap", fcs.PASS, False),
+        ("ieee802154-tap", fcs.FLAG, True),
+    ],
+)
+def test_frames_keep_their_fcs_whatever_the_reader(metadata, policy, keep_fcs):
+    for chunked in (False, True):
+        sniffer = Nrf802154Sniffer(fcs_policy=policy, chunked_reader=chunked)
+        sniffer.set_metadata(metadata)
+        assert sniffer.keep_fcs == keep_fcs
+
+
+def test_daemon_strips_the_fcs_only_for_clients_without_it():
+    stream = DeviceStream("/dev/null", 11)
+    packet = CapturedPacket(GOOD, 1000, 11, -42, 200)
+    assert pcap_records(b"\0" * 24 + stream.encode([packet], DLT.DLT_IEEE802_15_4_NOFCS)) == [GOOD[:-2]]
+    assert pcap_records(b"\0" * 24 + stream.encode([packet], DLT.DLT_IEEE802_15_4_WITHFCS)) == [GOOD]
+    tap = pcap_records(b"\0" * 24 + stream.encode([packet], DLT.DLT_IEEE802_15_4_TAP))[0]
+    assert tap.endswith(GOOD)
+    # The FCS TLV (type 0, 16-bit FCS) follows the TAP header.
+    assert tap[4:12] == struct.pack("<HHB3x", 0, 1, 1)
+
+
+def test_archive_keeps_the_fcs(tmp_path):
+    path = str(tmp_path / "capture.nrfa")
+    writer = ArchiveWriter(path, fcs=True)
+    writer.write_packet(GOOD, 11, -42, 200, 1000)
+    writer.write_packet(BAD, 11, -42, 200, 2000)
+    writer.close()
+
+    reader = ArchiveReader(path)
+    assert reader.has_fcs()
+    assert [p[4] for p in reader.packets(fcs=True)] == [GOOD, BAD]
+    assert [p[4] for p in reader.packets()] == [GOOD[:-2], BAD[:-2]]
+    # The addresses are indexed from the header, FCS or not.
+    assert [p[4] for p in reader.packets(pan=0x1A62, fcs=True)] == [GOOD, BAD]
+
+
+def test_archive_without_fcs_cannot_export_it(tmp_path):
+    path = str(tmp_path / "capture.nrfa")
+    writer = ArchiveWriter(path)
+    writer.write_packet(GOOD[:-2], 11, -42, 200, 1000)
+    writer.close()
+
+    reader = ArchiveReader(path)
+    assert not reader.has_fcs()
+    assert [p[4] for p in reader.packets()] == [GOOD[:-2]]
+    with pytest.raises(ValueError):
+        list(reader.packets(fcs=True))
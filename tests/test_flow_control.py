@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from nrf802154_sniffer.nrf802154_sniffer import FlowControl, Nrf802154Sniffer, SnifferConfig, SnifferPacket
+
+
+def packets(first, count, size=4):
+    return [SnifferPacket(bytes([first + i]) * size, first + i, 200, -40) for i in range(count)]
+
+
+def indexes(q):
+    batches = []
+    while not q.empty():
+        batches.append([p.timestamp for p in q.get_nowait().packets])
+    return batches
+
+
+def test_unbounded_by_default():
+    assert Nrf802154Sniffer().flow is None
+    assert SnifferConfig().overload_policy == FlowControl.BLOCK
+
+
+def test_drop_newest_discards_what_does_not_fit():
+    flow = FlowControl(max_frames=3, policy=FlowControl.DROP_NEWEST)
+    q = queue.Queue()
+    assert flow.send(q, packets(0, 5)) == 3
+    assert indexes(q) == [[0, 1, 2]]
+    assert flow.dropped.value == 2
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    flow = FlowControl(max_frames=3, policy=FlowControl.DROP_OLDEST)
+    q = queue.Queue()
+    sent = packets(0, 5)
+    assert flow.send(q, sent) == 3
+    assert indexes(q) == [[2, 3, 4]]
+    assert flow.dropped.value == 2
+
+    # Held back while the writer is behind, oldest first out.
+    assert flow.send(q, packets(5, 4)) == 0
+    assert [p.timestamp for p in flow.pending] == [6, 7, 8]
+    assert flow.dropped.value == 3
+
+    flow.release(sent[2:])
+    assert flow.send(q, []) == 3
+    assert indexes(q) == [[6, 7, 8]]
+
+
+def test_block_waits_for_the_writer():
+    flow = FlowControl(max_frames=2, policy=FlowControl.BLOCK)
+    q = queue.Queue()
+    sender = threading.Thread(target=flow.send, args=(q, packets(0, 5)), daemon=True)
+    sender.start()
+    time.sleep(0.2)
+    assert sender.is_alive()
+    batches = [q.get(timeout=1)]
+    assert [p.timestamp for p in batches[0].packets] == [0, 1]
+    assert q.empty()
+
+    while sum(len(batch.packets) for batch in batches) < 5:
+        flow.release(batches[-1].packets)
+        batches.append(q.get(timeout=1))
+    sender.join(1)
+    assert not sender.is_alive()
+    assert [p.timestamp for batch in batches for p in batch.packets] == [0, 1, 2, 3, 4]
+    assert flow.dropped.value == 0
+
+
+def test_byte_limit():
+    flow = FlowControl(max_bytes=10, policy=FlowControl.DROP_NEWEST)
+    q = queue.Queue()
+    assert flow.send(q, packets(0, 4, size=4)) == 2
+    assert flow.bytes.value == 8
+    assert flow.dropped.value == 2
+    flow.release(q.get_nowait().packets)
+    assert flow.bytes.value == 0
+
+    # A frame larger than the limit still goes through an empty buffer.
+    assert flow.send(q, packets(4, 1, size=16)) == 1
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="Unknown overload policy"):
+        FlowControl(max_frames=1, policy="drop-all")
@@ -0,0 +1,192 @@
+import time
+
+import pytest
+
+from nrf802154_sniffer.aio import AsyncNrf802154Sniffer
+from nrf802154_sniffer.capture_filter import CaptureFilterError
+from nrf802154_sniffer.hooks import CaptureHook, HookGroup, MetricsHook, PeriodicHook, SurveyHook, TalkersHook
+from nrf802154_sniffer.nrf802154_sniffer import Nrf802154Sniffer, PacketBatch, SnifferConfig, SnifferPacket
+
+
+class Writer:
+    def __init__(self):
+        self.flush_count = 0
+
+
+class Counter(PeriodicHook):
+    def __init__(self, interval=None):
+        super().__init__(interval)
+        self.published = 0
+
+    def publish(self):
+        self.published += 1
+
+
+def packets(count):
+    return [SnifferPacket(b"\x41\x88\x01\x34\x12\xff\xff\x01\x00", 1000 + i, 200, -40) for i in range(count)]
+
+
+def test_options_are_taken_as_config_or_keywords():
+    assert Nrf802154Sniffer(transport="shm").config == SnifferConfig(transport="shm")
+    config = SnifferConfig(transport="shm", batch_size=8)
+    sniffer = Nrf802154Sniffer(config=config, batch_size=16)
+    assert sniffer.config.transport == "shm"
+    assert sniffer.config.batch_size == 16
+    assert config.batch_size == 8
+    assert Nrf802154Sniffer(2.5).config.connection_open_timeout == 2.5
+
+
+def test_periodic_hooks_must_publish():
+    with pytest.raises(TypeError):
+        PeriodicHook()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"transport": "pipe"},
+        {"overload_policy": "drop-all"},
+        {"fcs_policy": "ignore"},
+    ],
+)
+def test_config_rejects_unknown_choices(options):
+    with pytest.raises(ValueError):
+        SnifferConfig(**options)
+
+
+def test_config_compiles_filters():
+    with pytest.raises(CaptureFilterError):
+        SnifferConfig(capture_filter="type data and")
+    with pytest.raises(CaptureFilterError):
+        SnifferConfig(triggers=["type beacon", "pan"])
+    assert SnifferConfig(capture_filter="").capture_filter is None
+
+
+def test_unknown_option():
+    with pytest.raises(TypeError):
+        Nrf802154Sniffer(surveys=True)
+
+
+def test_hooks_follow_the_config():
+    assert len(Nrf802154Sniffer().hooks) == 0
+    sniffer = Nrf802154Sniffer(metrics=True, talkers_file="talkers.json", survey_dwell=1.0)
+    assert [type(hook) for hook in sniffer.hooks.hooks] == [MetricsHook, TalkersHook, SurveyHook]
+    assert sniffer.metrics is not None and sniffer.talkers is not None and sniffer.survey is not None
+
+
+def test_multi_device_errors():
+    assert SnifferConfig(talkers=True, metrics=True, triggers=["type beacon"]).multi_device_errors() == []
+    assert SnifferConfig(survey_dwell=1.0, transport="shm").multi_device_errors() == [
+        "channel surveys",
+        "the shm transport",
+    ]
+    assert SnifferConfig(chunked_reader=False).multi_device_errors() == ["the line by line reader"]
+
+
+@pytest.mark.parametrize("options", [{"survey_dwell": 1.0}, {"transport": "shm"}, {"chunked_reader": False}])
+def test_multi_device_capture_rejects_single_device_options(monkeypatch, options):
+    monkeypatch.setattr(Nrf802154Sniffer, "configure_device", staticmethod(lambda dev, channel: pytest.fail()))
+    sniffer = Nrf802154Sniffer(**options)
+    with pytest.raises(ValueError, match="several devices"):
+        sniffer._start_multi(None, [("a", 11), ("b", 15)])
+    assert sniffer.processes == []
+
+
+@pytest.mark.parametrize("options", [{"transport": "shm"}, {"metrics_interval": 1.0}])
+def test_asyncio_engine_rejects_process_options(options):
+    with pytest.raises(ValueError, match="asyncio"):
+        AsyncNrf802154Sniffer(**options)
+
+
+def test_periodic_hook():
+    hook = Counter(0.05)
+    assert hook.timeout() is None
+    hook.start(None)
+    assert 0 < hook.timeout() <= 0.05
+    hook.poll(None)
+    assert hook.published == 0
+    time.sleep(0.06)
+    assert hook.timeout() == 0
+    hook.poll(None)
+    assert hook.published == 1
+    hook.stop()
+    assert hook.published == 2
+    assert hook.timeout() is None
+
+
+def test_periodic_hook_without_interval_publishes_on_stop():
+    hook = Counter()
+    hook.start(None)
+    assert hook.timeout() is None
+    hook.poll(None)
+    hook.stop()
+    assert hook.published == 1
+
+
+def test_hook_group():
+    first, second = Counter(10), Counter(0.01)
+    group = HookGroup([first, second, CaptureHook()])
+    assert group.timeout() is None
+    group.start(None)
+    assert group.timeout() <= 0.01
+    time.sleep(0.02)
+    group.poll(None)
+    assert (first.published, second.published) == (0, 1)
+    group.stop()
+    assert (first.published, second.published) == (1, 2)
+    assert HookGroup([]).timeout() is None
+
+
+def test_metrics_are_accounted_once_written_out():
+    sniffer = Nrf802154Sniffer(metrics=True)
+    hook = sniffer.hooks.hooks[0]
+    writer = Writer()
+    hook.start(writer)
+    hook.add(PacketBatch(packets(3)), 11)
+    hook.poll(writer)
+    assert sniffer.stats()["frames_written"] == 0
+    writer.flush_count += 1
+    hook.add(PacketBatch(packets(2)), 11)
+    hook.poll(writer)
+    assert sniffer.stats()["frames_written"] == 5
+    hook.add(PacketBatch(packets(4)), 11)
+    hook.stop()
+    assert sniffer.stats()["frames_written"] == 9
+
+
+def test_metrics_are_accounted_at_once_without_writer():
+    sniffer = Nrf802154Sniffer(metrics=True)
+    hook = sniffer.hooks.hooks[0]
+    hook.start(None)
+    hook.add(PacketBatch(packets(3)), 11)
+    hook.poll(None)
+    assert sniffer.stats()["frames_written"] == 3
+
+
+def test_talkers_hook(tmp_path):
+    path = tmp_path / "talkers.json"
+    sniffer = Nrf802154Sniffer(talkers_file=str(path))
+    sniffer.hooks.start(None)
+    sniffer.hooks.add(PacketBatch(packets(3)), 11)
+    sniffer.hooks.stop()
+    assert sniffer.talkers.snapshot()["sources"][0]["frames"] == 3
+    assert path.exists()
+
+
+def test_survey_hook_hops_and_ends_the_capture(tmp_path):
+    path = tmp_path / "survey.json"
+    sniffer = Nrf802154Sniffer(survey_dwell=0.01, survey_channels=[11, 12], survey_rounds=1, survey_file=str(path))
+    channels = []
+    sniffer.set_channel = lambda channel, source=0: channels.append(channel)
+    sniffer.hooks.start(None)
+    sniffer.hooks.add(PacketBatch(packets(2)), 11)
+    time.sleep(0.02)
+    sniffer.hooks.poll(None)
+    assert channels == [12]
+    assert sniffer.queue.empty()
+    time.sleep(0.02)
+    sniffer.hooks.poll(None)
+    assert channels == [12]
+    assert sniffer.queue.get(timeout=1).reason == ""
+    sniffer.hooks.stop()
+    assert path.exists()
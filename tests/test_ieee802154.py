@@ -0,0 +1,142 @@
+import pytest
+
+from nrf802154_sniffer.ieee802154 import (
+    FC_DST_ADDR_MODE_SHIFT,
+    FC_FRAME_VERSION_SHIFT,
+    FC_PAN_ID_COMPRESSION,
+    FC_SEQUENCE_NUMBER_SUPPRESSION,
+    FC_SRC_ADDR_MODE_SHIFT,
+    AddressMode,
+    FrameType,
+    MacHeader,
+    decode_addressing,
+)
+
+NONE, SHORT, EXTENDED = AddressMode.NONE, AddressMode.SHORT, AddressMode.EXTENDED
+DST_PAN, SRC_PAN = 0x1A62, 0xBEEF
+ADDRESSES = {SHORT: 0x1234, EXTENDED: 0x0011223344556677}
+
+
+def build(version, dst_mode, src_mode, compression, dst_pan, src_pan, suppress_sequence=False):
+    """
+    Builds a data frame with the fields the test expects to be present.
+    """
+    fc = FrameType.DATA | version << FC_FRAME_VERSION_SHIFT
+    fc |= dst_mode << FC_DST_ADDR_MODE_SHIFT | src_mode << FC_SRC_ADDR_MODE_SHIFT
+    if compression:
+        fc |= FC_PAN_ID_COMPRESSION
+    if suppress_sequence:
+        fc |= FC_SEQUENCE_NUMBER_SUPPRESSION
+    frame = fc.to_bytes(2, "little")
+    if not suppress_sequence:
+        frame += b"\x2a"
+    if dst_pan:
+        frame += DST_PAN.to_bytes(2, "little")
+    if dst_mode:
+        frame += ADDRESSES[dst_mode].to_bytes(2 if dst_mode == SHORT else 8, "little")
+    if src_pan:
+        frame += SRC_PAN.to_bytes(2, "little")
+    if src_mode:
+        frame += ADDRESSES[src_mode].to_bytes(2 if src_mode == SHORT else 8, "little")
+    return frame + b"payload"
+
+
+# (frame version, dst mode, src mode, PAN ID compression,
+#  destination PAN ID present, source PAN ID present)
+CASES = [
+    # IEEE 802.15.4-2003 and -2006: the source PAN ID is left out when
+    # compressed and both addresses are present.
+    *[
+        (version, dst, src, compression, bool(dst), bool(src) and not (compression and dst))
+        for version in (0, 1)
+        for dst in (NONE, SHORT, EXTENDED)
+        for src in (NONE, SHORT, EXTENDED)
+        for compression in (False, True)
+    ],
+    # IEEE 802.15.4-2015, table 7-2.
+    (2, NONE, NONE, False, False, False),
+    (2, NONE, NONE, True, True, False),
+    (2, SHORT, NONE, False, True, False),
+    (2, EXTENDED, NONE, True, False, False),
+    (2, NONE, SHORT, False, False, True),
+    (2, NONE, EXTENDED, True, False, False),
+    (2, EXTENDED, EXTENDED, False, True, False),
+    (2, EXTENDED, EXTENDED, True, False, False),
+    (2, SHORT, SHORT, False, True, True),
+    (2, SHORT, EXTENDED, True, True, False),
+    (2, EXTENDED, SHORT, False, True, True),
+    (2, SHORT, SHORT, True, True, False),
+]
+
+
+def expected(dst_mode, src_mode, dst_pan, src_pan):
+    dst_pan_value = DST_PAN if dst_pan else None
+    if src_pan:
+        src_pan_value = SRC_PAN
+    else:
+        src_pan_value = dst_pan_value if src_mode else None
+    return (
+        dst_pan_value,
+        dst_mode or None,
+        ADDRESSES.get(dst_mode),
+        src_pan_value,
+        src_mode or None,
+        ADDRESSES.get(src_mode),
+    )
+
+
+@pytest.mark.parametrize("version, dst_mode, src_mode, compression, dst_pan, src_pan", CASES)
+def test_addressing_follows_the_compression_rules(version, dst_mode, src_mode, compression, dst_pan, src_pan):
+    frame = build(version, dst_mode, src_mode, compression, dst_pan, src_pan)
+    fields = expected(dst_mode, src_mode, dst_pan, src_pan)
+    assert decode_addressing(frame) == fields
+
+    header = MacHeader(memoryview(frame))
+    assert header.frame_version == version
+    assert header.sequence_number == 0x2A
+    assert (header.dst_pan, header.dst_addr, header.src_pan, header.src_addr) == (
+        fields[0], fields[2], fields[3], fields[5]
+    )
+    assert header.addressing() == (fields[0], fields[2], fields[3], fields[5])
+
+
+def test_sequence_number_suppression_is_a_2015_feature():
+    frame = build(2, SHORT, SHORT, True, True, False, suppress_sequence=True)
+    assert MacHeader(frame).sequence_number is None
+    assert decode_addressing(frame) == (DST_PAN, SHORT, 0x1234, DST_PAN, SHORT, 0x1234)
+
+    # Older versions have no such bit: the byte is still a sequence number.
+    fc = FrameType.DATA | FC_SEQUENCE_NUMBER_SUPPRESSION | SHORT << FC_DST_ADDR_MODE_SHIFT
+    frame = fc.to_bytes(2, "little") + b"\x07" + DST_PAN.to_bytes(2, "little") + b"\x34\x12"
+    assert MacHeader(frame).sequence_number == 7
+    assert decode_addressing(frame) == (DST_PAN, SHORT, 0x1234, None, None, None)
+
+
+@pytest.mark.parametrize("version, dst_mode, src_mode, compression, dst_pan, src_pan", CASES[::5])
+def test_truncated_frames_are_not_decoded(version, dst_mode, src_mode, compression, dst_pan, src_pan):
+    frame = build(version, dst_mode, src_mode, compression, dst_pan, src_pan)[:-len(b"payload")]
+    assert decode_addressing(frame) is not None
+    for length in range(len(frame)):
+        assert decode_addressing(frame[:length]) is None
+        header = MacHeader(frame[:length])
+        assert header.addressing() == (None, None, None, None)
+        assert header.sequence_number is None
+
+
+@pytest.mark.parametrize(
+    "fc",
+    [
+        FrameType.MULTIPURPOSE,
+        FrameType.FRAGMENT,
+        FrameType.EXTENDED,
+        # Reserved address mode.
+        FrameType.DATA | 1 << FC_DST_ADDR_MODE_SHIFT,
+        FrameType.DATA | 1 << FC_SRC_ADDR_MODE_SHIFT,
+    ],
+)
+def test_unsupported_formats_are_not_decoded(fc):
+    frame = fc.to_bytes(2, "little") + bytes(30)
+    assert decode_addressing(frame) is None
+    header = MacHeader(frame)
+    assert header.fc == fc
+    assert header.offsets() is MacHeader.UNDECODED
@@ -0,0 +1,119 @@
+import pytest
+
+from nrf802154_sniffer import fcs
+from nrf802154_sniffer.nrf802154_sniffer import LineParser, SnifferPacket
+
+PAYLOAD = bytes.fromhex("41881a621affff0100aabb")
+FRAME = PAYLOAD + fcs.crc16(PAYLOAD).to_bytes(2, "little")
+BAD_FRAME = FRAME[:-1] + bytes([FRAME[-1] ^ 1])
+
+
+def line(frame=FRAME, rssi=-42, lqi=200, timestamp=123456789):
+    return b"received: %s power: %d lqi: %d time: %d" % (frame.hex().encode(), rssi, lqi, timestamp)
+
+
+def test_parses_a_line_and_strips_the_fcs():
+    assert LineParser.parse_line(line()) == SnifferPacket(PAYLOAD, 123456789, 200, -42)
+
+
+def test_keeps_the_fcs_on_request():
+    result = LineParser.parse_lines([line()], keep_fcs=True)
+    assert [p.content for p in result.packets] == [FRAME]
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        line(),
+        line() + b"\r",
+        b"uart:~$ " + line(),
+        memoryview(line()),
+        bytearray(line()),
+        # Payload with a space left in by a garbled line ending.
+        line().replace(b"received: ", b"received:  "),
+    ],
+)
+def test_accepts_the_forms_lines_come_in(value):
+    assert LineParser.parse_line(value) == SnifferPacket(PAYLOAD, 123456789, 200, -42)
+
+
+def test_rssi_and_lqi_cover_their_whole_range():
+    packets = LineParser.parse_lines([line(rssi=-128, lqi=255), line(rssi=0, lqi=0)]).packets
+    assert [(p.rssi, p.lqi) for p in packets] == [(-128, 255), (0, 0)]
+
+
+def test_counts_ignored_and_malformed_lines():
+    lines = [
+        line(),
+        b"",
+        b"uart:~$",
+        b"received: 4188zz power: -42 lqi: 200 time: 1",
+        b"received: 4188 power: -42 lqi: 200",
+        b"received: 4188 power: -42 lqi: 999 time: 1",
+        b"received: 4188 power: -42 lq: 200 time: 1",
+        b"received: 4188 power: -42 lqi: 200 time: x",
+        line(timestamp=1),
+    ]
+    result = LineParser.parse_lines(lines)
+    assert [p.timestamp for p in result.packets] == [123456789, 1]
+    assert result.ignored == 2
+    assert result.malformed == 5
+    assert result.bad_fcs == 0
+
+
+def test_fcs_is_not_checked_by_default():
+    result = LineParser.parse_lines([line(BAD_FRAME)])
+    assert len(result.packets) == 1
+    assert result.bad_fcs == 0
+
+
+def test_flag_policy_counts_bad_frames():
+    result = LineParser.parse_lines([line(), line(BAD_FRAME), line(b"\x41")], fcs.FLAG, keep_fcs=True)
+    assert [p.content for p in result.packets] == [FRAME, BAD_FRAME, b"\x41"]
+    assert result.bad_fcs == 2
+
+
+def test_drop_policy_leaves_bad_frames_out():
+    result = LineParser.parse_lines([line(), line(BAD_FRAME)], fcs.DROP)
+    assert [p.content for p in result.packets] == [PAYLOAD]
+    assert result.bad_fcs == 1
+
+
+def batch(count=LineParser.BATCH_MIN_LINES, **kwargs):
+    return [line(timestamp=i, **kwargs) + b"\r" for i in range(count)]
+
+
+@pytest.mark.parametrize("policy", fcs.POLICIES)
+@pytest.mark.parametrize("keep_fcs", [False, True])
+def test_batches_parse_like_single_lines(policy, keep_fcs):
+    lines = batch()
+    lines[3] = line(BAD_FRAME, timestamp=3)
+    lines[7] = line(b"\x01", timestamp=7)
+    lines[9] = memoryview(lines[9])
+    expected = [LineParser.parse_lines([value], policy, keep_fcs) for value in lines]
+    result = LineParser.parse_lines(lines, policy, keep_fcs)
+    assert result.packets == [p for r in expected for p in r.packets]
+    assert result.bad_fcs == sum(r.bad_fcs for r in expected) == (0 if policy == fcs.PASS else 2)
+
+
+@pytest.mark.parametrize(
+    "odd",
+    [
+        b"uart:~$ ",
+        b"",
+        b"uart:~$ " + line(),
+        line().replace(b"received: ", b"received:  "),
+        line().replace(b"lqi:", b"LQI:"),
+        line(rssi=-500),
+        line()[:-1] + b"x",
+        line()[:20] + line()[21:],
+    ],
+)
+def test_batches_with_an_odd_line_are_parsed_line_by_line(odd):
+    lines = batch()
+    lines[5] = odd
+    expected = [LineParser.parse_lines([value]) for value in lines]
+    result = LineParser.parse_lines(lines)
+    assert result.packets == [p for r in expected for p in r.packets]
+    assert result.malformed == sum(r.malformed for r in expected)
+    assert result.ignored == sum(r.ignored for r in expected)
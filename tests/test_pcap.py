@@ -0,0 +1,99 @@
+import io
+import struct
+
+from nrf802154_sniffer.nrf802154_sniffer import DLT, Nrf802154Sniffer, PcapWriter, pcap_header
+
+FRAME = bytes.fromhex("41881a621affff0100aabb")
+TIMESTAMP = 1_700_000_000_123_456
+
+
+class ShortWrites(io.BytesIO):
+    """
+    File taking at most 7 bytes per write, like a pipe near full.
+    """
+
+    def write(self, data):
+        return super().write(bytes(data[:7]))
+
+
+def test_pcap_header():
+    sniffer = Nrf802154Sniffer()
+    sniffer.dlt = DLT.DLT_IEEE802_15_4_TAP
+    assert bytes(sniffer.pcap_header()) == struct.pack("<LHHIILL", 0xA1B2C3D4, 2, 4, 0, 0, 255, 283)
+    assert pcap_header(DLT.DLT_IEEE802_15_4_NOFCS) == struct.pack("<LHHIILL", 0xA1B2C3D4, 2, 4, 0, 0, 255, 230)
+
+
+def test_nofcs_record():
+    out = io.BytesIO()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_NOFCS)
+    writer.write_packet(FRAME, 11, -42, 200, TIMESTAMP)
+    assert out.getvalue() == b""
+    writer.flush()
+    assert out.getvalue() == struct.pack("<LLLL", 1_700_000_000, 123_456, len(FRAME), len(FRAME)) + FRAME
+
+
+def test_withfcs_record_keeps_the_frame_as_is():
+    out = io.BytesIO()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_WITHFCS, fcs=True)
+    writer.write_packet(FRAME + b"\x12\x34", 11, -42, 200, TIMESTAMP)
+    writer.flush()
+    assert out.getvalue()[16:] == FRAME + b"\x12\x34"
+
+
+def test_tap_record():
+    out = io.BytesIO()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_TAP)
+    writer.write_packet(FRAME, 26, -42, 200, TIMESTAMP)
+    writer.flush()
+    data = out.getvalue()
+    tlvs = struct.pack("<HH" "HHf" "HHHBx" "HHB3x", 0, 28, 1, 4, -42.0, 3, 3, 26, 0, 10, 1, 200)
+    assert data == struct.pack("<LLLL", 1_700_000_000, 123_456, 28 + len(FRAME), 28 + len(FRAME)) + tlvs + FRAME
+
+
+def test_frames_are_truncated_to_the_phy_maximum():
+    out = io.BytesIO()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_NOFCS)
+    writer.write_packet(bytes(200), 11, -42, 200, TIMESTAMP)
+    writer.flush()
+    assert struct.unpack_from("<LL", out.getvalue(), 8) == (127, 127)
+    assert len(out.getvalue()) == 16 + 127
+
+
+def test_flushes_once_max_bytes_are_buffered():
+    out = io.BytesIO()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_NOFCS, max_bytes=100)
+    record = 16 + len(FRAME)
+    for _ in range(100 // record):
+        writer.write_packet(FRAME, 11, -42, 200, TIMESTAMP)
+    assert out.getvalue() == b""
+    writer.write_packet(FRAME, 11, -42, 200, TIMESTAMP)
+    assert len(out.getvalue()) == (100 // record + 1) * record
+    assert writer.flush_count == 1
+    assert writer.timeout() is None
+
+
+def test_poll_flushes_after_max_delay():
+    out = io.BytesIO()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_NOFCS, max_delay=0)
+    assert writer.timeout() is None
+    writer.write_packet(FRAME, 11, -42, 200, TIMESTAMP)
+    assert writer.timeout() == 0
+    writer.poll()
+    assert len(out.getvalue()) == 16 + len(FRAME)
+    assert writer.timeout() is None
+
+
+def test_short_writes_are_completed():
+    out = ShortWrites()
+    writer = PcapWriter(out, DLT.DLT_IEEE802_15_4_NOFCS)
+    for i in range(3):
+        writer.write_packet(FRAME, 11, -42, 200, TIMESTAMP + i)
+    writer.flush()
+    assert len(out.getvalue()) == 3 * (16 + len(FRAME))
+    assert struct.unpack_from("<L", out.getvalue(), 2 * (16 + len(FRAME)) + 4)[0] == 123_458
+
+
+def test_pcap_packet_without_tap():
+    assert Nrf802154Sniffer.pcap_packet(FRAME, DLT.DLT_IEEE802_15_4_NOFCS, 11, -42, 200, TIMESTAMP) == (
+        struct.pack("<LLLL", 1_700_000_000, 123_456, len(FRAME), len(FRAME)) + FRAME
+    )
@@ -0,0 +1,132 @@
+import io
+import os
+import struct
+
+import pytest
+
+from nrf802154_sniffer import tap
+from nrf802154_sniffer.nrf802154_sniffer import DLT, Nrf802154Sniffer, PcapWriter
+from nrf802154_sniffer.pcapng import PcapngWriter, RotatingRecorder
+
+FRAME = bytes.fromhex("41881a621affff0100aabb")
+TIMESTAMP = 1_700_000_000_123_456
+
+
+def epb_data(data):
+    """
+    Returns the packet data of the enhanced packet blocks of a pcapng stream.
+    """
+    offset = 0
+    packets = []
+    while offset < len(data):
+        block_type, length = struct.unpack_from("<II", data, offset)
+        if block_type == 6:
+            caplength = struct.unpack_from("<I", data, offset + 20)[0]
+            packets.append(data[offset + 28:offset + 28 + caplength])
+        offset += length
+    return packets
+
+
+@pytest.mark.parametrize("fcs", [False, True])
+def test_pcap_and_pcapng_share_the_tap_tlvs(fcs):
+    pcap = io.BytesIO()
+    writer = PcapWriter(pcap, DLT.DLT_IEEE802_15_4_TAP, fcs=fcs)
+    writer.write_packet(FRAME, 25, -61, 180, TIMESTAMP)
+    writer.flush()
+    pcapng = io.BytesIO()
+    writer = PcapngWriter(pcapng, DLT.DLT_IEEE802_15_4_TAP, fcs=fcs)
+    writer.write_packet(FRAME, 25, -61, 180, TIMESTAMP)
+    writer.flush()
+
+    record = pcap.getvalue()[16:]
+    assert epb_data(pcapng.getvalue()) == [record]
+    tlvs = b"\x01\x00\x04\x00" + struct.pack("<f", -61) + b"\x03\x00\x03\x00\x19\x00\x00\x00\x0a\x00\x01\x00\xb4\x00\x00\x00"
+    if fcs:
+        tlvs = b"\x00\x00\x01\x00\x01\x00\x00\x00" + tlvs
+    assert record == struct.pack("<HH", 0, 4 + len(tlvs)) + tlvs + FRAME
+    assert len(record) - len(FRAME) == (tap.FCS_TLV_LENGTH if fcs else tap.TLV_LENGTH)
+
+
+def test_pcap_packet_matches_the_writer():
+    pcap = io.BytesIO()
+    writer = PcapWriter(pcap, DLT.DLT_IEEE802_15_4_TAP)
+    writer.write_packet(FRAME, 25, -61, 180, TIMESTAMP)
+    writer.flush()
+    assert Nrf802154Sniffer.pcap_packet(FRAME, DLT.DLT_IEEE802_15_4_TAP, 25, -61, 180, TIMESTAMP) == pcap.getvalue()
+
+
+def test_rotated_files_are_ordered_by_number(tmp_path):
+    for index in (99998, 99999, 100000, 100001):
+        (tmp_path / ("nrf802154_%05d_20240501100000.pcapng" % index)).write_bytes(b"")
+    # Not files of this recorder.
+    (tmp_path / "nrf802154_other_00001_20240501100000.pcapng").write_bytes(b"")
+
+    recorder = RotatingRecorder(str(tmp_path), DLT.DLT_IEEE802_15_4_NOFCS, max_files=3)
+    recorder.close()
+    names = sorted(os.listdir(tmp_path))
+    assert [n for n in names if not n.startswith("nrf802154_other")] == [
+        "nrf802154_100000_20240501100000.pcapng",
+        "nrf802154_100001_20240501100000.pcapng",
+        os.path.basename(recorder.path),
+    ]
+    assert os.path.basename(recorder.path).startswith("nrf802154_100002_")
+    assert "nrf802154_other_00001_20240501100000.pcapng" in names
+
+
+def blocks(data):
+    offset = 0
+    result = []
+    while offset < len(data):
+        block_type, length = struct.unpack_from("<II", data, offset)
+        assert struct.unpack_from("<I", data, offset + length - 4)[0] == length
+        assert length % 4 == 0
+        result.append((block_type, data[offset + 8:offset + length - 4]))
+        offset += length
+    assert offset == len(data)
+    return result
+
+
+def test_pcapng_section_and_interfaces():
+    out = io.BytesIO()
+    writer = PcapngWriter(out, DLT.DLT_IEEE802_15_4_NOFCS, interfaces=[(15, "Zigbee")])
+    writer.write_packet(FRAME, 15, -61, 180, TIMESTAMP)
+    writer.write_packet(FRAME, 20, -61, 180, TIMESTAMP + 1)
+    writer.write_packet(FRAME, 15, -61, 180, TIMESTAMP + 2)
+    writer.flush()
+
+    result = blocks(out.getvalue())
+    assert [block_type for block_type, _ in result] == [0x0A0D0D0A, 1, 6, 1, 6, 6]
+    magic, major, minor, section_length = struct.unpack_from("<IHHq", result[0][1])
+    assert (magic, major, minor, section_length) == (0x1A2B3C4D, 1, 0, -1)
+
+    # Link type, then the name, description and microsecond resolution.
+    first, second = result[1][1], result[3][1]
+    assert struct.unpack_from("<HHI", first) == (DLT.DLT_IEEE802_15_4_NOFCS, 0, 0)
+    assert b"nrf802154-ch15" in first and b"Zigbee" in first
+    assert b"nrf802154-ch20" in second and b"IEEE 802.15.4 channel 20" in second
+    assert b"\x09\x00\x01\x00\x06" in first
+
+    packets = [body for block_type, body in result if block_type == 6]
+    assert [struct.unpack_from("<I", body)[0] for body in packets] == [0, 1, 0]
+
+
+def test_pcapng_enhanced_packet_block():
+    out = io.BytesIO()
+    writer = PcapngWriter(out, DLT.DLT_IEEE802_15_4_NOFCS)
+    writer.write_packet(FRAME, 11, -61, 180, TIMESTAMP)
+    writer.flush()
+    body = blocks(out.getvalue())[-1][1]
+    interface, high, low, caplength, length = struct.unpack_from("<IIIII", body)
+    assert (interface, high << 32 | low, caplength, length) == (0, TIMESTAMP, len(FRAME), len(FRAME))
+    # Frame data is padded to 32 bits.
+    assert body[20:] == FRAME + bytes(-len(FRAME) % 4)
+
+
+def test_pcapng_flushes_once_max_bytes_are_buffered():
+    out = io.BytesIO()
+    writer = PcapngWriter(out, DLT.DLT_IEEE802_15_4_NOFCS, max_bytes=200)
+    flushed = writer.flush_count
+    while writer.flush_count == flushed:
+        writer.write_packet(FRAME, 11, -61, 180, TIMESTAMP)
+    assert len(out.getvalue()) >= 200
+    blocks(out.getvalue())
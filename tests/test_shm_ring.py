@@ -0,0 +1,43 @@
+import pytest
+
+from nrf802154_sniffer.nrf802154_sniffer import Nrf802154Sniffer, SnifferPacket
+from nrf802154_sniffer.shm_ring import SharedMemoryRing
+
+
+@pytest.fixture
+def ring():
+    ring = SharedMemoryRing.create(16)
+    yield ring
+    ring.close()
+
+
+def packets(first, count):
+    return [SnifferPacket(bytes([i]) * (i % 127 + 1), 1000 + i, 200, -40) for i in range(first, first + count)]
+
+
+def test_slots_keep_the_host_receive_time(ring):
+    ring.put(b"\x41" * 127, 5, -90, 255, 26, host_time=1_700_000_000_000_001)
+    assert ring.put_packets(packets(0, 3), 11, 1_700_000_000_000_002) == 0
+    items = ring.get_batch(16, 0)
+    assert items[0] == (b"\x41" * 127, 5, 255, -90, 26, 1_700_000_000_000_001)
+    assert [item[5] for item in items[1:]] == [1_700_000_000_000_002] * 3
+    assert [item[0] for item in items[1:]] == [p.content for p in packets(0, 3)]
+
+
+def test_full_ring_counts_overruns(ring):
+    assert ring.put_packets(packets(0, 20), 11, 1) == 4
+    assert ring.overruns == 4
+    assert len(ring.get_batch(32, 0)) == 16
+
+
+def test_batches_carry_the_time_of_their_serial_read(ring):
+    sniffer = Nrf802154Sniffer(transport=Nrf802154Sniffer.TRANSPORT_SHM)
+    sniffer.ring = ring
+    ring.put_packets(packets(0, 3), 11, 100)
+    ring.put_packets(packets(3, 2), 11, 200)
+    ring.put_packets(packets(5, 4), 12, 200)
+    ring.notify()
+
+    batches = [sniffer._receive(0) for _ in range(3)]
+    assert [(len(b.packets), b.channel, b.host_time) for b in batches] == [(3, 11, 100), (2, 11, 200), (4, 12, 200)]
+    assert [p.timestamp for b in batches for p in b.packets] == list(range(1000, 1009))
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from nrf802154_sniffer.nrf802154_sniffer import Nrf802154Sniffer, PacketBatch, SnifferPacket
+
+TRANSPORTS = [Nrf802154Sniffer.TRANSPORT_QUEUE, Nrf802154Sniffer.TRANSPORT_SHM]
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """
+    Starts streams without a device: nothing is configured and no reader
+    runs, so the test feeds the transport itself.
+    """
+    monkeypatch.setattr(Nrf802154Sniffer, "configure_device", staticmethod(lambda dev, channel: None))
+    monkeypatch.setattr(Nrf802154Sniffer, "append_process", lambda self, target, args, kwargs=None: None)
+    sniffers = []
+
+    def start(transport):
+        sniffer = Nrf802154Sniffer(transport=transport)
+        sniffer.start_stream("", 11)
+        sniffers.append(sniffer)
+        return sniffer
+
+    yield start
+    for sniffer in sniffers:
+        if not sniffer.stream_ended:
+            sniffer.stop_stream()
+
+
+def feed(sniffer, count):
+    packets = [SnifferPacket(b"\x41\x88%c" % i, 1000 + i, 200, -40) for i in range(count)]
+    if sniffer.ring is not None:
+        sniffer.ring.put_packets(packets, 11)
+        sniffer.ring.notify()
+    else:
+        sniffer.queue.put(PacketBatch(packets))
+
+
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_stop_while_get_batch_is_blocked(stream, transport):
+    sniffer = stream(transport)
+    ring = sniffer.ring
+    result = []
+    consumer = threading.Thread(target=lambda: result.append(sniffer.get_batch(16)))
+    consumer.start()
+    time.sleep(0.2)
+    assert consumer.is_alive()
+
+    started = time.monotonic()
+    sniffer.stop_stream()
+    consumer.join(1)
+    assert not consumer.is_alive()
+    assert time.monotonic() - started < 1
+    assert result == [[]]
+    assert sniffer.ring is None
+    if ring is not None:
+        assert ring.buf is None
+    assert sniffer.get_batch(16, 0) == []
+
+
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_stop_ends_aiter_packets(stream, transport):
+    sniffer = stream(transport)
+
+    async def consume():
+        received = []
+        loop = asyncio.get_running_loop()
+        async for packet in sniffer.aiter_packets(poll_interval=1):
+            received.append(packet.content)
+            if len(received) == 5:
+                # Stop from another thread while the executor call waits.
+                loop.call_later(0.2, threading.Thread(target=sniffer.stop_stream).start)
+        return received
+
+    feed(sniffer, 5)
+    received = asyncio.run(asyncio.wait_for(consume(), 5))
+    assert received == [b"\x41\x88%c" % i for i in range(5)]
+    assert sniffer.stream_ended
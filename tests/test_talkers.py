@@ -0,0 +1,52 @@
+import random
+from collections import Counter
+
+import pytest
+
+from nrf802154_sniffer.talkers import SpaceSaving
+
+
+def test_counts_exactly_below_capacity():
+    sketch = SpaceSaving(4)
+    for key, length, rssi in [("a", 10, -40), ("b", 20, -60), ("a", 30, -50)]:
+        sketch.add(key, length, rssi)
+    assert sketch.top() == [("a", 2, 0, 40, -45.0), ("b", 1, 0, 20, -60.0)]
+    assert len(sketch) == 2
+    assert sketch.total == 3
+
+
+def test_new_key_takes_the_place_of_the_smallest():
+    sketch = SpaceSaving(2)
+    for key in "aab":
+        sketch.add(key, 1, -50)
+    sketch.add("c", 5, -70)
+    top = {key: (count, error, length, rssi) for key, count, error, length, rssi in sketch.top()}
+    # c inherits the count of b, which becomes its error; bytes and RSSI
+    # only cover the frames of c itself.
+    assert top == {"a": (2, 0, 2, -50.0), "c": (2, 1, 5, -70.0)}
+
+
+def test_guarantees_on_a_skewed_stream():
+    rng = random.Random(7)
+    keys = [min(int(rng.paretovariate(1.1)), 5000) for _ in range(50000)]
+    exact = Counter(keys)
+    sketch = SpaceSaving(64)
+    for key in keys:
+        sketch.add(key, 1, 0)
+
+    assert len(sketch) == 64
+    bound = len(keys) / 64
+    reported = {key: (count, error) for key, count, error, _, _ in sketch.top()}
+    for key, (count, error) in reported.items():
+        # Counts are overestimated by at most their error.
+        assert count - error <= exact[key] <= count
+        assert error <= bound
+    # Every key seen more than total / capacity times is counted.
+    assert {key for key, count in exact.items() if count > bound} <= set(reported)
+    # The heavy hitters come out in order.
+    assert [key for key, *_ in sketch.top(3)] == [key for key, _ in exact.most_common(3)]
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        SpaceSaving(0)
@@ -0,0 +1,134 @@
+import os
+import random
+import struct
+from collections import deque
+
+import pytest
+
+from nrf802154_sniffer.nrf802154_sniffer import DLT, Nrf802154Sniffer, PcapWriter
+from nrf802154_sniffer.trigger import FrameRing, TriggerRecorder
+
+SECOND = 10**6
+START = 1_700_000_000 * SECOND
+
+
+def read_pcap(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 24
+    records = []
+    while offset < len(data):
+        seconds, microseconds, length, _ = struct.unpack_from("<LLLL", data, offset)
+        offset += 16
+        records.append((seconds * SECOND + microseconds, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+def test_ring_keeps_the_newest_frames_that_fit():
+    ring = FrameRing(4 * (FrameRing.HEADER.size + 127))
+    for i in range(10):
+        ring.append(bytes([i]) * 127, 11, -40, 200, i)
+    assert [r[4] for r in ring.records()] == [6, 7, 8, 9]
+    assert ring.evicted == 6
+
+
+def test_ring_drops_frames_older_than_max_age():
+    ring = FrameRing(64 * 1024, max_age=10)
+    for t in (0, 5, 12, 14, 30):
+        ring.append(b"x", 11, -40, 200, t)
+    assert [r[4] for r in ring.records()] == [30]
+    ring.append(b"y", 26, -90, 1, 35)
+    assert list(ring.records()) == [(b"x", 11, -40, 200, 30), (b"y", 26, -90, 1, 35)]
+
+
+def test_ring_matches_a_reference_through_wraps():
+    rng = random.Random(3)
+    capacity = 1000
+    ring = FrameRing(capacity)
+    reference = deque()
+    for t in range(5000):
+        frame = bytes([t % 256]) * rng.randint(0, 127)
+        ring.append(frame, t % 16 + 11, -t % 100, t % 256, t)
+        reference.append((frame, t % 16 + 11, -t % 100, t % 256, t))
+        if rng.random() < 0.01:
+            ring.clear()
+            reference.clear()
+        records = list(ring.records())
+        # The ring holds a suffix of the frames appended since it was cleared.
+        assert records == list(reference)[len(reference) - len(records):]
+        assert sum(FrameRing.HEADER.size + len(r[0]) for r in records) <= capacity
+
+
+def test_ring_must_hold_a_frame():
+    with pytest.raises(ValueError):
+        FrameRing(100)
+
+
+def recorder(tmp_path, incidents, **kwargs):
+    sniffer = Nrf802154Sniffer()
+    sniffer.dlt = DLT.DLT_IEEE802_15_4_NOFCS
+    options = dict(pre_seconds=2, post_seconds=3)
+    options.update(kwargs)
+    return TriggerRecorder(
+        str(tmp_path),
+        bytes(sniffer.pcap_header()),
+        PcapWriter,
+        DLT.DLT_IEEE802_15_4_NOFCS,
+        [("alarm", lambda content, rssi, lqi: content.startswith(b"!"))],
+        on_incident=incidents.append,
+        **options,
+    )
+
+
+def test_incident_holds_the_pre_and_post_trigger_windows(tmp_path):
+    incidents = []
+    writer = recorder(tmp_path, incidents)
+    for i in range(40):
+        writer.write_packet(b"!" if i == 20 else b"%d" % i, 11, -40, 200, START + i * SECOND // 2)
+    writer.close()
+
+    [incident] = incidents
+    assert incident["trigger"] == "alarm"
+    assert incident["time"] == START + 10 * SECOND
+    assert incident["start"] == START + 8 * SECOND
+    # Frames up to 2 s before and 3 s after the trigger, which are all
+    # written once the next frame shows the window is over.
+    records = read_pcap(incident["path"])
+    assert [t for t, _ in records] == [START + i * SECOND // 2 for i in range(16, 27)]
+    assert incident["frames"] == 11
+    assert records[4][1] == b"!"
+
+
+def test_overlapping_triggers_share_an_incident(tmp_path):
+    incidents = []
+    writer = recorder(tmp_path, incidents)
+    for i in range(60):
+        writer.write_packet(b"!" if i in (10, 14) else b"x", 11, -40, 200, START + i * SECOND // 2)
+    writer.write_packet(b"!", 11, -40, 200, START + 100 * SECOND)
+    writer.close()
+
+    assert [i["triggers"] for i in incidents] == [2, 1]
+    assert incidents[0]["end"] == START + 10 * SECOND
+    paths = sorted(p.name for p in tmp_path.iterdir())
+    assert [p.split("_")[1] for p in paths] == ["00000", "00001"]
+
+
+def test_poll_closes_an_incident_once_its_window_has_passed(tmp_path):
+    incidents = []
+    writer = recorder(tmp_path, incidents, post_seconds=0)
+    writer.write_packet(b"!", 11, -40, 200, START)
+    assert writer.timeout() == 0
+    writer.poll()
+    assert len(incidents) == 1
+    assert writer.timeout() is None
+
+
+def test_incidents_are_numbered_on_past_the_padding(tmp_path):
+    for name in ("trigger_99999_20240501100000.pcap", "trigger_100000_20240501100000.pcap", "trigger_x.pcap"):
+        (tmp_path / name).write_bytes(b"")
+    incidents = []
+    writer = recorder(tmp_path, incidents)
+    writer.write_packet(b"!", 11, -40, 200, START)
+    writer.close()
+    assert os.path.basename(incidents[0]["path"]).startswith("trigger_100001_")